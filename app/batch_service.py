@@ -0,0 +1,104 @@
+import asyncio
+import json
+import os
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict
+
+from fastapi import HTTPException
+from loguru import logger
+
+from .mlflow_utils import submit_log_on_mlflow
+from .models import BatchRequest, Request
+from .openai_scheduler import BATCH, request_priority
+from .prompt_service import (
+    enhance_prompt_data,
+    validate_users_data,
+    validation_error_detail,
+)
+
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "5000"))
+BATCH_DEFAULT_CONCURRENCY = int(os.getenv("BATCH_DEFAULT_CONCURRENCY", "8"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "32"))
+
+PayloadHandler = Callable[[Request, Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+def check_batch_size(batch: BatchRequest) -> None:
+    """
+    Rifiuta i batch oltre BATCH_MAX_SIZE prima di iniziare lo streaming
+    """
+    if len(batch.requests) > BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch troppo grande: massimo {BATCH_MAX_SIZE} richieste",
+        )
+
+
+def _item(index: int, request: Request, status: int, **fields: Any) -> str:
+    item = {"index": index, "user_id": request.user_id, "status": status, **fields}
+    return json.dumps(item, ensure_ascii=False, default=str) + "\n"
+
+
+async def run_batch(
+    batch: BatchRequest, handler: PayloadHandler, route: str
+) -> AsyncIterator[str]:
+    """
+    Esegue la pipeline di generazione su un batch di richieste.
+
+    Validazione (un solo round trip al database) e arricchimento vengono fatti
+    sull'intero insieme; le generazioni partono poi in parallelo, limitate da
+    un semaforo. Ogni risultato viene emesso come riga NDJSON appena pronto,
+    con lo status HTTP che avrebbe avuto la richiesta singola.
+
+    Args:
+        batch: Richieste da elaborare e concorrenza desiderata
+        handler: Funzione che genera il payload di risposta di una richiesta
+        route: Nome della route, usato per il logging degli errori
+
+    Yields:
+        Una riga JSON per richiesta, nell'ordine di completamento
+    """
+    concurrency = min(
+        batch.concurrency or BATCH_DEFAULT_CONCURRENCY, BATCH_MAX_CONCURRENCY
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+    # Le chiamate OpenAI del batch (estrazione e generazione) cedono il passo
+    # a quelle interattive; i task creati sotto ereditano la priorità
+    request_priority.set(BATCH)
+
+    logger.info(
+        f"[BATCH: {route}] Validazione di {len(batch.requests)} richieste "
+        f"(concorrenza {concurrency})"
+    )
+    validation_results = await validate_users_data(batch.requests)
+
+    async def run_one(index: int, request: Request, enhanced_data: Dict[str, Any]):
+        async with semaphore:
+            try:
+                payload = await handler(request, enhanced_data)
+                return _item(index, request, 200, result=payload)
+            except HTTPException as e:
+                return _item(index, request, e.status_code, error=e.detail)
+            except Exception as e:
+                logger.error(f"[USER: {request.user_id}] Errore nel batch: {e}")
+                await submit_log_on_mlflow(route, request, {"error": str(e)})
+                return _item(index, request, 500, error=str(e))
+
+    tasks = []
+    for index, (request, validation_result) in enumerate(
+        zip(batch.requests, validation_results)
+    ):
+        if not validation_result.is_valid:
+            yield _item(
+                index, request, 400, error=validation_error_detail(validation_result)
+            )
+            continue
+        enhanced_data = enhance_prompt_data(validation_result, request)
+        tasks.append(asyncio.create_task(run_one(index, request, enhanced_data)))
+
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Il client può chiudere lo stream prima della fine: niente lavoro orfano
+        for task in tasks:
+            task.cancel()
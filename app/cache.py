@@ -0,0 +1,75 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+# Sentinella per distinguere "non in cache" da una entry negativa (None)
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Cache in memoria con eviction LRU, scadenza (TTL) e contatori hit/miss.
+
+    Un valore None è una entry negativa valida (es. utente inesistente) e può
+    avere un TTL diverso, tipicamente più breve, rispetto alle entry positive.
+    """
+
+    def __init__(
+        self, maxsize: int, ttl: float, negative_ttl: Optional[float] = None
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Restituisce il valore in cache oppure MISSING se assente o scaduto
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return MISSING
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        ttl = self.negative_ttl if value is None else self.ttl
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        """
+        Svuota la cache (es. dopo un nuovo caricamento dei dati)
+        """
+        self._data.clear()
+        self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -1,27 +1,301 @@
 import os
-from typing import Any, Dict, Optional
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Iterable, Optional
 
-import psycopg2
+import psycopg
 from dotenv import load_dotenv
-from psycopg2.extras import RealDictCursor
+from loguru import logger
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from .cache import MISSING, TTLCache
+from .metrics import record_cache, stage
 
 load_dotenv()
 
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "600"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"))
+
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+PROFILE_CACHE_TTL_S = float(os.getenv("PROFILE_CACHE_TTL_S", "3600"))
+PROFILE_CACHE_NEGATIVE_TTL_S = float(os.getenv("PROFILE_CACHE_NEGATIVE_TTL_S", "60"))
+PROFILE_CACHE_VERSION_CHECK_S = float(os.getenv("PROFILE_CACHE_VERSION_CHECK_S", "5"))
+
+# Lettura per chiave primaria del profilo precalcolato dal loader
+USER_PROFILE_QUERY = """
+    SELECT user_id, year, region, travel_mode, travel_motive, trip_count, km_travelled
+    FROM user_profile
+    WHERE user_id = %s
+"""
+
+USERS_PROFILE_QUERY = """
+    SELECT user_id, year, region, travel_mode, travel_motive, trip_count, km_travelled
+    FROM user_profile
+    WHERE user_id = ANY(%s)
+"""
+
+# Aggregazione live su trips in un solo passaggio, usata se il profilo non è
+# ancora materializzato. mode() ignora i NULL (codici senza corrispondenza
+# nelle lookup) e a parità di frequenza restituisce il primo valore in ordine
+# alfabetico, come le vecchie subquery ORDER BY COUNT(*) DESC, nome.
+_AGGREGATE_QUERY = """
+    SELECT
+        t."UserId" AS user_id,
+        CASE
+            WHEN MIN(t."Periods") = MAX(t."Periods")
+            THEN MIN(t."Periods")::varchar
+            ELSE MIN(t."Periods")::varchar || '-' || MAX(t."Periods")::varchar
+        END AS year,
+        mode() WITHIN GROUP (ORDER BY r.region) AS region,
+        mode() WITHIN GROUP (ORDER BY tm.mode) AS travel_mode,
+        mode() WITHIN GROUP (ORDER BY tmot.motive) AS travel_motive,
+        SUM(t."Trip in a year")::int AS trip_count,
+        SUM(t."Km travelled in a year")::int AS km_travelled
+    FROM trips t
+    LEFT JOIN region r ON t."RegionCharacteristics" = r.id
+    LEFT JOIN travel_mode tm ON t."TravelModes" = tm.id
+    LEFT JOIN travel_motives tmot ON t."TravelMotives" = tmot.id
+    WHERE {condition}
+    GROUP BY t."UserId"
+"""
+
+USER_AGGREGATE_QUERY = _AGGREGATE_QUERY.format(condition='t."UserId" = %s')
+USERS_AGGREGATE_QUERY = _AGGREGATE_QUERY.format(condition='t."UserId" = ANY(%s)')
+
+USER_PROFILE_FALLBACK = os.getenv("USER_PROFILE_FALLBACK", "true").lower() == "true"
+
+# Marker incrementato dal loader a ogni caricamento dei dati
+DATA_VERSION_QUERY = "SELECT version FROM data_version WHERE id = 1"
+
+# Output generati offline per classe di profilo (dataset/pregenerate_outputs.py)
+PREGENERATED_OUTPUT_QUERY = """
+    SELECT kind, content, image
+    FROM pregenerated_output
+    WHERE cache_key = %s
+"""
+PREGENERATED_LOOKUP = os.getenv("PREGENERATED_LOOKUP", "true").lower() == "true"
+
+# Valori noti delle tabelle di lookup, usati dall'estrattore di info (i codici
+# registrati dal caricamento senza descrizione hanno il nome NULL)
+LOOKUP_VALUES_QUERIES = {
+    "region": "SELECT DISTINCT region FROM region WHERE region IS NOT NULL ORDER BY 1",
+    "travel_mode": (
+        "SELECT DISTINCT mode FROM travel_mode WHERE mode IS NOT NULL ORDER BY 1"
+    ),
+    "travel_motive": (
+        "SELECT DISTINCT motive FROM travel_motives WHERE motive IS NOT NULL ORDER BY 1"
+    ),
+}
+
+_pool: Optional[AsyncConnectionPool] = None
 
-def get_database_connection():
+profile_cache = TTLCache(
+    maxsize=PROFILE_CACHE_SIZE,
+    ttl=PROFILE_CACHE_TTL_S,
+    negative_ttl=PROFILE_CACHE_NEGATIVE_TTL_S,
+)
+_data_version: Optional[int] = None
+_data_version_checked_at = float("-inf")
+_lookup_values: Optional[Dict[str, list[str]]] = None
+
+
+def get_conninfo() -> str:
     """
-    Crea connessione al database PostgreSQL
+    Costruisce la stringa di connessione al database PostgreSQL
     """
-    return psycopg2.connect(
+    return make_conninfo(
         host=os.getenv("POSTGRES_HOST", "localhost"),
         port=os.getenv("PGPORT", "5433"),
-        database=os.getenv("POSTGRES_DB", "mir_db"),
+        dbname=os.getenv("POSTGRES_DB", "mir_db"),
         user=os.getenv("POSTGRES_USER", "mir_user"),
         password=os.getenv("POSTGRES_PASSWORD"),
     )
 
 
-def get_user_aggregated_data(user_id: str) -> Optional[Dict[str, Any]]:
+async def open_pool() -> AsyncConnectionPool:
+    """
+    Apre (una sola volta) il pool di connessioni condiviso dall'applicazione.
+
+    Le connessioni vengono verificate prima di ogni checkout e hanno uno
+    statement_timeout impostato lato server, così una query lenta non può
+    trattenere una connessione del pool indefinitamente.
+    """
+    global _pool
+    if _pool is None:
+        _pool = AsyncConnectionPool(
+            conninfo=get_conninfo(),
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            timeout=DB_POOL_TIMEOUT,
+            max_idle=DB_POOL_MAX_IDLE,
+            kwargs={"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"},
+            check=AsyncConnectionPool.check_connection,
+            name="mir-api",
+            open=False,
+        )
+        # Non blocca l'avvio se il database non è ancora raggiungibile
+        await _pool.open(wait=False)
+    return _pool
+
+
+async def close_pool() -> None:
+    """
+    Chiude il pool di connessioni, se aperto
+    """
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def get_pool_stats() -> Dict[str, int]:
+    """
+    Statistiche del pool: checkout (requests_num), attesa cumulativa
+    (requests_wait_ms), richieste in coda, connessioni aperte/perse, ecc.
+    """
+    if _pool is None:
+        return {}
+    return _pool.get_stats()
+
+
+@asynccontextmanager
+async def get_database_connection() -> AsyncIterator[psycopg.AsyncConnection]:
+    """
+    Prende in prestito una connessione dal pool e la restituisce all'uscita
+    """
+    pool = await open_pool()
+    async with pool.connection() as conn:
+        yield conn
+
+
+async def refresh_profile_cache_version() -> None:
+    """
+    Confronta (al massimo ogni PROFILE_CACHE_VERSION_CHECK_S secondi) il
+    marker data_version aggiornato dal loader e svuota la cache dei profili
+    se i dati sono stati ricaricati
+    """
+    global _data_version, _data_version_checked_at, _lookup_values
+
+    now = time.monotonic()
+    if now - _data_version_checked_at < PROFILE_CACHE_VERSION_CHECK_S:
+        return
+    _data_version_checked_at = now
+
+    try:
+        async with get_database_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(DATA_VERSION_QUERY, prepare=True)
+                row = await cur.fetchone()
+    except Exception as e:
+        logger.error(f"Errore nella lettura di data_version: {e}")
+        return
+
+    version = row[0] if row else None
+    if version != _data_version:
+        if _data_version is not None:
+            profile_cache.clear()
+            _lookup_values = None
+        _data_version = version
+
+
+async def get_lookup_values() -> Dict[str, list[str]]:
+    """
+    Restituisce i valori noti di region, travel_mode e travel_motive.
+
+    Le tabelle di lookup sono piccole e cambiano solo con un nuovo
+    caricamento dei dati: vengono lette una volta e ricaricate quando
+    cambia data_version. In caso di errore restituisce liste vuote.
+    """
+    global _lookup_values
+
+    await refresh_profile_cache_version()
+    if _lookup_values is not None:
+        return _lookup_values
+
+    try:
+        values: Dict[str, list[str]] = {}
+        async with get_database_connection() as conn:
+            async with conn.cursor() as cur:
+                for field, query in LOOKUP_VALUES_QUERIES.items():
+                    await cur.execute(query)
+                    values[field] = [row[0] for row in await cur.fetchall() if row[0]]
+    except Exception as e:
+        logger.error(f"Errore nella lettura delle tabelle di lookup: {e}")
+        return {field: [] for field in LOOKUP_VALUES_QUERIES}
+
+    _lookup_values = values
+    return values
+
+
+async def get_pregenerated_output(cache_key: str) -> Optional[Dict[str, Any]]:
+    """
+    Cerca un output pregenerato con la stessa chiave della cache delle
+    generazioni (modello, prompt e parametri). Restituisce None se assente,
+    se la ricerca è disabilitata o in caso di errore.
+    """
+    if not PREGENERATED_LOOKUP:
+        return None
+    try:
+        with stage("db_pregenerated"):
+            async with get_database_connection() as conn:
+                async with conn.cursor(row_factory=dict_row) as cur:
+                    await cur.execute(
+                        PREGENERATED_OUTPUT_QUERY, (cache_key,), prepare=True
+                    )
+                    return await cur.fetchone()
+    except Exception as e:
+        logger.error(f"Errore nella lettura degli output pregenerati: {e}")
+        return None
+
+
+def get_profile_cache_stats() -> Dict[str, Any]:
+    """
+    Statistiche della cache dei profili utente
+    """
+    return {**profile_cache.stats(), "data_version": _data_version}
+
+
+async def _fetch_users_aggregated_data(ids: list[int]) -> Dict[int, Dict[str, Any]]:
+    """
+    Legge dal database i profili degli utenti indicati, prima da user_profile
+    e poi con l'aggregazione live per quelli non ancora materializzati
+    """
+    results: Dict[int, Dict[str, Any]] = {}
+    async with get_database_connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            # Prepared statement lato server: la query viene pianificata
+            # una volta per connessione e poi solo rieseguita
+            with stage("db_profile"):
+                if len(ids) == 1:
+                    await cur.execute(USER_PROFILE_QUERY, (ids[0],), prepare=True)
+                else:
+                    await cur.execute(USERS_PROFILE_QUERY, (ids,), prepare=True)
+                for row in await cur.fetchall():
+                    results[row["user_id"]] = dict(row)
+
+            missing = [i for i in ids if i not in results]
+            if missing and USER_PROFILE_FALLBACK:
+                with stage("db_aggregate"):
+                    if len(missing) == 1:
+                        await cur.execute(
+                            USER_AGGREGATE_QUERY, (missing[0],), prepare=True
+                        )
+                    else:
+                        await cur.execute(
+                            USERS_AGGREGATE_QUERY, (missing,), prepare=True
+                        )
+                    for row in await cur.fetchall():
+                        results[row["user_id"]] = dict(row)
+
+    return results
+
+
+async def get_user_aggregated_data(user_id: str) -> Optional[Dict[str, Any]]:
     """
     Recupera le informazioni aggregate per un utente specifico dal database
 
@@ -32,60 +306,72 @@ def get_user_aggregated_data(user_id: str) -> Optional[Dict[str, Any]]:
         Dizionario con le informazioni aggregate o None se non trovate
     """
     try:
-        with get_database_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                # Query per recuperare i dati aggregati dell'utente (tutte le righe aggregate)
-                query = """
-                SELECT 
-                    t."UserId" as user_id,
-                    CASE 
-                        WHEN MIN(t."Periods"::int) = MAX(t."Periods"::int) 
-                        THEN MIN(t."Periods"::int)::varchar
-                        ELSE MIN(t."Periods"::int)::varchar || '-' || MAX(t."Periods"::int)::varchar
-                    END as year,
-                    (SELECT r2.region 
-                     FROM trips t2 
-                     LEFT JOIN region r2 ON t2."RegionCharacteristics" = r2.code 
-                     WHERE t2."UserId" = t."UserId" AND r2.region IS NOT NULL
-                     GROUP BY r2.region 
-                     ORDER BY COUNT(*) DESC, r2.region 
-                     LIMIT 1) as region,
-                    (SELECT tm2.mode 
-                     FROM trips t2 
-                     LEFT JOIN travel_mode tm2 ON t2."TravelModes" = tm2.code 
-                     WHERE t2."UserId" = t."UserId" AND tm2.mode IS NOT NULL
-                     GROUP BY tm2.mode 
-                     ORDER BY COUNT(*) DESC, tm2.mode 
-                     LIMIT 1) as travel_mode,
-                    (SELECT tmot2.motive 
-                     FROM trips t2 
-                     LEFT JOIN travel_motives tmot2 ON t2."TravelMotives" = tmot2.code 
-                     WHERE t2."UserId" = t."UserId" AND tmot2.motive IS NOT NULL
-                     GROUP BY tmot2.motive 
-                     ORDER BY COUNT(*) DESC, tmot2.motive 
-                     LIMIT 1) as travel_motive,
-                    SUM(t."Trip in a year")::int as trip_count,
-                    SUM(t."Km travelled in a year")::int as km_travelled
-                FROM trips t
-                LEFT JOIN region r ON t."RegionCharacteristics" = r.code
-                LEFT JOIN travel_mode tm ON t."TravelModes" = tm.code
-                LEFT JOIN travel_motives tmot ON t."TravelMotives" = tmot.code
-                WHERE t."UserId" = %s
-                GROUP BY t."UserId"
-                """
-
-                cur.execute(query, (int(user_id),))
-                result = cur.fetchone()
-
-                if result:
-                    return dict(result)
-                return None
+        uid = int(user_id)
+        await refresh_profile_cache_version()
+
+        cached = profile_cache.get(uid)
+        record_cache("profile", cached is not MISSING)
+        if cached is not MISSING:
+            # Copia: i chiamanti integrano il dizionario con i campi da info
+            return dict(cached) if cached is not None else None
+
+        result = (await _fetch_users_aggregated_data([uid])).get(uid)
+        # Anche l'assenza dell'utente viene messa in cache (entry negativa)
+        profile_cache.set(uid, result)
+        return dict(result) if result is not None else None
 
     except Exception as e:
-        print(f"Errore nel recupero dati aggregati: {e}")
+        logger.error(f"Errore nel recupero dati aggregati: {e}")
         return None
 
 
+async def get_users_aggregated_data(
+    user_ids: Iterable[str],
+) -> Dict[int, Dict[str, Any]]:
+    """
+    Recupera le informazioni aggregate di più utenti con un solo round trip
+    per sorgente (profili precalcolati, poi aggregazione live per i mancanti)
+
+    Args:
+        user_ids: ID degli utenti; gli ID non numerici vengono ignorati
+
+    Returns:
+        Dizionario user_id -> informazioni aggregate, solo per gli utenti trovati.
+        A differenza della variante singola, gli errori del database vengono propagati.
+    """
+    parsed = set()
+    for user_id in user_ids:
+        try:
+            parsed.add(int(user_id))
+        except (TypeError, ValueError):
+            continue
+    ids = sorted(parsed)
+    if not ids:
+        return {}
+
+    await refresh_profile_cache_version()
+
+    results: Dict[int, Dict[str, Any]] = {}
+    to_fetch = []
+    for uid in ids:
+        cached = profile_cache.get(uid)
+        record_cache("profile", cached is not MISSING)
+        if cached is MISSING:
+            to_fetch.append(uid)
+        elif cached is not None:
+            results[uid] = dict(cached)
+
+    if to_fetch:
+        fetched = await _fetch_users_aggregated_data(to_fetch)
+        for uid in to_fetch:
+            row = fetched.get(uid)
+            profile_cache.set(uid, row)
+            if row is not None:
+                results[uid] = dict(row)
+
+    return results
+
+
 def check_required_fields(data: Dict[str, Any]) -> list:
     """
     Controlla se tutti i campi richiesti sono presenti nei dati aggregati
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+GENERATION_CACHE_PATH = os.getenv(
+    "GENERATION_CACHE_PATH", os.path.join(".cache", "generation_cache.sqlite3")
+)
+GENERATION_CACHE_MAX_BYTES = int(
+    os.getenv("GENERATION_CACHE_MAX_BYTES", str(256 * 1024 * 1024))
+)
+
+
+def make_cache_key(model: str, prompt: str, params: Dict[str, Any]) -> str:
+    """
+    Chiave content-addressed: hash di modello, prompt renderizzato e parametri
+    """
+    payload = json.dumps(
+        {"model": model, "prompt": prompt, "params": params},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    """
+    Cache persistente su disco (SQLite) dei risultati di generazione.
+
+    Le entry meno usate di recente vengono eliminate quando la dimensione
+    totale supera max_bytes. La dimensione è tenuta in memoria e ricalcolata
+    sulla tabella solo quando supera il limite (altri processi possono
+    scrivere sullo stesso file). I metodi sono sincroni e thread-safe: dal codice
+    async vanno invocati con asyncio.to_thread.
+    """
+
+    def __init__(self, path: str, max_bytes: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._total_bytes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS generations (
+                    key TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    expires_at REAL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_generations_accessed_at "
+                "ON generations(accessed_at)"
+            )
+            self._total_bytes = self._table_bytes(conn)
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _table_bytes(conn: sqlite3.Connection) -> int:
+        return conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM generations"
+        ).fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Restituisce il valore in cache oppure None se assente o scaduto
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, expires_at, size FROM generations WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] < now):
+                if row is not None:
+                    conn.execute("DELETE FROM generations WHERE key = ?", (key,))
+                    conn.commit()
+                    self._total_bytes -= row[2]
+                self.misses += 1
+                return None
+
+            conn.execute(
+                "UPDATE generations SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(
+        self,
+        key: str,
+        kind: str,
+        model: str,
+        value: str,
+        ttl: Optional[float] = None,
+    ) -> None:
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        size = len(key) + len(value.encode("utf-8"))
+        with self._lock:
+            conn = self._connect()
+            previous = conn.execute(
+                "SELECT size FROM generations WHERE key = ?", (key,)
+            ).fetchone()
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO generations
+                    (key, kind, model, value, size, created_at, accessed_at, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (key, kind, model, value, size, now, now, expires_at),
+            )
+            self._total_bytes += size - (previous[0] if previous else 0)
+            self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        if self._total_bytes <= self.max_bytes:
+            return
+        # Il totale in memoria può divergere se altri processi usano il file
+        total = self._table_bytes(conn)
+        if total <= self.max_bytes:
+            self._total_bytes = total
+            return
+
+        # Libera fino al 90% del limite per non rientrare qui a ogni inserimento
+        target = int(self.max_bytes * 0.9)
+        rows = conn.execute(
+            "SELECT key, size FROM generations ORDER BY accessed_at"
+        ).fetchall()
+        for key, size in rows:
+            if total <= target:
+                break
+            conn.execute("DELETE FROM generations WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+        self._total_bytes = total
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            conn = self._connect()
+            entries, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM generations"
+            ).fetchone()
+        total = self.hits + self.misses
+        return {
+            "entries": entries,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+generation_cache = GenerationCache(GENERATION_CACHE_PATH, GENERATION_CACHE_MAX_BYTES)
@@ -1,101 +1,281 @@
+import asyncio
 import os
-from typing import Any, Dict
+from contextlib import AsyncExitStack
+from typing import AsyncIterator, Optional
 
-import openai
 from dotenv import load_dotenv
-from jinja2 import Environment, FileSystemLoader
+
+from .database import get_pregenerated_output
+from .generation_cache import generation_cache, make_cache_key
+from .http_client import outbound_http
+from .image_store import ImageWriter, image_store, is_digest
+from .metrics import record_cache, stage
+from .models import GenerationResult, RenderedPrompt
+from .openai_scheduler import (
+    OpenAIRateLimited,
+    estimate_tokens,
+    image_priority,
+    openai_scheduler,
+)
 
 load_dotenv()
 
-# Configura OpenAI client
-openai.api_key = os.getenv("OPENAI_API_KEY")
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+TEXT_SYSTEM_PROMPT = "Sei un esperto analista di mobilità specializzato nella creazione di profili utente dettagliati."
+
+IMAGE_PARAMS = {"size": "1024x1024", "quality": "standard", "n": 1}
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(20 * 1024 * 1024)))
+
+
+def text_generation_key(prompt_text: str) -> tuple[str, str]:
+    """
+    Modello e chiave di cache della generazione di un testo
+    """
+    model = os.getenv("DEFAULT_TEXT_MODEL", "gpt-5-nano")
+    return model, make_cache_key(model, prompt_text, {"system": TEXT_SYSTEM_PROMPT})
+
+
+def image_generation_key(prompt_text: str) -> tuple[str, str]:
+    """
+    Modello e chiave di cache della generazione di un'immagine
+    """
+    model = os.getenv("DEFAULT_IMAGE_MODEL", "dall-e-3")
+    return model, make_cache_key(model, prompt_text, IMAGE_PARAMS)
+
+
+async def _cached_text(model: str, cache_key: str) -> Optional[str]:
+    """
+    Testo dalla cache locale o, in alternativa, dagli output pregenerati
+    """
+    cached = await asyncio.to_thread(generation_cache.get, cache_key)
+    record_cache("generation_text", cached is not None)
+    if cached is not None:
+        return cached
+
+    pregenerated = await get_pregenerated_output(cache_key)
+    found = bool(
+        pregenerated and pregenerated["kind"] == "text" and pregenerated["content"]
+    )
+    record_cache("pregenerated_text", found)
+    if found:
+        text = pregenerated["content"]
+        await asyncio.to_thread(generation_cache.set, cache_key, "text", model, text)
+        return text
+    return None
+
+
+async def _cached_image(model: str, cache_key: str) -> Optional[str]:
+    """
+    Hash dell'immagine dalla cache locale o dagli output pregenerati; le
+    immagini pregenerate vengono copiate nell'image store al primo utilizzo
+    """
+    cached = await asyncio.to_thread(generation_cache.get, cache_key)
+    # Le entry precedenti all'image store contengono URL ormai scaduti
+    hit = (
+        cached is not None
+        and is_digest(cached)
+        and await asyncio.to_thread(image_store.exists, cached)
+    )
+    record_cache("generation_image", hit)
+    if hit:
+        return cached
 
-# Configura Jinja2
-template_dir = os.path.join(os.path.dirname(__file__), "templates")
-jinja_env = Environment(loader=FileSystemLoader(template_dir))
+    pregenerated = await get_pregenerated_output(cache_key)
+    found = bool(
+        pregenerated and pregenerated["kind"] == "image" and pregenerated["image"]
+    )
+    record_cache("pregenerated_image", found)
+    if found:
+        digest = await asyncio.to_thread(image_store.put, bytes(pregenerated["image"]))
+        await asyncio.to_thread(
+            generation_cache.set, cache_key, "image", model, digest
+        )
+        return digest
+    return None
 
 
-def generate_text_description(enhanced_data: Dict[str, Any]) -> str:
+async def generate_text_description(
+    prompt: RenderedPrompt, use_cache: bool = True
+) -> GenerationResult:
     """
-    Genera una descrizione testuale dell'utente usando OpenAI e template Jinja2
+    Genera una descrizione testuale dell'utente usando OpenAI
 
     Args:
-        enhanced_data: Dati arricchiti dell'utente
+        prompt: Prompt già renderizzato dal template del testo
+        use_cache: Se False ignora cache e output pregenerati (il risultato
+            viene comunque salvato)
 
     Returns:
-        Descrizione testuale generata
+        Descrizione testuale generata e indicazione di cache hit
     """
     try:
-        # Carica il template Jinja2
-        template = jinja_env.get_template("aggregate_text_prompt.j2")
-
-        # Renderizza il prompt con i dati
-        prompt = template.render(**enhanced_data)
-
-        # Chiama OpenAI per la generazione del testo
-        response = client.chat.completions.create(
-            model=os.getenv("DEFAULT_TEXT_MODEL", "gpt-5-nano"),
-            messages=[
-                {
-                    "role": "system",
-                    "content": "Sei un esperto analista di mobilità specializzato nella creazione di profili utente dettagliati.",
-                },
-                {"role": "user", "content": prompt},
-            ],
-        )
+        model, cache_key = text_generation_key(prompt.text)
+        if use_cache:
+            cached = await _cached_text(model, cache_key)
+            if cached is not None:
+                return GenerationResult(content=cached, cache_hit=True)
+
+        # Chiama OpenAI per la generazione del testo, tramite lo scheduler
+        with stage("text_generation"):
+            raw_response = await openai_scheduler.call(
+                model,
+                lambda: outbound_http.openai.chat.completions.with_raw_response.create(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": TEXT_SYSTEM_PROMPT},
+                        {"role": "user", "content": prompt.text},
+                    ],
+                ),
+                tokens=estimate_tokens(TEXT_SYSTEM_PROMPT, prompt.text),
+            )
+            response = raw_response.parse()
 
-        return response.choices[0].message.content.strip()
+        text = (response.choices[0].message.content or "").strip()
+        # Una risposta vuota non va in cache: sarebbe servita come hit
+        if text:
+            await asyncio.to_thread(
+                generation_cache.set, cache_key, "text", model, text
+            )
+        return GenerationResult(content=text, cache_hit=False)
 
+    except OpenAIRateLimited:
+        # Quota esaurita: arriva al client come 429, non come errore generico
+        raise
     except Exception as e:
         raise Exception(f"Errore nella generazione del testo: {e}")
 
 
-def generate_image_description(enhanced_data: Dict[str, Any]) -> str:
+async def stream_text_description(
+    prompt: RenderedPrompt, use_cache: bool = True
+) -> AsyncIterator[GenerationResult]:
     """
-    Genera un'immagine rappresentativa dell'utente usando OpenAI DALL-E
+    Variante in streaming di generate_text_description: emette i frammenti
+    di testo man mano che OpenAI li produce
 
     Args:
-        enhanced_data: Dati arricchiti dell'utente
+        prompt: Prompt già renderizzato dal template del testo
+        use_cache: Se False ignora cache e output pregenerati (il risultato
+            viene comunque salvato)
 
-    Returns:
-        URL dell'immagine generata
+    Yields:
+        Frammenti della descrizione; in caso di cache hit un unico frammento
+        con il testo completo
     """
     try:
-        # Carica il template Jinja2 per l'immagine
-        template = jinja_env.get_template("aggregate_image_prompt.j2")
+        model, cache_key = text_generation_key(prompt.text)
+        if use_cache:
+            cached = await _cached_text(model, cache_key)
+            if cached is not None:
+                yield GenerationResult(content=cached, cache_hit=True)
+                return
 
-        # Renderizza il prompt per l'immagine
-        image_prompt = template.render(**enhanced_data)
+        # Lo slot dello scheduler resta occupato per tutta la lettura dello
+        # stream; lo stadio misura invece l'attesa fino all'apertura, cioè la
+        # latenza prima del primo frammento
+        parts = []
+        async with AsyncExitStack() as scheduled:
+            with stage("text_generation"):
+                raw_response = await scheduled.enter_async_context(
+                    openai_scheduler.stream(
+                        model,
+                        lambda: outbound_http.openai.chat.completions.with_raw_response.create(
+                            model=model,
+                            messages=[
+                                {"role": "system", "content": TEXT_SYSTEM_PROMPT},
+                                {"role": "user", "content": prompt.text},
+                            ],
+                            stream=True,
+                        ),
+                        tokens=estimate_tokens(TEXT_SYSTEM_PROMPT, prompt.text),
+                    )
+                )
+                stream = raw_response.parse()
 
-        # Chiama OpenAI DALL-E per la generazione dell'immagine
-        response = client.images.generate(
-            model=os.getenv("DEFAULT_IMAGE_MODEL", "dall-e-3"),
-            prompt=image_prompt,
-            size="1024x1024",
-            quality="standard",
-            n=1,
-        )
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield GenerationResult(content=delta, cache_hit=False)
 
-        return response.data[0].url
+        text = "".join(parts).strip()
+        if text:
+            await asyncio.to_thread(
+                generation_cache.set, cache_key, "text", model, text
+            )
 
+    except OpenAIRateLimited:
+        # Quota esaurita: arriva al client come 429, non come errore generico
+        raise
     except Exception as e:
-        raise Exception(f"Errore nella generazione dell'immagine: {e}")
+        raise Exception(f"Errore nella generazione del testo: {e}")
 
 
-def get_template_content(template_name: str, enhanced_data: Dict[str, Any]) -> str:
+async def _download_image(image_url: str, writer: ImageWriter) -> None:
     """
-    Utility function per ottenere il contenuto renderizzato di un template
+    Scarica in streaming i byte grezzi dell'immagine nel writer dell'image
+    store, senza decodificarla né tenerla in memoria. Solleva un errore se
+    l'immagine supera IMAGE_MAX_BYTES.
+    """
+    async with outbound_http.client.stream("GET", image_url) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            writer.write(chunk)
+            if writer.size > IMAGE_MAX_BYTES:
+                raise ValueError(
+                    f"Immagine troppo grande (oltre {IMAGE_MAX_BYTES} byte)"
+                )
+
+
+async def generate_image_description(
+    prompt: RenderedPrompt, use_cache: bool = True
+) -> GenerationResult:
+    """
+    Genera un'immagine rappresentativa dell'utente usando OpenAI DALL-E.
+
+    L'immagine viene scaricata subito (l'URL di OpenAI scade) e salvata
+    nell'image store; la cache delle generazioni conserva il solo hash.
 
     Args:
-        template_name: Nome del template
-        enhanced_data: Dati da passare al template
+        prompt: Prompt già renderizzato dal template dell'immagine
+        use_cache: Se False ignora cache e output pregenerati (il risultato
+            viene comunque salvato)
 
     Returns:
-        Contenuto renderizzato del template
+        Hash dell'immagine nell'image store e indicazione di cache hit
     """
     try:
-        template = jinja_env.get_template(template_name)
-        return template.render(**enhanced_data)
+        model, cache_key = image_generation_key(prompt.text)
+        if use_cache:
+            cached = await _cached_image(model, cache_key)
+            if cached is not None:
+                return GenerationResult(content=cached, cache_hit=True)
+
+        # Chiama OpenAI DALL-E per la generazione dell'immagine
+        with stage("image_generation"):
+            raw_response = await openai_scheduler.call(
+                model,
+                lambda: outbound_http.openai.images.with_raw_response.generate(
+                    model=model,
+                    prompt=prompt.text,
+                    **IMAGE_PARAMS,
+                ),
+                priority=image_priority(),
+            )
+            response = raw_response.parse()
+
+        with image_store.writer() as writer:
+            with stage("image_download"):
+                await _download_image(response.data[0].url, writer)
+            with stage("image_store"):
+                digest = await asyncio.to_thread(writer.commit)
+        await asyncio.to_thread(
+            generation_cache.set, cache_key, "image", model, digest
+        )
+        return GenerationResult(content=digest, cache_hit=False)
+
+    except OpenAIRateLimited:
+        # Quota esaurita: arriva al client come 429, non come errore generico
+        raise
     except Exception as e:
-        raise Exception(f"Errore nel rendering del template {template_name}: {e}")
+        raise Exception(f"Errore nella generazione dell'immagine: {e}")
@@ -0,0 +1,175 @@
+import importlib.util
+import os
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+import httpx
+import openai
+from loguru import logger
+
+HTTP_CONNECT_TIMEOUT_S = float(os.getenv("HTTP_CONNECT_TIMEOUT_S", "5"))
+HTTP_READ_TIMEOUT_S = float(os.getenv("HTTP_READ_TIMEOUT_S", "120"))
+HTTP_WRITE_TIMEOUT_S = float(os.getenv("HTTP_WRITE_TIMEOUT_S", "30"))
+HTTP_POOL_TIMEOUT_S = float(os.getenv("HTTP_POOL_TIMEOUT_S", "10"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY_S = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_S", "60"))
+# HTTP/2 richiede il pacchetto h2 (httpx[http2]); senza si resta su HTTP/1.1
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+
+
+class _CountingStream(httpx.AsyncByteStream):
+    """
+    Corpo della risposta che segnala la propria chiusura (una sola volta)
+    """
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close: Callable[[], None]):
+        self._stream = stream
+        self._on_close: Optional[Callable[[], None]] = on_close
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._on_close is not None:
+                self._on_close()
+                self._on_close = None
+
+
+class _CountingTransport(httpx.AsyncHTTPTransport):
+    """
+    Trasporto httpx standard che conta le richieste in corso, dall'invio
+    alla chiusura del corpo della risposta, tramite la sola API pubblica
+    """
+
+    def __init__(
+        self,
+        on_start: Callable[[], None],
+        on_finish: Callable[[], None],
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(**kwargs)
+        self._on_start = on_start
+        self._on_finish = on_finish
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self._on_start()
+        try:
+            response = await super().handle_async_request(request)
+        except BaseException:
+            self._on_finish()
+            raise
+        response.stream = _CountingStream(response.stream, self._on_finish)
+        return response
+
+
+class OutboundHTTP:
+    """
+    Client HTTP in uscita condiviso da tutta l'applicazione.
+
+    Un solo httpx.AsyncClient mantiene vivi i pool di connessioni per host
+    (HTTP/2 dove disponibile) e un unico contesto TLS, così handshake e
+    sessioni TLS vengono riusati tra le chiamate a OpenAI e i download delle
+    immagini. Gli event hook contano richieste e risposte per classe di stato;
+    il trasporto conta le richieste in corso.
+    """
+
+    def __init__(self) -> None:
+        self.timeout = httpx.Timeout(
+            connect=HTTP_CONNECT_TIMEOUT_S,
+            read=HTTP_READ_TIMEOUT_S,
+            write=HTTP_WRITE_TIMEOUT_S,
+            pool=HTTP_POOL_TIMEOUT_S,
+        )
+        self.limits = httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_S,
+        )
+        self.http2 = HTTP2_ENABLED and importlib.util.find_spec("h2") is not None
+        if HTTP2_ENABLED and not self.http2:
+            logger.warning("Pacchetto h2 non installato: client HTTP in HTTP/1.1")
+
+        self.requests = 0
+        self.responses: Dict[str, int] = {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._openai: Optional[openai.AsyncOpenAI] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                transport=_CountingTransport(
+                    self._request_started,
+                    self._request_finished,
+                    http2=self.http2,
+                    limits=self.limits,
+                ),
+                timeout=self.timeout,
+                follow_redirects=True,
+                event_hooks={
+                    "request": [self._on_request],
+                    "response": [self._on_response],
+                },
+            )
+            self._openai = None
+        return self._client
+
+    @property
+    def openai(self) -> openai.AsyncOpenAI:
+        """
+        Client OpenAI che usa il pool di connessioni condiviso
+        """
+        if self._openai is None or self._client is None or self._client.is_closed:
+            http_client = self.client
+            self._openai = openai.AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                http_client=http_client,
+                timeout=self.timeout,
+                # I retry sono gestiti da openai_scheduler
+                max_retries=0,
+            )
+        return self._openai
+
+    def _request_started(self) -> None:
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _request_finished(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    async def _on_request(self, request: httpx.Request) -> None:
+        self.requests += 1
+
+    async def _on_response(self, response: httpx.Response) -> None:
+        status_class = f"{response.status_code // 100}xx"
+        self.responses[status_class] = self.responses.get(status_class, 0) + 1
+
+    async def aclose(self) -> None:
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+        self._openai = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "http2": self.http2,
+            "max_connections": HTTP_MAX_CONNECTIONS,
+            "max_keepalive_connections": HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "requests": self.requests,
+            "responses": dict(self.responses),
+        }
+
+
+outbound_http = OutboundHTTP()
@@ -0,0 +1,172 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", os.path.join(".cache", "images"))
+# Base degli URL stabili restituiti ai client per le immagini
+IMAGE_PUBLIC_BASE_URL = os.getenv("IMAGE_PUBLIC_BASE_URL", "http://localhost:8000")
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def sniff_image_type(data: bytes) -> tuple[str, str]:
+    """
+    Estensione e media type dai magic bytes, senza decodificare l'immagine
+    """
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png", "image/png"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "jpg", "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp", "image/webp"
+    return "bin", "application/octet-stream"
+
+
+def is_digest(value: str) -> bool:
+    return bool(_DIGEST_RE.match(value))
+
+
+class ImageWriter:
+    """
+    Scrittura incrementale di un'immagine nello store: i byte vanno su un
+    file temporaneo mentre se ne calcola lo sha256, e commit() lo rinomina
+    con il suo hash. Nessuna copia dell'immagine resta in memoria.
+    """
+
+    def __init__(self, store: "ImageStore") -> None:
+        self.store = store
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+        os.makedirs(store.root, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=store.root, prefix=".tmp-")
+        self._file = os.fdopen(fd, "wb")
+        self._done = False
+
+    def write(self, chunk: bytes) -> None:
+        self._file.write(chunk)
+        self._sha256.update(chunk)
+        self.size += len(chunk)
+
+    def commit(self) -> str:
+        """
+        Rende l'immagine visibile nello store e ne restituisce l'hash
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._done = True
+        return self.store._publish(self._tmp_path, self._sha256.hexdigest())
+
+    def discard(self) -> None:
+        if self._done:
+            return
+        self._done = True
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+class ImageStore:
+    """
+    Store su filesystem delle immagini generate, indirizzato per contenuto.
+
+    Ogni immagine è salvata una sola volta con nome pari allo sha256 dei suoi
+    byte, in sottocartelle a due livelli (ab/cd/abcd...) per non avere
+    directory enormi. La scrittura avviene su un file temporaneo nello store
+    seguito da un rename atomico: un lettore non vede mai file parziali.
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.stored = 0
+        self.deduplicated = 0
+        self._lock = threading.Lock()
+
+    def path_for(self, digest: str) -> str:
+        if not is_digest(digest):
+            raise ValueError(f"Hash immagine non valido: {digest}")
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.path_for(digest))
+
+    def put(self, data: bytes) -> str:
+        """
+        Salva l'immagine se non è già presente e ne restituisce l'hash
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        if os.path.exists(self.path_for(digest)):
+            with self._lock:
+                self.deduplicated += 1
+            return digest
+
+        with self.writer() as writer:
+            writer.write(data)
+            return writer.commit()
+
+    @contextmanager
+    def writer(self) -> Iterator[ImageWriter]:
+        """
+        Writer incrementale; se non viene chiamato commit() il file
+        temporaneo viene eliminato all'uscita
+        """
+        writer = ImageWriter(self)
+        try:
+            yield writer
+        finally:
+            writer.discard()
+
+    def _publish(self, tmp_path: str, digest: str) -> str:
+        path = self.path_for(digest)
+        try:
+            if os.path.exists(path):
+                os.remove(tmp_path)
+                with self._lock:
+                    self.deduplicated += 1
+                return digest
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+        with self._lock:
+            self.stored += 1
+        return digest
+
+    def read(self, digest: str) -> Optional[bytes]:
+        try:
+            with open(self.path_for(digest), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def media_type(self, digest: str) -> str:
+        with open(self.path_for(digest), "rb") as f:
+            return sniff_image_type(f.read(12))[1]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "root": self.root,
+            "stored": self.stored,
+            "deduplicated": self.deduplicated,
+        }
+
+
+def image_url(digest: str) -> str:
+    """
+    URL stabile con cui l'API serve l'immagine
+    """
+    return f"{IMAGE_PUBLIC_BASE_URL.rstrip('/')}/images/{digest}"
+
+
+image_store = ImageStore(IMAGE_STORE_DIR)
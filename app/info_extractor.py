@@ -0,0 +1,173 @@
+import re
+from typing import Any, Dict, Iterable, Optional
+
+# Parole chiave (regex, italiano e inglese) -> frammento del valore canonico
+# nelle tabelle di lookup. Se nel testo compaiono parole chiave di valori
+# diversi il campo resta irrisolto.
+MODE_ALIASES = [
+    (r"passeggero|passenger", "passenger car (passenger)"),
+    (r"auto(mobile)?|macchina|in car|by car|guidando|driver", "passenger car (driver)"),
+    (r"treno|train", "train"),
+    (r"autobus|bus|tram|metro(politana)?|subway", "bus/tram/metro"),
+    (r"bici(cletta)?|bike|bicycle|cycling", "bike"),
+    (r"a piedi|camminando|on foot|walking", "walking"),
+]
+
+MOTIVE_ALIASES = [
+    (r"trasfert\w*|professional\w*", "professionally"),
+    (r"lavoro|work|commut\w*|pendolar\w*|ufficio|office", "work"),
+    (r"servizi|cure|medic\w*|services|care", "services/care"),
+    (r"spesa|shopping|acquisti|groceries", "shopping"),
+    (r"studio|scuola|universit\w*|corsi|education|school|courses", "education"),
+    (r"visit\w*|amici|parenti|friends|relatives", "visits"),
+    (r"tempo libero|sport\w*|leisure", "leisure"),
+    (r"turismo|escursion\w*|touring|gite", "touring"),
+]
+
+_NUMBER = r"(\d{1,3}(?:[.,]\d{3})+|\d+(?:[.,]\d+)?)"
+
+TRIP_COUNT_PATTERNS = [
+    _NUMBER + r"\s*(?:volte|viaggi|viaggio|spostamenti|tragitti|trips?|times|journeys)\b",
+    r"\b(?:trip_count|numero di viaggi|viaggi)\s*[=:]?\s*" + _NUMBER,
+]
+
+KM_PATTERNS = [
+    _NUMBER + r"\s*(?:km|chilometri|kilometri|kilometers|kilometres)\b",
+    r"\bkm_travelled\s*[=:]\s*" + _NUMBER,
+]
+
+_YEAR = r"((?:19|20)\d{2})"
+
+YEAR_RANGE_PATTERNS = [
+    r"\b(?:dal|da|from|tra il|between)\s+" + _YEAR
+    + r"\s+(?:al|a|to|until|e il|and)\s+" + _YEAR + r"\b",
+    r"\b" + _YEAR + r"\s*[-–/]\s*" + _YEAR + r"\b",
+]
+
+YEAR_SINGLE_PATTERNS = [
+    r"\b(?:nel|in|anno|year|durante il)\s+" + _YEAR + r"\b",
+    r"\byear\s*[=:]\s*" + _YEAR + r"\b",
+]
+
+
+def _parse_number(raw: str) -> int:
+    """
+    Converte "1.500", "1,500", "500" o "12,5" in intero
+    """
+    if re.fullmatch(r"\d{1,3}(?:[.,]\d{3})+", raw):
+        return int(re.sub(r"[.,]", "", raw))
+    return int(round(float(raw.replace(",", "."))))
+
+
+def _unique(values: Iterable[Any]) -> Optional[Any]:
+    """
+    Restituisce il valore se tutte le occorrenze concordano, altrimenti None
+    """
+    distinct = set(values)
+    return distinct.pop() if len(distinct) == 1 else None
+
+
+def _find_numbers(info: str, patterns: list[str]) -> Optional[int]:
+    found = []
+    for pattern in patterns:
+        for match in re.finditer(pattern, info, re.IGNORECASE):
+            found.append(_parse_number(match.group(1)))
+    return _unique(found)
+
+
+def _find_year(info: str) -> Optional[str]:
+    ranges = []
+    for pattern in YEAR_RANGE_PATTERNS:
+        for match in re.finditer(pattern, info, re.IGNORECASE):
+            start, end = sorted((int(match.group(1)), int(match.group(2))))
+            ranges.append(f"{start}-{end}" if start != end else str(start))
+    if ranges:
+        return _unique(ranges)
+
+    singles = []
+    for pattern in YEAR_SINGLE_PATTERNS:
+        for match in re.finditer(pattern, info, re.IGNORECASE):
+            singles.append(match.group(1))
+    return _unique(singles)
+
+
+def _base_name(value: str) -> str:
+    # "Groningen (PV)" -> "Groningen"
+    return re.sub(r"\s*\(.*?\)", "", value).strip()
+
+
+def _find_lookup_value(
+    info: str, values: list[str], aliases: list[tuple[str, str]]
+) -> Optional[str]:
+    """
+    Cerca nel testo un valore noto della tabella di lookup: prima per nome,
+    poi tramite parole chiave. Se il nome è ambiguo (es. "passenger car" per
+    conducente e passeggero) le parole chiave scelgono tra i valori trovati.
+    Se il testo resta ambiguo non restituisce nulla.
+    """
+    by_name = [
+        value
+        for value in values
+        if _base_name(value)
+        and re.search(
+            r"(?<!\w)" + re.escape(_base_name(value)) + r"(?!\w)", info, re.IGNORECASE
+        )
+    ]
+    if len(set(by_name)) == 1:
+        return by_name[0]
+
+    candidates = by_name or values
+    by_alias = [
+        value
+        for pattern, fragment in aliases
+        if re.search(r"(?<!\w)(?:" + pattern + r")(?!\w)", info, re.IGNORECASE)
+        for value in candidates
+        if fragment in value.lower()
+    ]
+    return _unique(by_alias)
+
+
+def extract_fields(
+    info: str, missing_fields: list[str], lookups: Dict[str, list[str]]
+) -> Dict[str, Any]:
+    """
+    Estrattore deterministico dei campi richiesti dal testo libero di info.
+
+    Gestisce le formulazioni più comuni in italiano e inglese (es. "Ha
+    viaggiato 10 volte per un totale di 500 km percorsi", "dal 2018 al 2022",
+    "in bicicletta per lavoro"). I campi non risolti con certezza vengono
+    omessi, così da poterli demandare all'LLM.
+
+    Args:
+        info: Testo libero della request
+        missing_fields: Campi da estrarre
+        lookups: Valori noti per region, travel_mode e travel_motive
+
+    Returns:
+        Dizionario con i soli campi estratti
+    """
+    extracted: Dict[str, Any] = {}
+
+    for field in missing_fields:
+        value: Any = None
+        if field == "trip_count":
+            value = _find_numbers(info, TRIP_COUNT_PATTERNS)
+        elif field == "km_travelled":
+            value = _find_numbers(info, KM_PATTERNS)
+        elif field == "year":
+            value = _find_year(info)
+        elif field == "region":
+            value = _find_lookup_value(info, lookups.get("region", []), [])
+        elif field == "travel_mode":
+            value = _find_lookup_value(
+                info, lookups.get("travel_mode", []), MODE_ALIASES
+            )
+        elif field == "travel_motive":
+            value = _find_lookup_value(
+                info, lookups.get("travel_motive", []), MOTIVE_ALIASES
+            )
+
+        if value is not None:
+            extracted[field] = value
+
+    return extracted
@@ -0,0 +1,227 @@
+import asyncio
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from fastapi import HTTPException
+from loguru import logger
+
+from .metrics import current_route
+from .models import Request
+
+JobHandler = Callable[[Request], Awaitable[Dict[str, Any]]]
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class Job:
+    """
+    Stato di un job asincrono; le modifiche notificano chi è in attesa
+    """
+
+    def __init__(self, request: Request) -> None:
+        self.job_id = uuid.uuid4().hex
+        self.request = request
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[Dict[str, Any]] = None
+        self.version = 0
+        self.changed = asyncio.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.status in (SUCCEEDED, FAILED)
+
+    async def update(self, status: str, **fields: Any) -> None:
+        async with self.changed:
+            self.status = status
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.version += 1
+            self.changed.notify_all()
+
+    def to_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {
+            "job_id": self.job_id,
+            "user_id": self.request.user_id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.result is not None:
+            data["result"] = self.result
+        if self.error is not None:
+            data["error"] = self.error
+        return data
+
+
+class JobManager:
+    """
+    Coda limitata di job eseguiti da un pool fisso di worker asyncio.
+
+    I job e i risultati vivono in memoria nel processo che li ha ricevuti;
+    i job terminati vengono rimossi dopo result_ttl secondi.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: JobHandler,
+        workers: int,
+        max_queue: int,
+        result_ttl: float,
+    ) -> None:
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.max_queue = max_queue
+        self.result_ttl = result_ttl
+        self.jobs: Dict[str, Job] = {}
+        self.succeeded = 0
+        self.failed = 0
+        self.rejected = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"{self.name}-worker-{i}")
+            for i in range(self.workers)
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, request: Request) -> Job:
+        """
+        Accoda un job; solleva 503 se la coda è piena
+        """
+        if self._queue is None:
+            raise HTTPException(status_code=503, detail="Worker pool non avviato")
+
+        self._purge_expired()
+        job = Job(request)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Coda dei job piena, riprovare più tardi",
+                headers={"Retry-After": "5"},
+            )
+        self.jobs[job.job_id] = job
+        return job
+
+    def get(self, job_id: str) -> Job:
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Job {job_id} non trovato")
+        return job
+
+    async def wait(self, job: Job, timeout: float) -> Job:
+        """
+        Long-poll: attende al massimo timeout secondi che il job termini
+        """
+        async with job.changed:
+            try:
+                await asyncio.wait_for(
+                    job.changed.wait_for(lambda: job.done), timeout=timeout
+                )
+            except asyncio.TimeoutError:
+                pass
+        return job
+
+    async def watch(self, job: Job, heartbeat: float) -> AsyncIterator[Optional[Job]]:
+        """
+        Emette il job a ogni cambio di stato fino al termine; emette None
+        ogni heartbeat secondi senza cambiamenti
+        """
+        last_version = -1
+        while True:
+            async with job.changed:
+                try:
+                    await asyncio.wait_for(
+                        job.changed.wait_for(lambda: job.version != last_version),
+                        timeout=heartbeat,
+                    )
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                last_version = job.version
+            yield job
+            if job.done:
+                return
+
+    async def _worker(self) -> None:
+        # Le metriche degli stadi eseguiti dai worker vanno sotto il pool
+        current_route.set(self.name)
+        while True:
+            job = await self._queue.get()
+            try:
+                await job.update(RUNNING, started_at=time.time())
+                try:
+                    result = await self.handler(job.request)
+                    await job.update(
+                        SUCCEEDED, result=result, finished_at=time.time()
+                    )
+                    self.succeeded += 1
+                except HTTPException as e:
+                    await job.update(
+                        FAILED,
+                        error={"status_code": e.status_code, "detail": e.detail},
+                        finished_at=time.time(),
+                    )
+                    self.failed += 1
+                except Exception as e:
+                    logger.error(f"[JOB: {job.job_id}] Errore nel job: {e}")
+                    await job.update(
+                        FAILED,
+                        error={"status_code": 500, "detail": str(e)},
+                        finished_at=time.time(),
+                    )
+                    self.failed += 1
+            finally:
+                self._queue.task_done()
+
+    def _purge_expired(self) -> None:
+        cutoff = time.time() - self.result_ttl
+        expired = [
+            job_id
+            for job_id, job in self.jobs.items()
+            if job.done and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        queued = [job for job in self.jobs.values() if job.status == QUEUED]
+        running = [job for job in self.jobs.values() if job.status == RUNNING]
+        return {
+            "workers": self.workers,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "max_queue": self.max_queue,
+            "running": len(running),
+            "oldest_queued_age_s": round(
+                max((now - job.created_at for job in queued), default=0.0), 3
+            ),
+            "oldest_running_age_s": round(
+                max((now - job.started_at for job in running), default=0.0), 3
+            ),
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "retained_jobs": len(self.jobs),
+        }
@@ -1,15 +1,46 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from dotenv import load_dotenv
 from fastapi import FastAPI
 
-from .routes import generate_images, generate_text
+from .database import close_pool, open_pool
+from .http_client import outbound_http
+from .metrics import SERVER_TIMING_ENABLED, MetricsMiddleware
+from .mlflow_utils import mlflow_log_queue
+from .prompt_registry import prompt_registry
+from .routes import generate_images, generate_text, images, metrics, stats
 
 load_dotenv()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Compila i template dei prompt una volta sola
+    prompt_registry.load()
+    await open_pool()
+    mlflow_log_queue.start()
+    await generate_images.image_jobs.start()
+    yield
+    await generate_images.image_jobs.stop()
+    # Svuota la coda MLflow senza bloccare l'event loop
+    await asyncio.to_thread(mlflow_log_queue.stop)
+    await outbound_http.aclose()
+    await close_pool()
+
+
 app = FastAPI(
     title="MIR User Profiling API",
     description="API per generare descrizioni e immagini basate sui viaggi degli utenti",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 app.include_router(generate_text.router)
 app.include_router(generate_images.router)
+app.include_router(images.router)
+app.include_router(stats.router)
+app.include_router(metrics.router)
+
+# Latenze per route e stadio, opzionalmente anche nell'header Server-Timing
+app.add_middleware(MetricsMiddleware, server_timing=SERVER_TIMING_ENABLED)
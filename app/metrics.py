@@ -0,0 +1,180 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Header Server-Timing con la durata degli stadi di ogni richiesta
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "false").lower() == "true"
+
+# Da pochi ms (cache, Postgres) a decine di secondi (generazione immagini)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 60)
+
+HTTP_REQUESTS = Counter(
+    "mir_http_requests_total",
+    "Richieste HTTP servite",
+    ["route", "method", "status"],
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "mir_http_request_duration_seconds",
+    "Durata delle richieste HTTP fino all'invio della risposta",
+    ["route", "method"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_DURATION = Histogram(
+    "mir_stage_duration_seconds",
+    "Durata dei singoli stadi della pipeline",
+    ["route", "stage"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_ERRORS = Counter(
+    "mir_stage_errors_total",
+    "Errori per stadio della pipeline e classe di eccezione",
+    ["route", "stage", "error"],
+)
+CACHE_LOOKUPS = Counter(
+    "mir_cache_lookups_total",
+    "Esiti delle ricerche nelle cache",
+    ["cache", "result"],
+)
+OPENAI_REQUEST_DURATION = Histogram(
+    "mir_openai_request_duration_seconds",
+    "Durata delle chiamate OpenAI, escluse le attese dello scheduler",
+    ["model", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+OPENAI_QUEUE_WAIT = Histogram(
+    "mir_openai_queue_wait_seconds",
+    "Attesa delle chiamate OpenAI nello scheduler prima dell'invio",
+    ["model", "priority"],
+    buckets=LATENCY_BUCKETS,
+)
+MLFLOW_LOG_DURATION = Histogram(
+    "mir_mlflow_log_duration_seconds",
+    "Durata della scrittura dei record MLflow nel worker",
+    ["route", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+MLFLOW_QUEUE_DEPTH = Gauge(
+    "mir_mlflow_queue_depth",
+    "Record MLflow in coda in attesa del worker",
+)
+MLFLOW_RECORDS_DROPPED = Counter(
+    "mir_mlflow_records_dropped_total",
+    "Record MLflow scartati per coda piena",
+)
+
+# Route della richiesta corrente e durate degli stadi per Server-Timing;
+# i task (batch, job) ereditano i valori del chiamante
+current_route: ContextVar[str] = ContextVar("current_route", default="background")
+_stage_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar(
+    "stage_timings", default=None
+)
+
+
+def _record_stage(name: str, elapsed: float) -> None:
+    STAGE_DURATION.labels(current_route.get(), name).observe(elapsed)
+    timings = _stage_timings.get()
+    if timings is not None:
+        # Gli stadi ripetuti (es. batch) si sommano
+        timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def _record_error(name: str, error: BaseException) -> None:
+    STAGE_ERRORS.labels(current_route.get(), name, type(error).__name__).inc()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Misura la durata di uno stadio della pipeline (anche in caso di errore)
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        _record_error(name, e)
+        raise
+    finally:
+        _record_stage(name, time.perf_counter() - started)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def format_server_timing(timings: Dict[str, float]) -> str:
+    return ", ".join(
+        f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in timings.items()
+    )
+
+
+def _route_template(scope: Scope) -> str:
+    """
+    Path template della route (es. /images/{image_hash}), per non creare
+    una serie per ogni URL
+    """
+    app = scope.get("app")
+    for route in getattr(getattr(app, "router", None), "routes", []):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", scope["path"])
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI che etichetta la richiesta con la sua route, ne misura
+    la durata e, se abilitato, aggiunge l'header Server-Timing con gli
+    stadi completati prima dell'invio della risposta. Nelle risposte in
+    streaming gli stadi successivi finiscono solo nelle metriche.
+    """
+
+    def __init__(self, app: ASGIApp, server_timing: bool = False) -> None:
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = _route_template(scope)
+        method = scope["method"]
+        timings: Dict[str, float] = {}
+        route_token = current_route.set(route)
+        timings_token = _stage_timings.set(timings)
+        started = time.perf_counter()
+        status: Optional[int] = None
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                elapsed = time.perf_counter() - started
+                HTTP_REQUEST_DURATION.labels(route, method).observe(elapsed)
+                if self.server_timing:
+                    entries = dict(timings, total=elapsed)
+                    headers = list(message.get("headers", []))
+                    headers.append(
+                        (b"server-timing", format_server_timing(entries).encode())
+                    )
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            if status is None:
+                # Eccezione non gestita: la risposta 500 la invia Starlette
+                status = 500
+                HTTP_REQUEST_DURATION.labels(route, method).observe(
+                    time.perf_counter() - started
+                )
+            HTTP_REQUESTS.labels(route, method, str(status)).inc()
+            current_route.reset(route_token)
+            _stage_timings.reset(timings_token)
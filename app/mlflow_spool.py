@@ -0,0 +1,242 @@
+import base64
+import glob
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+MLFLOW_SPOOL_DIR = os.getenv("MLFLOW_SPOOL_DIR", os.path.join(".cache", "mlflow_spool"))
+MLFLOW_SPOOL_SEGMENT_BYTES = int(
+    os.getenv("MLFLOW_SPOOL_SEGMENT_BYTES", str(16 * 1024 * 1024))
+)
+MLFLOW_SPOOL_MAX_BYTES = int(
+    os.getenv("MLFLOW_SPOOL_MAX_BYTES", str(1024 * 1024 * 1024))
+)
+MLFLOW_SPOOL_FSYNC = os.getenv("MLFLOW_SPOOL_FSYNC", "false").lower() == "true"
+# Replay progress is checkpointed every N uploaded records; a crash can
+# re-upload at most N - 1 records
+MLFLOW_SPOOL_CHECKPOINT_RECORDS = int(
+    os.getenv("MLFLOW_SPOOL_CHECKPOINT_RECORDS", "100")
+)
+
+
+def encode_record(record: Dict[str, Any]) -> bytes:
+    """
+    Serialize a log record as one JSON line; the image travels as base64.
+    """
+    data = dict(record)
+    image = data.pop("image", None)
+    if image is not None:
+        data["image_b64"] = base64.b64encode(image).decode("ascii")
+    line = json.dumps(data, ensure_ascii=False, default=str) + "\n"
+    return line.encode("utf-8")
+
+
+def decode_record(line: bytes) -> Dict[str, Any]:
+    data = json.loads(line)
+    image_b64 = data.pop("image_b64", None)
+    data["image"] = base64.b64decode(image_b64) if image_b64 else None
+    return data
+
+
+class MlflowSpool:
+    """
+    Durable, append-only local spool for MLflow records.
+
+    Records are appended sequentially to numbered segment files. The active
+    segment is sealed once it reaches segment_bytes; sealed segments are
+    replayed oldest first and deleted once fully uploaded. Replay progress is
+    checkpointed in a sidecar ``.offset`` file every checkpoint_records
+    records and when a replay stops, so a crash mid-segment re-uploads at
+    most one batch. Above max_bytes the oldest sealed segments are
+    discarded; the total size is tracked in memory and the directory is
+    only listed when it exceeds the limit.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int,
+        max_bytes: int,
+        fsync: bool,
+        checkpoint_records: int = MLFLOW_SPOOL_CHECKPOINT_RECORDS,
+    ) -> None:
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.checkpoint_records = max(1, checkpoint_records)
+        self.appended = 0
+        self.replayed = 0
+        self.dropped_segments = 0
+        self.last_replay_records = 0
+        self.last_replay_seconds = 0.0
+        self._lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self._active = None
+        self._active_path: Optional[str] = None
+        # Size of the segments on disk, read once on first use
+        self._total_bytes: Optional[int] = None
+
+    def _segments(self) -> list[str]:
+        return sorted(glob.glob(os.path.join(self.directory, "segment-*.jsonl")))
+
+    @staticmethod
+    def _segment_info(path: str) -> tuple[int, float]:
+        # segment-<sequence>-<creation time in ms>.jsonl
+        _, sequence, created_ms = os.path.basename(path)[:-6].split("-")
+        return int(sequence), int(created_ms) / 1000
+
+    def _next_segment_path(self) -> str:
+        segments = self._segments()
+        last = self._segment_info(segments[-1])[0] if segments else 0
+        created_ms = int(time.time() * 1000)
+        return os.path.join(
+            self.directory, f"segment-{last + 1:012d}-{created_ms}.jsonl"
+        )
+
+    def _disk_bytes(self) -> int:
+        total = 0
+        for path in self._segments():
+            try:
+                total += os.path.getsize(path)
+            except FileNotFoundError:
+                continue
+        return total
+
+    def _seal_active(self) -> None:
+        if self._active is not None:
+            self._active.close()
+            self._active = None
+            self._active_path = None
+
+    def append(self, record: Dict[str, Any]) -> None:
+        line = encode_record(record)
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._disk_bytes()
+            if self._active is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._active_path = self._next_segment_path()
+                self._active = open(self._active_path, "ab")
+            self._active.write(line)
+            self._active.flush()
+            if self.fsync:
+                os.fsync(self._active.fileno())
+            self.appended += 1
+            self._total_bytes += len(line)
+            if self._active.tell() >= self.segment_bytes:
+                self._seal_active()
+            self._enforce_max_bytes()
+
+    def _enforce_max_bytes(self) -> None:
+        if self._total_bytes <= self.max_bytes:
+            return
+        segments = self._segments()
+        total = self._disk_bytes()
+        for path in segments:
+            if total <= self.max_bytes or path == self._active_path:
+                break
+            total -= os.path.getsize(path)
+            self._remove_segment(path)
+            self.dropped_segments += 1
+        self._total_bytes = total
+
+    @staticmethod
+    def _remove_segment(path: str) -> None:
+        for victim in (path, path + ".offset"):
+            try:
+                os.remove(victim)
+            except FileNotFoundError:
+                pass
+
+    def has_pending(self) -> bool:
+        return bool(self._segments())
+
+    def replay(self, upload: Callable[[Dict[str, Any]], None]) -> int:
+        """
+        Upload spooled records oldest first; stops at the first failure,
+        leaving the remaining records in place. Returns the records uploaded.
+        """
+        with self._replay_lock:
+            with self._lock:
+                self._seal_active()
+                sealed = self._segments()
+            started = time.monotonic()
+            uploaded = 0
+            try:
+                for path in sealed:
+                    uploaded += self._replay_segment(path, upload)
+            finally:
+                self.replayed += uploaded
+                self.last_replay_records = uploaded
+                self.last_replay_seconds = time.monotonic() - started
+            return uploaded
+
+    def _replay_segment(
+        self, path: str, upload: Callable[[Dict[str, Any]], None]
+    ) -> int:
+        offset_path = path + ".offset"
+        try:
+            with open(offset_path) as f:
+                offset = int(f.read().strip() or 0)
+        except FileNotFoundError:
+            offset = 0
+
+        uploaded = 0
+        checkpointed = offset
+        try:
+            with open(path, "rb") as segment:
+                segment.seek(offset)
+                for line in segment:
+                    if line.strip():
+                        upload(decode_record(line))
+                        uploaded += 1
+                    offset += len(line)
+                    if uploaded and uploaded % self.checkpoint_records == 0:
+                        self._write_offset(offset_path, offset)
+                        checkpointed = offset
+        except BaseException:
+            # Keep the progress of the records uploaded before the failure
+            if offset != checkpointed:
+                self._write_offset(offset_path, offset)
+            raise
+
+        with self._lock:
+            size = os.path.getsize(path)
+            self._remove_segment(path)
+            if self._total_bytes is not None:
+                self._total_bytes -= size
+        return uploaded
+
+    @staticmethod
+    def _write_offset(offset_path: str, offset: int) -> None:
+        with open(offset_path, "w") as f:
+            f.write(str(offset))
+
+    def stats(self) -> Dict[str, Any]:
+        segments = self._segments()
+        size = 0
+        for path in segments:
+            try:
+                size += os.path.getsize(path)
+            except FileNotFoundError:
+                continue
+        oldest = self._segment_info(segments[0])[1] if segments else None
+        throughput = (
+            self.last_replay_records / self.last_replay_seconds
+            if self.last_replay_seconds > 0
+            else 0.0
+        )
+        return {
+            "segments": len(segments),
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+            "oldest_segment_age_s": round(time.time() - oldest, 3) if oldest else 0.0,
+            "appended": self.appended,
+            "replayed": self.replayed,
+            "dropped_segments": self.dropped_segments,
+            "last_replay_records": self.last_replay_records,
+            "last_replay_records_per_s": round(throughput, 2),
+        }
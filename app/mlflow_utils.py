@@ -1,96 +1,461 @@
+import asyncio
+import io
+import json
 import os
+import queue
+import tempfile
+import threading
+import time
 import uuid
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
-import mlflow
+import requests
 from loguru import logger
+from mlflow.entities import Metric
+from mlflow.exceptions import MlflowException
+from mlflow.tracking import MlflowClient
+
+from .image_store import image_store, sniff_image_type
+from .metrics import (
+    MLFLOW_LOG_DURATION,
+    MLFLOW_QUEUE_DEPTH,
+    MLFLOW_RECORDS_DROPPED,
+    stage,
+)
+from .mlflow_spool import (
+    MLFLOW_SPOOL_DIR,
+    MLFLOW_SPOOL_FSYNC,
+    MLFLOW_SPOOL_MAX_BYTES,
+    MLFLOW_SPOOL_SEGMENT_BYTES,
+    MlflowSpool,
+)
+
+# Fail fast on a slow or unreachable tracking server: records are spooled
+# locally instead of waiting through MLflow's default 120 s timeout x 7 retries
+os.environ.setdefault("MLFLOW_HTTP_REQUEST_TIMEOUT", "10")
+os.environ.setdefault("MLFLOW_HTTP_REQUEST_MAX_RETRIES", "1")
 
 MLFLOW_TRACKING_URI = os.getenv("MLFLOW_TRACKING_URI", "http://localhost:5001")
 MLFLOW_EXPERIMENT = os.getenv("MLFLOW_EXPERIMENT", "mir-executions")
 
+MLFLOW_QUEUE_SIZE = int(os.getenv("MLFLOW_QUEUE_SIZE", "1000"))
+# drop_newest: discard the incoming record; drop_oldest: discard the oldest
+# queued record; block: wait up to MLFLOW_QUEUE_BLOCK_TIMEOUT_S, then discard
+MLFLOW_QUEUE_POLICY = os.getenv("MLFLOW_QUEUE_POLICY", "drop_newest")
+MLFLOW_QUEUE_BLOCK_TIMEOUT_S = float(
+    os.getenv("MLFLOW_QUEUE_BLOCK_TIMEOUT_S", "0.05")
+)
+MLFLOW_LOG_BATCH_SIZE = int(os.getenv("MLFLOW_LOG_BATCH_SIZE", "50"))
+MLFLOW_EXPERIMENT_RETRY_S = 30.0
+MLFLOW_SPOOL_REPLAY_INTERVAL_S = float(
+    os.getenv("MLFLOW_SPOOL_REPLAY_INTERVAL_S", "15")
+)
+# Optional thumbnail logged next to the original image (0 disables it).
+# Built on the logging worker thread, never on the request path.
+MLFLOW_IMAGE_THUMBNAIL_PX = int(os.getenv("MLFLOW_IMAGE_THUMBNAIL_PX", "0"))
+
+_STOP = object()
+
 
-def setup_mlflow(experiment_name: str = MLFLOW_EXPERIMENT) -> bool:
+class MlflowLogQueue:
     """
-    Ensure MLflow is configured with tracking URI and experiment.
-    Returns False if MLflow is not available, True otherwise.
+    MLflow logging off the request path.
+
+    Records go into a bounded queue drained by a worker thread. The experiment
+    is resolved once, then each record costs one create_run (tags included),
+    at most one log_batch and one log_artifacts call.
+
+    If the tracking server fails, records are appended to a durable local
+    spool and the worker stops calling the server. A replay thread probes
+    the server's /health endpoint and bulk-uploads the spool once it answers.
     """
-    try:
-        mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
-        mlflow.set_experiment(experiment_name)
+
+    def __init__(
+        self,
+        experiment_name: str,
+        maxsize: int,
+        policy: str,
+        block_timeout: float,
+        batch_size: int,
+        spool: MlflowSpool,
+        replay_interval: float,
+    ) -> None:
+        if policy not in ("drop_newest", "drop_oldest", "block"):
+            raise ValueError(f"Invalid MLflow queue policy: {policy}")
+        self.experiment_name = experiment_name
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.batch_size = batch_size
+        self.spool = spool
+        self.replay_interval = replay_interval
+        self.tracking_available = True
+        self.spooled = 0
+        self.experiment_id: Optional[str] = None
+        self.enqueued = 0
+        self.logged = 0
+        self.dropped = 0
+        self.failed = 0
+        self.last_error: Optional[str] = None
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=maxsize)
+        # The gauge follows the queue created last (the module singleton)
+        MLFLOW_QUEUE_DEPTH.set_function(self._queue.qsize)
+        self._client: Optional[MlflowClient] = None
+        self._experiment_checked_at = float("-inf")
+        self._thread: Optional[threading.Thread] = None
+        self._replay_thread: Optional[threading.Thread] = None
+        self._stop_replay = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="mlflow-logger", daemon=True
+            )
+            self._thread.start()
+        if self._replay_thread is None:
+            self._stop_replay.clear()
+            self._replay_thread = threading.Thread(
+                target=self._replay_loop, name="mlflow-spool-replay", daemon=True
+            )
+            self._replay_thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """
+        Wait up to timeout seconds for the queue to drain.
+        """
+        self._stop_replay.set()
+        if self._replay_thread is not None:
+            self._replay_thread.join(timeout=timeout)
+            self._replay_thread = None
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def submit(self, record: Dict[str, Any]) -> bool:
+        """
+        Enqueue a record without blocking (unless the policy is block).
+        Returns False if the record was dropped.
+        """
+        try:
+            if self.policy == "block":
+                self._queue.put(record, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(record)
+        except queue.Full:
+            if self.policy != "drop_oldest":
+                self._drop()
+                return False
+            try:
+                self._queue.get_nowait()
+                self._drop()
+                self._queue.put_nowait(record)
+            except (queue.Empty, queue.Full):
+                self._drop()
+                return False
+        with self._lock:
+            self.enqueued += 1
         return True
-    except Exception as e:
-        logger.error("Errore configurazione MLflow: {}", e)
+
+    async def submit_async(self, record: Dict[str, Any]) -> bool:
+        """
+        submit for callers on the event loop: with the block policy the wait
+        happens on a worker thread, so other requests keep running.
+        """
+        if self.policy == "block":
+            return await asyncio.to_thread(self.submit, record)
+        return self.submit(record)
+
+    def _drop(self) -> None:
+        with self._lock:
+            self.dropped += 1
+        MLFLOW_RECORDS_DROPPED.inc()
+
+    def _resolve_experiment(self, force: bool = False) -> bool:
+        if self.experiment_id is not None:
+            return True
+        now = time.monotonic()
+        if not force and now - self._experiment_checked_at < MLFLOW_EXPERIMENT_RETRY_S:
+            return False
+        self._experiment_checked_at = now
+        try:
+            self._client = MlflowClient(tracking_uri=MLFLOW_TRACKING_URI)
+            experiment = self._client.get_experiment_by_name(self.experiment_name)
+            if experiment is not None:
+                self.experiment_id = experiment.experiment_id
+            else:
+                self.experiment_id = self._client.create_experiment(
+                    self.experiment_name
+                )
+            return True
+        except Exception as e:
+            logger.error("Errore configurazione MLflow: {}", e)
+            self.last_error = str(e)
+            return False
+
+    def _run(self) -> None:
+        while True:
+            batch: List[Dict[str, Any]] = [self._queue.get()]
+            # Drain whatever is already queued in one pass
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = any(record is _STOP for record in batch)
+            for record in batch:
+                if record is not _STOP:
+                    started = time.monotonic()
+                    outcome = self._log_record(record)
+                    MLFLOW_LOG_DURATION.labels(record["route"], outcome).observe(
+                        time.monotonic() - started
+                    )
+            if stop:
+                return
+
+    def _log_record(self, record: Dict[str, Any]) -> str:
+        """Upload (or spool) one record and return the outcome."""
+        if self.tracking_available and self._resolve_experiment():
+            try:
+                log_request_response(self._client, self.experiment_id, record)
+                with self._lock:
+                    self.logged += 1
+                return "logged"
+            except Exception as e:
+                if not _is_outage(e):
+                    logger.warning("MLflow logging skipped per errore: {}", e)
+                    with self._lock:
+                        self.failed += 1
+                        self.last_error = str(e)
+                    return "failed"
+                logger.warning("MLflow non raggiungibile, uso lo spool locale: {}", e)
+                self.tracking_available = False
+                self.last_error = str(e)
+        return self._spool_record(record)
+
+    def _spool_record(self, record: Dict[str, Any]) -> str:
+        try:
+            self.spool.append(record)
+            with self._lock:
+                self.spooled += 1
+            return "spooled"
+        except Exception as e:
+            logger.error("Impossibile scrivere il record MLflow nello spool: {}", e)
+            with self._lock:
+                self.failed += 1
+                self.last_error = str(e)
+            return "failed"
+
+    def _replay_upload(self, record: Dict[str, Any]) -> None:
+        try:
+            log_request_response(self._client, self.experiment_id, record)
+            with self._lock:
+                self.logged += 1
+        except Exception as e:
+            if _is_outage(e):
+                raise
+            # Record non accettato dal server: scartarlo evita di bloccare lo spool
+            logger.warning("Record MLflow scartato durante il replay: {}", e)
+            with self._lock:
+                self.failed += 1
+                self.last_error = str(e)
+
+    def _replay_loop(self) -> None:
+        while not self._stop_replay.wait(self.replay_interval):
+            if self.tracking_available and not self.spool.has_pending():
+                continue
+            if not _tracking_server_healthy():
+                self.tracking_available = False
+                continue
+            if not self._resolve_experiment(force=True):
+                continue
+            self.tracking_available = True
+            try:
+                uploaded = self.spool.replay(self._replay_upload)
+                if uploaded:
+                    logger.info("Replay spool MLflow: {} record caricati", uploaded)
+            except Exception as e:
+                logger.warning("Replay dello spool MLflow interrotto: {}", e)
+                self.tracking_available = False
+                self.last_error = str(e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_length": self._queue.qsize(),
+            "max_queue": self._queue.maxsize,
+            "policy": self.policy,
+            "enqueued": self.enqueued,
+            "logged": self.logged,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "spooled": self.spooled,
+            "tracking_available": self.tracking_available,
+            "experiment_id": self.experiment_id,
+            "last_error": self.last_error,
+            "spool": self.spool.stats(),
+        }
+
+
+def _write_thumbnail(data: bytes, path: str, size: int) -> None:
+    # Pillow is only needed when thumbnails are enabled
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        # draft() lets JPEG decode directly at reduced scale
+        image.draft("RGB", (size, size))
+        image.thumbnail((size, size))
+        image.save(path, format="PNG")
+
+
+def _is_outage(error: Exception) -> bool:
+    """
+    True for connection problems and 5xx answers, as opposed to a record the
+    server rejected.
+    """
+    if isinstance(error, (requests.exceptions.RequestException, OSError)):
+        return True
+    if isinstance(error, MlflowException):
+        return error.get_http_status_code() >= 500
+    return False
+
+
+def _tracking_server_healthy() -> bool:
+    if not MLFLOW_TRACKING_URI.startswith(("http://", "https://")):
+        return True
+    try:
+        response = requests.get(f"{MLFLOW_TRACKING_URI.rstrip('/')}/health", timeout=2)
+        return response.ok
+    except requests.exceptions.RequestException:
         return False
 
 
+def _write_json(path: str, payload: Dict[str, Any]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2, default=str)
+
+
 def log_request_response(
-    route: str,
-    request_payload: Dict[str, Any],
-    response_payload: Dict[str, Any],
-    *,
-    experiment_name: str = MLFLOW_EXPERIMENT,
-    tags: Optional[Dict[str, str]] = None,
-    image_binary: Optional[bytes] = None,
-    final_prompt: Optional[str] = None,
+    client: MlflowClient, experiment_id: str, record: Dict[str, Any]
 ) -> None:
     """
-    Log request/response as JSON artifacts in MLflow under the given experiment.
+    Log request/response as a single MLflow run under the given experiment.
 
-    - Creates the experiment if it doesn't exist.
-    - Starts a run named after the route and user_id.
-    - Logs request.json, response.json, optionally an image, and final prompt as artifacts.
+    - The run is created with its tags in one call.
+    - Metrics are sent with a single log_batch.
+    - request.json, response.json, the optional image and the final prompt are
+      written to a temporary directory and uploaded with one log_artifacts.
+      The image is stored as the raw downloaded bytes, without re-encoding.
     """
-    if not setup_mlflow(experiment_name):  # MLflow not available or misconfigured
-        return
-
+    route = record["route"]
+    request_payload = record["request"]
+    response_payload = record["response"]
     user_id = request_payload.get("user_id")
     run_name = (
         f"{route}-user-{user_id}-{uuid.uuid4()}" if user_id is not None else route
     )
 
+    tags: Dict[str, str] = {"route": route, "user_id": str(user_id)}
+    tags.update(record.get("tags") or {})
+
+    run = client.create_run(experiment_id, tags=tags, run_name=run_name)
+    run_id = run.info.run_id
+    status = "FAILED"
     try:
-        with mlflow.start_run(run_name=run_name):
-            base_tags: Dict[str, str] = {"route": route}
-            base_tags["user_id"] = str(user_id)
-            if tags:
-                base_tags.update(tags)
-            mlflow.set_tags(base_tags)
-
-            # Log JSON artifacts
-            mlflow.log_dict(request_payload, "request.json")
-            mlflow.log_dict(response_payload, "response.json")
-
-            # Optional simple metrics
-            text_val = response_payload.get("text")
-            if isinstance(text_val, str):
-                mlflow.log_metric("text_length", len(text_val))
-            if image_binary:
-                mlflow.log_image(image_binary, key=f"image_{user_id}")
-
-            # Log final prompt as text artifact
-            if final_prompt:
-                mlflow.log_text(final_prompt, "final_prompt.txt")
-
-            logger.info(
-                "Esecuzione loggata su MLflow (exp: {}, run: {})",
-                experiment_name,
-                run_name,
+        # Optional simple metrics
+        text_val = response_payload.get("text")
+        if isinstance(text_val, str):
+            timestamp = int(record["created_at"] * 1000)
+            client.log_batch(
+                run_id, metrics=[Metric("text_length", len(text_val), timestamp, 0)]
             )
-    except Exception as e:
-        logger.warning("MLflow logging skipped per errore: {}", e)
 
+        with tempfile.TemporaryDirectory(prefix="mlflow-record-") as tmp:
+            _write_json(os.path.join(tmp, "request.json"), request_payload)
+            _write_json(os.path.join(tmp, "response.json"), response_payload)
+            if record.get("final_prompt"):
+                path = os.path.join(tmp, "final_prompt.txt")
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(record["final_prompt"])
+            # Only records spooled by earlier versions carry the image bytes
+            image = record.get("image")
+            if not image and record.get("image_hash"):
+                # Images in the content-addressed store are read at upload time
+                image = image_store.read(record["image_hash"])
+            if image:
+                extension = sniff_image_type(image)[0]
+                with open(os.path.join(tmp, f"image_{user_id}.{extension}"), "wb") as f:
+                    f.write(image)
+                if MLFLOW_IMAGE_THUMBNAIL_PX > 0:
+                    try:
+                        _write_thumbnail(
+                            image,
+                            os.path.join(tmp, f"thumbnail_{user_id}.png"),
+                            MLFLOW_IMAGE_THUMBNAIL_PX,
+                        )
+                    except Exception as e:
+                        logger.warning("Thumbnail non generata: {}", e)
+            client.log_artifacts(run_id, tmp)
 
-def log_on_mlflow(
-    mode, request, response_payload, image_binary=None, final_prompt=None
-):
-    try:
-        req_payload = request.model_dump()
-        log_request_response(
-            mode,
-            req_payload,
-            response_payload,
-            image_binary=image_binary,
-            final_prompt=final_prompt,
+        status = "FINISHED"
+        logger.info(
+            "Esecuzione loggata su MLflow (exp: {}, run: {})",
+            experiment_id,
+            run_name,
         )
+    finally:
+        client.set_terminated(run_id, status=status)
+
+
+mlflow_log_queue = MlflowLogQueue(
+    MLFLOW_EXPERIMENT,
+    maxsize=MLFLOW_QUEUE_SIZE,
+    policy=MLFLOW_QUEUE_POLICY,
+    block_timeout=MLFLOW_QUEUE_BLOCK_TIMEOUT_S,
+    batch_size=MLFLOW_LOG_BATCH_SIZE,
+    spool=MlflowSpool(
+        MLFLOW_SPOOL_DIR,
+        segment_bytes=MLFLOW_SPOOL_SEGMENT_BYTES,
+        max_bytes=MLFLOW_SPOOL_MAX_BYTES,
+        fsync=MLFLOW_SPOOL_FSYNC,
+    ),
+    replay_interval=MLFLOW_SPOOL_REPLAY_INTERVAL_S,
+)
+
+
+async def submit_log_on_mlflow(
+    mode,
+    request,
+    response_payload,
+    final_prompt=None,
+    image_hash: Optional[str] = None,
+    tags: Optional[Dict[str, str]] = None,
+) -> None:
+    """
+    Queue a request/response record for background logging on MLflow.
+
+    Never waits on the tracking server: the record is uploaded by the
+    mlflow_log_queue worker, or dropped according to MLFLOW_QUEUE_POLICY.
+    For images already in the image store pass image_hash: only the hash is
+    queued (and spooled), the bytes are read when the run is uploaded.
+    """
+    try:
+        record = {
+            "route": mode,
+            "request": request.model_dump(),
+            "response": response_payload,
+            "image_hash": image_hash,
+            "final_prompt": final_prompt,
+            "tags": tags,
+            "created_at": time.time(),
+        }
+        with stage("mlflow_submit"):
+            accepted = await mlflow_log_queue.submit_async(record)
+        if not accepted:
+            logger.warning("MLflow logging skipped: coda piena")
     except Exception as e:
         logger.warning("MLflow logging skipped per errore: {}", e)
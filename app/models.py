@@ -6,6 +6,18 @@ from pydantic import BaseModel, Field
 class Request(BaseModel):
     user_id: str = Field(..., description="id dell'utente")
     info: Optional[str] = Field(None, description="informazioni aggiuntive")
+    use_cache: bool = Field(
+        True, description="se False ignora la cache delle generazioni"
+    )
+
+
+class BatchRequest(BaseModel):
+    requests: list[Request] = Field(
+        ..., min_length=1, description="richieste da elaborare"
+    )
+    concurrency: Optional[int] = Field(
+        None, ge=1, description="numero massimo di generazioni in parallelo"
+    )
 
 
 class UserAggregatedData(BaseModel):
@@ -37,3 +49,22 @@ class ValidationResult(BaseModel):
     data: Optional[UserAggregatedData] = Field(
         None, description="Dati aggregati dell'utente"
     )
+
+
+class GenerationResult(BaseModel):
+    """
+    Risultato di una generazione (testo o hash dell'immagine)
+    """
+
+    content: str = Field(..., description="Testo generato o hash dell'immagine")
+    cache_hit: bool = Field(False, description="Indica se servito dalla cache")
+
+
+class RenderedPrompt(BaseModel):
+    """
+    Prompt renderizzato una sola volta e condiviso tra generazione e logging
+    """
+
+    template: str = Field(..., description="Nome del template usato")
+    text: str = Field(..., description="Prompt finale renderizzato")
+    render_ms: float = Field(0.0, description="Tempo di rendering in millisecondi")
@@ -0,0 +1,479 @@
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import random
+import re
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Mapping,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+import openai
+from fastapi import HTTPException
+from loguru import logger
+
+from .metrics import OPENAI_QUEUE_WAIT, OPENAI_REQUEST_DURATION
+
+T = TypeVar("T")
+
+# Classi di priorità: valori più bassi vengono serviti prima
+INTERACTIVE = 0
+BATCH = 1
+# Scarto delle immagini rispetto al testo della stessa classe
+IMAGE = 2
+PRIORITY_NAMES = {
+    INTERACTIVE: "interactive",
+    BATCH: "batch",
+    INTERACTIVE + IMAGE: "image",
+    BATCH + IMAGE: "batch_image",
+}
+
+OPENAI_DEFAULT_RPM = int(os.getenv("OPENAI_DEFAULT_RPM", "500"))
+OPENAI_DEFAULT_TPM = int(os.getenv("OPENAI_DEFAULT_TPM", "200000"))
+# Limiti per modello (rpm, tpm, concurrency), es.
+# {"dall-e-3": {"rpm": 7}, "gpt-5-nano": {"rpm": 500, "tpm": 200000}}
+OPENAI_RATE_LIMITS = json.loads(os.getenv("OPENAI_RATE_LIMITS", "{}"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "32"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "4"))
+OPENAI_BACKOFF_BASE_S = float(os.getenv("OPENAI_BACKOFF_BASE_S", "0.5"))
+OPENAI_BACKOFF_MAX_S = float(os.getenv("OPENAI_BACKOFF_MAX_S", "20"))
+# Stima dei token di output usata per prenotare il budget TPM
+OPENAI_COMPLETION_TOKENS_ESTIMATE = int(
+    os.getenv("OPENAI_COMPLETION_TOKENS_ESTIMATE", "800")
+)
+
+# Priorità della richiesta corrente; i task ereditano il valore del chiamante
+request_priority: ContextVar[int] = ContextVar(
+    "request_priority", default=INTERACTIVE
+)
+
+# Errori transitori per cui la chiamata viene ritentata
+_RETRYABLE = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+class OpenAIRateLimited(HTTPException):
+    """
+    Quota OpenAI esaurita anche dopo i retry: arriva al client come 429
+    """
+
+    def __init__(self, retry_after: float) -> None:
+        self.retry_after = retry_after
+        super().__init__(
+            status_code=429,
+            detail="Limite di richieste OpenAI raggiunto, riprovare più tardi",
+            headers={"Retry-After": str(max(1, int(retry_after + 0.999)))},
+        )
+
+
+def _parse_duration(value: Optional[str]) -> Optional[float]:
+    # Formato degli header di OpenAI: "20ms", "1s", "6m0s", "1h2m3.5s"
+    if not value:
+        return None
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def _header_int(headers: Mapping[str, str], name: str) -> Optional[int]:
+    try:
+        return int(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    if not headers:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    return _parse_duration(headers.get("retry-after")) or _parse_duration(
+        headers.get("x-ratelimit-reset-requests")
+    )
+
+
+def image_priority() -> int:
+    """
+    Priorità di una generazione di immagine: la classe della richiesta
+    corrente (interattiva o batch) spostata dopo il testo della stessa classe
+    """
+    return request_priority.get() + IMAGE
+
+
+def estimate_tokens(*texts: str) -> int:
+    """
+    Stima grossolana dei token di una chat: ~4 caratteri per token in input
+    più la stima dei token di output
+    """
+    return sum(len(t) for t in texts) // 4 + OPENAI_COMPLETION_TOKENS_ESTIMATE
+
+
+class TokenBucket:
+    """
+    Token bucket con ricarica continua, dimensionato su un limite al minuto.
+    Un limite pari a 0 disattiva il controllo.
+    """
+
+    def __init__(self, per_minute: int) -> None:
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if self.capacity > 0:
+            self.level = min(
+                self.capacity, self.level + (now - self._updated) * self.capacity / 60
+            )
+        self._updated = now
+
+    def time_until(self, amount: float) -> float:
+        if self.capacity <= 0:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.capacity
+
+    def take(self, amount: float) -> None:
+        if self.capacity > 0:
+            self._refill()
+            self.level -= min(amount, self.capacity)
+
+    def observe(self, limit: Optional[int], remaining: Optional[int]) -> None:
+        """
+        Riallinea il bucket ai valori riportati dagli header di OpenAI
+        """
+        self._refill()
+        if limit:
+            self.capacity = float(limit)
+        if remaining is not None and self.capacity > 0:
+            self.level = min(self.level, float(remaining))
+
+
+class ModelLimiter:
+    """
+    Controllo di ammissione delle chiamate verso un modello.
+
+    Una chiamata parte quando c'è uno slot di concorrenza libero e i bucket
+    di richieste e token hanno budget sufficiente; i chiamanti in attesa
+    vengono serviti per priorità e poi in ordine di arrivo. La concorrenza
+    si adatta (AIMD): cresce lentamente finché gli header indicano margine e
+    si dimezza a ogni 429.
+    """
+
+    def __init__(self, model: str, rpm: int, tpm: int, max_concurrency: int) -> None:
+        self.model = model
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(max_concurrency)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.calls = 0
+        self.rate_limited = 0
+        self._waiters: list = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def acquire(self, priority: int, tokens: int) -> None:
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), tokens, future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Slot già assegnato ma il chiamante non lo userà
+                self.release()
+            else:
+                future.cancel()
+                self._dispatch()
+            raise
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._waiters:
+            _, _, tokens, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if self.in_flight >= max(1, int(self.concurrency)):
+                return  # riprova al prossimo release
+            wait = max(
+                self.paused_until - time.monotonic(),
+                self.requests.time_until(1),
+                self.tokens.time_until(tokens),
+            )
+            if wait > 0:
+                self._schedule(wait)
+                return
+            heapq.heappop(self._waiters)
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self.in_flight += 1
+            self.calls += 1
+            future.set_result(None)
+
+    def _schedule(self, delay: float) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def on_success(self, headers: Optional[Mapping[str, str]]) -> None:
+        headers = headers or {}
+        limit = _header_int(headers, "x-ratelimit-limit-requests")
+        remaining = _header_int(headers, "x-ratelimit-remaining-requests")
+        self.requests.observe(limit, remaining)
+        self.tokens.observe(
+            _header_int(headers, "x-ratelimit-limit-tokens"),
+            _header_int(headers, "x-ratelimit-remaining-tokens"),
+        )
+        # Additive increase finché resta almeno il 10% della quota
+        if remaining is None or not limit or remaining > limit * 0.1:
+            self.concurrency = min(
+                self.max_concurrency, self.concurrency + 1 / self.concurrency
+            )
+
+    def on_rate_limited(self, retry_after: Optional[float]) -> None:
+        self.rate_limited += 1
+        self.concurrency = max(1.0, self.concurrency / 2)
+        if retry_after:
+            self.paused_until = max(
+                self.paused_until, time.monotonic() + retry_after
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        waiting: Dict[str, int] = {}
+        for priority, _, _, future in self._waiters:
+            if not future.done():
+                name = PRIORITY_NAMES.get(priority, str(priority))
+                waiting[name] = waiting.get(name, 0) + 1
+        return {
+            "concurrency_limit": round(self.concurrency, 2),
+            "in_flight": self.in_flight,
+            "waiting": waiting,
+            "rpm_limit": int(self.requests.capacity),
+            "tpm_limit": int(self.tokens.capacity),
+            "calls": self.calls,
+            "rate_limited": self.rate_limited,
+        }
+
+
+class OpenAIScheduler:
+    """
+    Punto unico di passaggio delle chiamate a OpenAI (testo, immagini ed
+    estrazione): limiti per modello, priorità, retry con backoff e jitter.
+    """
+
+    def __init__(
+        self, max_retries: int, backoff_base: float, backoff_max: float
+    ) -> None:
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retries = 0
+        self.exhausted = 0
+        self._limiters: Dict[str, ModelLimiter] = {}
+
+    def limiter(self, model: str) -> ModelLimiter:
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            limits = OPENAI_RATE_LIMITS.get(model, {})
+            limiter = ModelLimiter(
+                model,
+                rpm=int(limits.get("rpm", OPENAI_DEFAULT_RPM)),
+                tpm=int(limits.get("tpm", OPENAI_DEFAULT_TPM)),
+                max_concurrency=int(
+                    limits.get("concurrency", OPENAI_MAX_CONCURRENCY)
+                ),
+            )
+            self._limiters[model] = limiter
+        return limiter
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        # Full jitter, senza scendere sotto il Retry-After indicato dal server
+        cap = min(self.backoff_max, self.backoff_base * 2**attempt)
+        delay = random.uniform(0, cap)
+        return max(delay, retry_after or 0.0)
+
+    async def call(
+        self,
+        model: str,
+        fn: Callable[[], Awaitable[T]],
+        tokens: int = 0,
+        priority: Optional[int] = None,
+    ) -> T:
+        """
+        Esegue una chiamata OpenAI rispettando limiti e priorità.
+
+        Args:
+            model: Modello chiamato, determina i limiti applicati
+            fn: Coroutine factory; deve restituire una risposta raw
+                (with_raw_response) per poterne leggere gli header
+            tokens: Token stimati della chiamata (0 per le immagini)
+            priority: Classe di priorità; di default quella della richiesta
+
+        Returns:
+            La risposta raw di OpenAI
+
+        Raises:
+            OpenAIRateLimited: se la quota resta esaurita dopo i retry
+        """
+        limiter = self.limiter(model)
+        response, started = await self._open(limiter, fn, tokens, priority)
+        self._finish(limiter, started, None)
+        return response
+
+    @asynccontextmanager
+    async def stream(
+        self,
+        model: str,
+        fn: Callable[[], Awaitable[T]],
+        tokens: int = 0,
+        priority: Optional[int] = None,
+    ) -> AsyncIterator[T]:
+        """
+        Come call, per le risposte in streaming: lo slot di concorrenza resta
+        occupato finché il blocco non ha finito di consumare lo stream, così
+        anche un 429 ricevuto a metà stream arriva al limiter.
+
+        Raises:
+            OpenAIRateLimited: se la quota resta esaurita dopo i retry o lo
+                stream viene interrotto da un 429
+        """
+        limiter = self.limiter(model)
+        response, started = await self._open(limiter, fn, tokens, priority)
+        error: Optional[BaseException] = None
+        try:
+            yield response
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._finish(limiter, started, error)
+            if isinstance(error, openai.RateLimitError):
+                self.exhausted += 1
+                raise OpenAIRateLimited(
+                    self._error_retry_after(error) or self.backoff_max
+                ) from error
+
+    async def _open(
+        self,
+        limiter: ModelLimiter,
+        fn: Callable[[], Awaitable[T]],
+        tokens: int,
+        priority: Optional[int],
+    ) -> Tuple[T, float]:
+        """
+        Attende uno slot ed esegue fn, con i retry sugli errori transitori.
+        In caso di successo lo slot resta occupato: va liberato con _finish.
+        """
+        if priority is None:
+            priority = request_priority.get()
+
+        for attempt in range(self.max_retries + 1):
+            queued = time.monotonic()
+            await limiter.acquire(priority, tokens)
+            started = time.monotonic()
+            OPENAI_QUEUE_WAIT.labels(
+                limiter.model, PRIORITY_NAMES.get(priority, str(priority))
+            ).observe(started - queued)
+            try:
+                response = await fn()
+            except _RETRYABLE as e:
+                self._finish(limiter, started, e)
+                error: Exception = e
+            except BaseException as e:
+                self._finish(limiter, started, e)
+                raise
+            else:
+                limiter.on_success(getattr(response, "headers", None))
+                return response, started
+
+            if attempt == self.max_retries:
+                break
+            self.retries += 1
+            delay = self._backoff(attempt, self._error_retry_after(error))
+            logger.warning(
+                f"[OPENAI: {limiter.model}] {type(error).__name__}, "
+                f"retry tra {delay:.2f}s"
+            )
+            await asyncio.sleep(delay)
+
+        self.exhausted += 1
+        if isinstance(error, openai.RateLimitError):
+            raise OpenAIRateLimited(
+                self._error_retry_after(error) or self.backoff_max
+            )
+        raise error
+
+    @staticmethod
+    def _error_retry_after(error: BaseException) -> Optional[float]:
+        if isinstance(error, openai.RateLimitError):
+            return _retry_after(error.response.headers)
+        return None
+
+    def _finish(
+        self, limiter: ModelLimiter, started: float, error: Optional[BaseException]
+    ) -> None:
+        """
+        Libera lo slot della chiamata e ne registra esito e durata
+        """
+        if error is None:
+            outcome = "ok"
+        elif isinstance(error, openai.RateLimitError):
+            outcome = "rate_limited"
+            limiter.on_rate_limited(self._error_retry_after(error))
+        elif isinstance(error, _RETRYABLE):
+            outcome = type(error).__name__
+        else:
+            outcome = "error"
+        limiter.release()
+        OPENAI_REQUEST_DURATION.labels(limiter.model, outcome).observe(
+            time.monotonic() - started
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "retries": self.retries,
+            "exhausted": self.exhausted,
+            "models": {m: limiter.stats() for m, limiter in self._limiters.items()},
+        }
+
+
+openai_scheduler = OpenAIScheduler(
+    max_retries=OPENAI_MAX_RETRIES,
+    backoff_base=OPENAI_BACKOFF_BASE_S,
+    backoff_max=OPENAI_BACKOFF_MAX_S,
+)
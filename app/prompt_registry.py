@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, Template
+
+from .metrics import stage
+from .models import RenderedPrompt
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), "templates")
+# In sviluppo i template modificati vengono ricaricati senza riavviare l'API
+TEMPLATE_AUTO_RELOAD = os.getenv("TEMPLATE_AUTO_RELOAD", "false").lower() == "true"
+TEMPLATE_BYTECODE_CACHE_DIR = os.getenv(
+    "TEMPLATE_BYTECODE_CACHE_DIR", os.path.join(".cache", "jinja")
+)
+
+
+class PromptRegistry:
+    """
+    Registro dei template Jinja2 dei prompt.
+
+    Tutti i template della cartella vengono compilati una volta all'avvio
+    (con cache del bytecode su disco, così i riavvii non li ricompilano) e
+    poi solo renderizzati. Con auto_reload i template modificati su disco
+    vengono ricompilati al rendering successivo.
+    """
+
+    def __init__(
+        self,
+        template_dir: str,
+        auto_reload: bool = False,
+        bytecode_cache_dir: Optional[str] = None,
+    ) -> None:
+        self.template_dir = template_dir
+        self.auto_reload = auto_reload
+        self.bytecode_cache_dir = bytecode_cache_dir
+        self._env: Optional[Environment] = None
+        self._templates: Dict[str, Template] = {}
+        self._metrics: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        """
+        Compila tutti i template .j2 della cartella
+        """
+        bytecode_cache = None
+        if self.bytecode_cache_dir:
+            os.makedirs(self.bytecode_cache_dir, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(self.bytecode_cache_dir)
+
+        env = Environment(
+            loader=FileSystemLoader(self.template_dir),
+            auto_reload=self.auto_reload,
+            bytecode_cache=bytecode_cache,
+        )
+        templates = {
+            name: env.get_template(name)
+            for name in env.list_templates(extensions=["j2"])
+        }
+        with self._lock:
+            self._env = env
+            self._templates = templates
+
+    def get_template(self, template_name: str) -> Template:
+        if self._env is None:
+            self.load()
+        if self.auto_reload:
+            # get_template verifica se il file è cambiato e lo ricompila
+            return self._env.get_template(template_name)
+        template = self._templates.get(template_name)
+        if template is None:
+            raise ValueError(f"Template {template_name} non trovato")
+        return template
+
+    def render(self, template_name: str, data: Dict[str, Any]) -> RenderedPrompt:
+        """
+        Renderizza un template registrando il tempo impiegato
+
+        Args:
+            template_name: Nome del template
+            data: Dati da passare al template
+
+        Returns:
+            Prompt renderizzato
+        """
+        template = self.get_template(template_name)
+        started = time.perf_counter()
+        try:
+            with stage("prompt_render"):
+                text = template.render(**data)
+        except Exception as e:
+            raise Exception(f"Errore nel rendering del template {template_name}: {e}")
+        render_ms = (time.perf_counter() - started) * 1000
+
+        with self._lock:
+            metrics = self._metrics.setdefault(
+                template_name, {"renders": 0, "total_ms": 0.0, "max_ms": 0.0}
+            )
+            metrics["renders"] += 1
+            metrics["total_ms"] += render_ms
+            metrics["max_ms"] = max(metrics["max_ms"], render_ms)
+
+        return RenderedPrompt(template=template_name, text=text, render_ms=render_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            templates = {
+                name: {
+                    "renders": int(m["renders"]),
+                    "avg_ms": round(m["total_ms"] / m["renders"], 3),
+                    "max_ms": round(m["max_ms"], 3),
+                }
+                for name, m in self._metrics.items()
+            }
+            return {
+                "compiled": len(self._templates),
+                "auto_reload": self.auto_reload,
+                "templates": templates,
+            }
+
+
+prompt_registry = PromptRegistry(
+    TEMPLATE_DIR,
+    auto_reload=TEMPLATE_AUTO_RELOAD,
+    bytecode_cache_dir=TEMPLATE_BYTECODE_CACHE_DIR,
+)
@@ -1,23 +1,120 @@
+import asyncio
 import json
 import os
 from typing import Any, Dict, Optional
 
-import openai
-from jinja2 import Environment, FileSystemLoader
-
-from .database import check_required_fields, get_user_aggregated_data
+from loguru import logger
+
+from .cache import MISSING, TTLCache
+from .database import (
+    check_required_fields,
+    get_lookup_values,
+    get_user_aggregated_data,
+    get_users_aggregated_data,
+)
+from .http_client import outbound_http
+from .info_extractor import extract_fields
+from .metrics import record_cache, stage
 from .models import Request, UserAggregatedData, ValidationResult
+from .openai_scheduler import estimate_tokens, openai_scheduler
+from .prompt_registry import prompt_registry
+
+INFO_EXTRACTION_CACHE_SIZE = int(os.getenv("INFO_EXTRACTION_CACHE_SIZE", "10000"))
+INFO_EXTRACTION_CACHE_TTL_S = float(os.getenv("INFO_EXTRACTION_CACHE_TTL_S", "3600"))
+
+extraction_cache = TTLCache(
+    maxsize=INFO_EXTRACTION_CACHE_SIZE, ttl=INFO_EXTRACTION_CACHE_TTL_S
+)
+extraction_stats = {"rule_fields": 0, "llm_calls": 0, "llm_errors": 0}
+
+EXTRACTION_SYSTEM_PROMPT = "Sei un assistente che estrae informazioni strutturate dal testo in formato JSON."
+
+
+def _parse_key_values(info: str, fields: list[str]) -> Dict[str, Any]:
+    """
+    Parsing semplice di coppie chiave=valore, usato se l'LLM non risponde
+    """
+    extracted_info = {}
+    try:
+        lines = info.replace(",", "\n").split("\n")
+        for line in lines:
+            if "=" in line:
+                key, value = line.split("=", 1)
+                key = key.strip().lower().replace(" ", "_")
+                if key in fields:
+                    value = value.strip()
+                    try:
+                        if "." in value:
+                            extracted_info[key] = float(value)
+                        else:
+                            extracted_info[key] = int(value)
+                    except ValueError:
+                        extracted_info[key] = value
+    except Exception:
+        pass
+    return extracted_info
 
 
-def extract_info_from_request(
+async def _extract_info_with_llm(info: str, fields: list[str]) -> Dict[str, Any]:
+    """
+    Estrae con l'LLM i campi che l'estrattore a regole non ha risolto
+    """
+    prompt = prompt_registry.render(
+        "extract_info_prompt.j2", {"missing_fields": fields, "info": info}
+    )
+
+    model = os.environ.get("OPENAI_MODEL", "gpt-5-mini")
+    with stage("extraction_llm"):
+        raw_response = await openai_scheduler.call(
+            model,
+            lambda: outbound_http.openai.chat.completions.with_raw_response.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": EXTRACTION_SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt.text},
+                ],
+                response_format={"type": "json_object"},
+            ),
+            tokens=estimate_tokens(EXTRACTION_SYSTEM_PROMPT, prompt.text),
+        )
+    response = raw_response.parse()
+
+    if not response.choices or not response.choices[0].message.content:
+        return {}
+
+    extracted_info = json.loads(response.choices[0].message.content)
+
+    # Post-processing per tentare di convertire i tipi
+    processed_info = {}
+    for key, value in extracted_info.items():
+        if key not in fields:
+            continue  # Ignora chiavi non richieste
+        try:
+            if isinstance(value, str):
+                if "." in value:
+                    processed_info[key] = float(value)
+                else:
+                    processed_info[key] = int(value)
+            else:
+                processed_info[key] = value
+        except (ValueError, TypeError):
+            processed_info[key] = value
+    return processed_info
+
+
+async def extract_info_from_request(
     info: Optional[str], missing_fields: list[str]
 ) -> Dict[str, Any]:
     """
-    Estrae informazioni aggiuntive dal campo info della request, usando un LLM.
+    Estrae informazioni aggiuntive dal campo info della request.
+
+    Prima viene applicato l'estrattore deterministico a regole; l'LLM viene
+    interpellato solo per i campi che restano irrisolti. I risultati sono
+    memorizzati per coppia (info, missing_fields).
 
     Args:
         info: Campo info della request contenente informazioni aggiuntive.
-        missing_fields: Lista di campi che l'LLM dovrebbe cercare di estrarre.
+        missing_fields: Lista di campi da cercare di estrarre.
 
     Returns:
         Dizionario con le informazioni estratte.
@@ -32,77 +129,115 @@ def extract_info_from_request(
     except json.JSONDecodeError:
         pass
 
-    try:
-        # Setup Jinja2 environment
-        template_dir = os.path.join(os.path.dirname(__file__), "templates")
-        env = Environment(loader=FileSystemLoader(template_dir))
-        template = env.get_template("extract_info_prompt.j2")
-
-        # Render the prompt
-        prompt = template.render(missing_fields=missing_fields, info=info)
-
-        # La chiave API di OpenAI deve essere impostata come variabile d'ambiente OPENAI_API_KEY
-        client = openai.OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-
-        response = client.chat.completions.create(
-            model=os.environ.get("OPENAI_MODEL", "gpt-5-mini"),
-            messages=[
-                {
-                    "role": "system",
-                    "content": "Sei un assistente che estrae informazioni strutturate dal testo in formato JSON.",
-                },
-                {"role": "user", "content": prompt},
+    cache_key = (info, tuple(missing_fields))
+    cached = extraction_cache.get(cache_key)
+    record_cache("info_extraction", cached is not MISSING)
+    if cached is not MISSING:
+        return dict(cached)
+
+    lookups = await get_lookup_values()
+    with stage("extraction_rules"):
+        extracted_info = extract_fields(info, missing_fields, lookups)
+    remaining = [field for field in missing_fields if field not in extracted_info]
+    extraction_stats["rule_fields"] += len(extracted_info)
+
+    if remaining:
+        extraction_stats["llm_calls"] += 1
+        try:
+            extracted_info.update(await _extract_info_with_llm(info, remaining))
+        except Exception as e:
+            logger.error(
+                f"Errore durante la chiamata all'LLM per l'estrazione delle info: {e}"
+            )
+            extraction_stats["llm_errors"] += 1
+            # Fallback al parsing semplice; il risultato parziale non va in cache
+            extracted_info.update(_parse_key_values(info, remaining))
+            return extracted_info
+
+    extraction_cache.set(cache_key, extracted_info)
+    return dict(extracted_info)
+
+
+def get_extraction_stats() -> Dict[str, Any]:
+    """
+    Statistiche dell'estrazione dei campi dal testo libero
+    """
+    return {**extraction_stats, "cache": extraction_cache.stats()}
+
+
+async def _check_user_data(
+    request: Request, user_data: Optional[Dict[str, Any]]
+) -> ValidationResult:
+    """
+    Controlla i dati aggregati di un utente, integrando i campi mancanti con
+    quanto estratto dal campo info della request
+    """
+    if not user_data:
+        return ValidationResult(
+            is_valid=False,
+            missing_fields=[
+                "user_id",
+                "year",
+                "region",
+                "travel_mode",
+                "travel_motive",
+                "trip_count",
+                "km_travelled",
             ],
-            response_format={"type": "json_object"},
+            message=f"Nessun dato trovato per l'utente {request.user_id}",
         )
 
-        if response.choices and response.choices[0].message.content:
-            extracted_info = json.loads(response.choices[0].message.content)
+    # Controlla i campi mancanti
+    missing_fields = check_required_fields(user_data)
 
-            # Post-processing per tentare di convertire i tipi
-            processed_info = {}
-            for key, value in extracted_info.items():
-                if key not in missing_fields:
-                    continue  # Ignora chiavi non richieste
-                try:
-                    if isinstance(value, str):
-                        if "." in value:
-                            processed_info[key] = float(value)
-                        else:
-                            processed_info[key] = int(value)
-                    else:
-                        processed_info[key] = value
-                except (ValueError, TypeError):
-                    processed_info[key] = value
-            return processed_info
+    if missing_fields:
+        # Prova a recuperare informazioni mancanti dal campo info
+        additional_info = await extract_info_from_request(
+            request.info, missing_fields
+        )
 
+        # Aggiorna i dati con le informazioni aggiuntive
+        for field in missing_fields.copy():
+            if field in additional_info:
+                # Make sure the key exists before assigning
+                if additional_info.get(field) is not None:
+                    user_data[field] = additional_info[field]
+                    missing_fields.remove(field)
+
+        # Controlla di nuovo i campi mancanti
+        if missing_fields:
+            return ValidationResult(
+                is_valid=False,
+                missing_fields=missing_fields,
+                message=f"Campi mancanti per l'utente {request.user_id}: {', '.join(missing_fields)}",
+            )
+
+    # Tutti i dati sono presenti, crea il modello UserAggregatedData
+    try:
+        aggregated_data = UserAggregatedData(**user_data)
+        return ValidationResult(
+            is_valid=True,
+            missing_fields=[],
+            message="Dati dell'utente completi",
+            data=aggregated_data,
+        )
     except Exception as e:
-        print(f"Errore durante la chiamata all'LLM per l'estrazione delle info: {e}")
-        # Fallback al parsing semplice in caso di errore dell'LLM
-        extracted_info = {}
-        try:
-            lines = info.replace(",", "\n").split("\n")
-            for line in lines:
-                if "=" in line:
-                    key, value = line.split("=", 1)
-                    key = key.strip().lower().replace(" ", "_")
-                    if key in missing_fields:
-                        value = value.strip()
-                        try:
-                            if "." in value:
-                                extracted_info[key] = float(value)
-                            else:
-                                extracted_info[key] = int(value)
-                        except ValueError:
-                            extracted_info[key] = value
-        except Exception:
-            pass
-        return extracted_info
+        return ValidationResult(
+            is_valid=False,
+            missing_fields=["validation_error"],
+            message=f"Errore nella validazione dei dati: {e}",
+        )
 
-    return {}
 
+def _database_error(e: Exception) -> ValidationResult:
+    return ValidationResult(
+        is_valid=False,
+        missing_fields=["database_error"],
+        message=f"Errore nel recupero dei dati: {e}",
+    )
 
-def validate_user_data(request: Request) -> ValidationResult:
+
+async def validate_user_data(request: Request) -> ValidationResult:
     """
     Prompt checker: valida se abbiamo tutte le informazioni aggregate per l'utente
 
@@ -114,68 +249,82 @@ def validate_user_data(request: Request) -> ValidationResult:
     """
     try:
         # Recupera i dati aggregati dal database
-        user_data = get_user_aggregated_data(request.user_id)
+        user_data = await get_user_aggregated_data(request.user_id)
+        return await _check_user_data(request, user_data)
+    except Exception as e:
+        return _database_error(e)
 
-        if not user_data:
-            return ValidationResult(
-                is_valid=False,
-                missing_fields=[
-                    "user_id",
-                    "year",
-                    "region",
-                    "travel_mode",
-                    "travel_motive",
-                    "trip_count",
-                    "km_travelled",
-                ],
-                message=f"Nessun dato trovato per l'utente {request.user_id}",
-            )
 
-        # Controlla i campi mancanti
-        missing_fields = check_required_fields(user_data)
+async def validate_users_data(requests: list[Request]) -> list[ValidationResult]:
+    """
+    Prompt checker per un insieme di richieste: recupera i dati aggregati di
+    tutti gli utenti con un solo round trip al database
 
-        if missing_fields:
-            # Prova a recuperare informazioni mancanti dal campo info
-            additional_info = extract_info_from_request(request.info, missing_fields)
-
-            # Aggiorna i dati con le informazioni aggiuntive
-            for field in missing_fields.copy():
-                if field in additional_info:
-                    # Make sure the key exists before assigning
-                    if additional_info.get(field) is not None:
-                        user_data[field] = additional_info[field]
-                        missing_fields.remove(field)
-
-            # Controlla di nuovo i campi mancanti
-            if missing_fields:
-                return ValidationResult(
-                    is_valid=False,
-                    missing_fields=missing_fields,
-                    message=f"Campi mancanti per l'utente {request.user_id}: {', '.join(missing_fields)}",
-                )
-
-        # Tutti i dati sono presenti, crea il modello UserAggregatedData
+    Args:
+        requests: Richieste da validare
+
+    Returns:
+        Risultati della validazione, nello stesso ordine delle richieste
+    """
+    try:
+        users_data = await get_users_aggregated_data(r.user_id for r in requests)
+    except Exception as e:
+        return [_database_error(e) for _ in requests]
+
+    async def check(request: Request) -> ValidationResult:
         try:
-            aggregated_data = UserAggregatedData(**user_data)
-            return ValidationResult(
-                is_valid=True,
-                missing_fields=[],
-                message="Dati dell'utente completi",
-                data=aggregated_data,
+            user_id = int(request.user_id)
+        except ValueError:
+            user_id = None
+        user_data = users_data.get(user_id)
+        try:
+            # Copia: lo stesso utente può comparire più volte nel batch
+            return await _check_user_data(
+                request, dict(user_data) if user_data else None
             )
         except Exception as e:
-            return ValidationResult(
-                is_valid=False,
-                missing_fields=["validation_error"],
-                message=f"Errore nella validazione dei dati: {e}",
-            )
+            return _database_error(e)
 
-    except Exception as e:
-        return ValidationResult(
-            is_valid=False,
-            missing_fields=["database_error"],
-            message=f"Errore nel recupero dei dati: {e}",
-        )
+    return list(await asyncio.gather(*(check(r) for r in requests)))
+
+
+def validation_error_detail(validation_result: ValidationResult) -> Dict[str, Any]:
+    """
+    Dettaglio della risposta 400 per dati utente incompleti
+    """
+    return {
+        "error": "Dati utente incompleti",
+        "missing_fields": validation_result.missing_fields,
+        "message": validation_result.message,
+    }
+
+
+# Soglie (valore strettamente maggiore di) e relative categorie, dalla più
+# alta; l'ultima voce è la categoria di default. Usate anche dalla
+# pregenerazione offline (dataset/pregenerate_outputs.py).
+TRAVEL_FREQUENCY_BUCKETS = [
+    (200, "molto frequente"),
+    (100, "frequente"),
+    (50, "moderata"),
+    (None, "occasionale"),
+]
+TRAVEL_DISTANCE_BUCKETS = [
+    (5000, "lunghe distanze"),
+    (2000, "medie distanze"),
+    (None, "brevi distanze"),
+]
+
+
+def bucket_label(value: Optional[float], buckets: list) -> str:
+    """
+    Categoria di un valore numerico secondo le soglie indicate
+    """
+    if value is None:
+        return "dati non disponibili"
+    for threshold, label in buckets:
+        if threshold is None or value > threshold:
+            return label
+    return buckets[-1][1]
 
 
 def enhance_prompt_data(
@@ -205,27 +354,9 @@ def enhance_prompt_data(
     else:
         avg_km_per_trip = None
 
-    # Categorizza l'utente in base ai suoi viaggi
-    if data.trip_count is None:
-        travel_frequency = "dati non disponibili"
-    elif data.trip_count > 200:
-        travel_frequency = "molto frequente"
-    elif data.trip_count > 100:
-        travel_frequency = "frequente"
-    elif data.trip_count > 50:
-        travel_frequency = "moderata"
-    else:
-        travel_frequency = "occasionale"
-
-    # Categorizza in base ai km percorsi
-    if data.km_travelled is None:
-        travel_distance = "dati non disponibili"
-    elif data.km_travelled > 5000:
-        travel_distance = "lunghe distanze"
-    elif data.km_travelled > 2000:
-        travel_distance = "medie distanze"
-    else:
-        travel_distance = "brevi distanze"
+    # Categorizza l'utente in base ai suoi viaggi e ai km percorsi
+    travel_frequency = bucket_label(data.trip_count, TRAVEL_FREQUENCY_BUCKETS)
+    travel_distance = bucket_label(data.km_travelled, TRAVEL_DISTANCE_BUCKETS)
 
     enhanced_data = {
         "user_id": data.user_id,
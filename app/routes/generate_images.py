@@ -1,68 +1,193 @@
-import requests
-from fastapi import APIRouter, HTTPException
+import os
+from typing import Any, Dict
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from loguru import logger
-from PIL import Image
 
-from app.generation_service import generate_image_description, get_template_content
-from app.mlflow_utils import log_on_mlflow
-from app.models import Request
-from app.prompt_service import enhance_prompt_data, validate_user_data
+from app.batch_service import check_batch_size, run_batch
+from app.generation_service import generate_image_description
+from app.image_store import image_url
+from app.job_service import JobManager
+from app.mlflow_utils import submit_log_on_mlflow
+from app.models import BatchRequest, Request
+from app.prompt_registry import prompt_registry
+from app.prompt_service import (
+    enhance_prompt_data,
+    validate_user_data,
+    validation_error_detail,
+)
+from app.singleflight import flight_key, generation_flights
+from app.sse import SSE_KEEPALIVE, format_sse
+
+IMAGE_JOB_WORKERS = int(os.getenv("IMAGE_JOB_WORKERS", "4"))
+IMAGE_JOB_MAX_QUEUE = int(os.getenv("IMAGE_JOB_MAX_QUEUE", "1000"))
+IMAGE_JOB_RESULT_TTL_S = float(os.getenv("IMAGE_JOB_RESULT_TTL_S", "3600"))
+JOB_MAX_WAIT_S = 60.0
+SSE_HEARTBEAT_S = 15.0
 
 router = APIRouter()
 
 
-@router.post("/generate-image")
-async def generate_image(request: Request):
+async def _generate_image_payload(
+    request: Request, enhanced_data: Dict[str, Any]
+) -> Dict[str, Any]:
     """
-    Genera un'immagine rappresentativa di un utente in base ai suoi viaggi effettuati
+    Genera l'immagine a partire dai dati già validati e arricchiti
+    """
+    # Il prompt viene renderizzato una volta e usato per generazione e logging
+    prompt = prompt_registry.render("aggregate_image_prompt.j2", enhanced_data)
+
+    # Genera l'immagine usando OpenAI DALL-E
+    logger.info(f"[USER: {request.user_id}] Generazione immagine")
+    generation = await generate_image_description(prompt, use_cache=request.use_cache)
+    image_hash = generation.content
+
+    # URL stabile servito dall'API: le visualizzazioni successive non
+    # richiedono una nuova generazione
+    response_payload = {
+        "user_id": request.user_id,
+        "image_url": image_url(image_hash),
+        "image_hash": image_hash,
+        "enhanced_data": enhanced_data,
+        "validation_status": "success",
+        "cache_hit": generation.cache_hit,
+    }
+
+    # MLflow logging
+    await submit_log_on_mlflow(
+        "generate_image",
+        request,
+        response_payload,
+        image_hash=image_hash,
+        final_prompt=prompt.text,
+    )
+    return response_payload
+
+
+async def _run_image_pipeline(request: Request) -> Dict[str, Any]:
+    """
+    Pipeline completa di una richiesta immagine: validazione, arricchimento,
+    generazione, download e logging. Solleva HTTPException 400 se i dati
+    dell'utente sono incompleti.
     """
-    logger.info(f"[USER: {request.user_id}] Inizio generazione immagine per utente")
     try:
         # Prompt checker: valida i dati dell'utente
         logger.info(f"[USER: {request.user_id}] Validazione dati utente")
-        validation_result = validate_user_data(request)
+        validation_result = await validate_user_data(request)
 
         if not validation_result.is_valid:
             raise HTTPException(
-                status_code=400,
-                detail={
-                    "error": "Dati utente incompleti",
-                    "missing_fields": validation_result.missing_fields,
-                    "message": validation_result.message,
-                },
+                status_code=400, detail=validation_error_detail(validation_result)
             )
 
         # Prompt enhancer: arricchisce i dati per la generazione
         logger.info(f"[USER: {request.user_id}] Arricchimento dati utente")
         enhanced_data = enhance_prompt_data(validation_result, request)
 
-        # Genera il prompt finale per il logging
-        final_prompt = get_template_content("aggregate_image_prompt.j2", enhanced_data)
-
-        # Genera l'immagine usando OpenAI DALL-E
-        logger.info(f"[USER: {request.user_id}] Generazione immagine")
-        image_url = generate_image_description(enhanced_data)
-
-        # Load image with PIL
-        image = Image.open(requests.get(image_url, stream=True).raw)
-
-        response_payload = {
-            "user_id": request.user_id,
-            "image_url": image_url,
-            "enhanced_data": enhanced_data,
-            "validation_status": "success",
-        }
-
-        # MLflow logging
-        log_on_mlflow(
-            "generate_image",
-            request,
-            response_payload,
-            image_binary=image,
-            final_prompt=final_prompt,
-        )
-        return response_payload
+        return await _generate_image_payload(request, enhanced_data)
+    except HTTPException:
+        raise
     except Exception as e:
         # Log errore generico
-        log_on_mlflow("generate_image", request, {"error": str(e)})
+        await submit_log_on_mlflow("generate_image", request, {"error": str(e)})
+        raise
+
+
+async def _run_coalesced_image_pipeline(request: Request) -> Dict[str, Any]:
+    """
+    Richieste identiche in corso (anche tra route sincrona e job) condividono
+    la stessa esecuzione della pipeline
+    """
+    return await generation_flights.do(
+        flight_key("generate_image", request),
+        lambda: _run_image_pipeline(request),
+    )
+
+
+image_jobs = JobManager(
+    "image-jobs",
+    _run_coalesced_image_pipeline,
+    workers=IMAGE_JOB_WORKERS,
+    max_queue=IMAGE_JOB_MAX_QUEUE,
+    result_ttl=IMAGE_JOB_RESULT_TTL_S,
+)
+
+
+@router.post("/generate-image")
+async def generate_image(request: Request):
+    """
+    Genera un'immagine rappresentativa di un utente in base ai suoi viaggi effettuati
+    """
+    logger.info(f"[USER: {request.user_id}] Inizio generazione immagine per utente")
+    try:
+        return await _run_coalesced_image_pipeline(request)
+    except HTTPException:
+        raise
+    except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/generate-image/batch")
+async def generate_image_batch(batch: BatchRequest):
+    """
+    Genera le immagini di più utenti, restituendo i risultati in streaming
+    (NDJSON) man mano che sono pronti
+    """
+    check_batch_size(batch)
+    return StreamingResponse(
+        run_batch(batch, _generate_image_payload, "generate_image"),
+        media_type="application/x-ndjson",
+    )
+
+
+@router.post("/generate-image/jobs", status_code=202)
+async def create_image_job(request: Request):
+    """
+    Accoda la generazione di un'immagine e restituisce subito l'id del job
+    """
+    job = image_jobs.submit(request)
+    logger.info(f"[USER: {request.user_id}] Job immagine accodato: {job.job_id}")
+    return {
+        "job_id": job.job_id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.job_id}",
+        "events_url": f"/jobs/{job.job_id}/events",
+    }
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    wait: float = Query(
+        0, ge=0, le=JOB_MAX_WAIT_S, description="secondi di long-poll"
+    ),
+):
+    """
+    Stato o risultato di un job; con wait > 0 attende che il job termini
+    """
+    job = image_jobs.get(job_id)
+    if wait and not job.done:
+        await image_jobs.wait(job, wait)
+    return job.to_dict()
+
+
+@router.get("/jobs/{job_id}/events")
+async def get_job_events(job_id: str):
+    """
+    Stream SSE degli aggiornamenti di stato di un job, fino al risultato
+    """
+    job = image_jobs.get(job_id)
+
+    async def stream():
+        async for update in image_jobs.watch(job, heartbeat=SSE_HEARTBEAT_S):
+            if update is None:
+                yield SSE_KEEPALIVE
+            else:
+                yield format_sse(update.to_dict(), event=update.status)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
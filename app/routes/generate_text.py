@@ -1,63 +1,183 @@
+from typing import Any, Dict
+
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from loguru import logger
 
-from app.generation_service import generate_text_description, get_template_content
-from app.mlflow_utils import log_on_mlflow
-from app.models import Request
-from app.prompt_service import enhance_prompt_data, validate_user_data
+from app.batch_service import check_batch_size, run_batch
+from app.generation_service import generate_text_description, stream_text_description
+from app.mlflow_utils import submit_log_on_mlflow
+from app.models import BatchRequest, Request
+from app.prompt_registry import prompt_registry
+from app.prompt_service import (
+    enhance_prompt_data,
+    validate_user_data,
+    validation_error_detail,
+)
+from app.singleflight import flight_key, generation_flights
+from app.sse import format_sse
 
 router = APIRouter()
 
 
-@router.post("/generate-text")
-async def generate_text(request: Request):
+async def _generate_text_payload(
+    request: Request, enhanced_data: Dict[str, Any]
+) -> Dict[str, Any]:
     """
-    Genera una descrizione dettagliata di un singolo utente in base ai suoi viaggi effettuati
+    Genera la descrizione testuale a partire dai dati già validati e arricchiti
     """
-    logger.info(
-        f"[USER: {request.user_id}] Inizio generazione descrizione testuale per utente"
+    # Il prompt viene renderizzato una volta e usato per generazione e logging
+    prompt = prompt_registry.render("aggregate_text_prompt.j2", enhanced_data)
+
+    # Genera la descrizione testuale usando OpenAI
+    logger.info(f"[USER: {request.user_id}] Generazione descrizione testuale")
+    generation = await generate_text_description(prompt, use_cache=request.use_cache)
+
+    response_payload = {
+        "user_id": request.user_id,
+        "text": generation.content,
+        "enhanced_data": enhanced_data,
+        "validation_status": "success",
+        "cache_hit": generation.cache_hit,
+    }
+
+    # MLflow logging
+    logger.info(f"[USER: {request.user_id}] Logging risultato per utente")
+    await submit_log_on_mlflow(
+        "generate_text", request, response_payload, final_prompt=prompt.text
     )
+    return response_payload
+
+
+async def _run_text_pipeline(request: Request) -> Dict[str, Any]:
+    """
+    Pipeline completa di una richiesta testuale: validazione, arricchimento,
+    generazione e logging. Solleva HTTPException 400 se i dati dell'utente
+    sono incompleti.
+    """
     try:
         # Prompt checker: valida i dati dell'utente
         logger.info(f"[USER: {request.user_id}] Validazione dati utente")
-        validation_result = validate_user_data(request)
+        validation_result = await validate_user_data(request)
 
         if not validation_result.is_valid:
             raise HTTPException(
-                status_code=400,
-                detail={
-                    "error": "Dati utente incompleti",
-                    "missing_fields": validation_result.missing_fields,
-                    "message": validation_result.message,
-                },
+                status_code=400, detail=validation_error_detail(validation_result)
             )
 
         # Prompt enhancer: arricchisce i dati per la generazione
         logger.info(f"[USER: {request.user_id}] Arricchimento dati utente")
         enhanced_data = enhance_prompt_data(validation_result, request)
 
-        # Genera il prompt finale per il logging
-        final_prompt = get_template_content("aggregate_text_prompt.j2", enhanced_data)
+        return await _generate_text_payload(request, enhanced_data)
+    except HTTPException:
+        raise
+    except Exception as e:
+        # Log errore generico
+        logger.error(f"[USER: {request.user_id}] Errore generico per utente: {str(e)}")
+        await submit_log_on_mlflow("generate_text", request, {"error": str(e)})
+        raise
+
+
+@router.post("/generate-text")
+async def generate_text(request: Request):
+    """
+    Genera una descrizione dettagliata di un singolo utente in base ai suoi viaggi effettuati
+    """
+    logger.info(
+        f"[USER: {request.user_id}] Inizio generazione descrizione testuale per utente"
+    )
+    try:
+        # Richieste identiche in corso condividono la stessa esecuzione
+        return await generation_flights.do(
+            flight_key("generate_text", request),
+            lambda: _run_text_pipeline(request),
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/generate-text/batch")
+async def generate_text_batch(batch: BatchRequest):
+    """
+    Genera le descrizioni testuali di più utenti, restituendo i risultati in
+    streaming (NDJSON) man mano che sono pronti
+    """
+    check_batch_size(batch)
+    return StreamingResponse(
+        run_batch(batch, _generate_text_payload, "generate_text"),
+        media_type="application/x-ndjson",
+    )
+
+
+@router.post("/generate-text/stream")
+async def generate_text_stream(request: Request):
+    """
+    Come /generate-text, ma restituisce la descrizione come Server-Sent Events:
+    eventi `delta` con i frammenti di testo e un evento finale `done` con i
+    dati arricchiti (oppure `error`)
+    """
+    logger.info(
+        f"[USER: {request.user_id}] Inizio generazione descrizione testuale in streaming"
+    )
+    # Validazione prima di aprire lo stream: i 400 restano normali risposte JSON
+    validation_result = await validate_user_data(request)
+    if not validation_result.is_valid:
+        raise HTTPException(
+            status_code=400, detail=validation_error_detail(validation_result)
+        )
+
+    enhanced_data = enhance_prompt_data(validation_result, request)
+    prompt = prompt_registry.render("aggregate_text_prompt.j2", enhanced_data)
 
-        # Genera la descrizione testuale usando OpenAI
-        logger.info(f"[USER: {request.user_id}] Generazione descrizione testuale")
-        generated_text = generate_text_description(enhanced_data)
+    async def stream():
+        parts = []
+        cache_hit = False
+        try:
+            async for chunk in stream_text_description(
+                prompt, use_cache=request.use_cache
+            ):
+                cache_hit = chunk.cache_hit
+                parts.append(chunk.content)
+                yield format_sse({"delta": chunk.content}, event="delta")
+        except HTTPException as e:
+            # Es. 429 per quota OpenAI esaurita
+            yield format_sse(
+                {"status_code": e.status_code, "detail": e.detail}, event="error"
+            )
+            return
+        except Exception as e:
+            logger.error(f"[USER: {request.user_id}] Errore nello streaming: {str(e)}")
+            await submit_log_on_mlflow(
+                "generate_text_stream", request, {"error": str(e)}
+            )
+            yield format_sse({"status_code": 500, "detail": str(e)}, event="error")
+            return
 
         response_payload = {
             "user_id": request.user_id,
-            "text": generated_text,
+            "text": "".join(parts).strip(),
             "enhanced_data": enhanced_data,
             "validation_status": "success",
+            "cache_hit": cache_hit,
         }
+        yield format_sse(
+            {k: v for k, v in response_payload.items() if k != "text"}, event="done"
+        )
 
-        # MLflow logging
+        # MLflow logging del testo completo, a stream concluso
         logger.info(f"[USER: {request.user_id}] Logging risultato per utente")
-        log_on_mlflow(
-            "generate_text", request, response_payload, final_prompt=final_prompt
+        await submit_log_on_mlflow(
+            "generate_text_stream",
+            request,
+            response_payload,
+            final_prompt=prompt.text,
         )
-        return response_payload
-    except Exception as e:
-        # Log errore generico
-        logger.error(f"[USER: {request.user_id}] Errore generico per utente: {str(e)}")
-        log_on_mlflow("generate_text", request, {"error": str(e)})
-        raise HTTPException(status_code=500, detail=str(e))
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,40 @@
+import asyncio
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import FileResponse, Response
+
+from app.image_store import image_store, is_digest
+
+router = APIRouter()
+
+# Il contenuto di un hash non cambia mai: le immagini sono cacheabili a vita
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@router.get("/images/{image_hash}")
+async def get_image(image_hash: str, if_none_match: Optional[str] = Header(None)):
+    """
+    Serve un'immagine generata dall'image store, con ETag, Cache-Control e
+    supporto alle richieste Range
+    """
+    # Anche la risposta 304 richiede un hash valido e presente nello store
+    if not is_digest(image_hash) or not await asyncio.to_thread(
+        image_store.exists, image_hash
+    ):
+        raise HTTPException(status_code=404, detail="Immagine non trovata")
+
+    etag = f'"{image_hash}"'
+    headers = {"ETag": etag, "Cache-Control": IMAGE_CACHE_CONTROL}
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    try:
+        media_type = await asyncio.to_thread(image_store.media_type, image_hash)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Immagine non trovata")
+
+    # FileResponse gestisce Range (206) e invia il file a blocchi
+    return FileResponse(
+        image_store.path_for(image_hash), media_type=media_type, headers=headers
+    )
@@ -0,0 +1,13 @@
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """
+    Metriche in formato Prometheus: latenze per route e per stadio della
+    pipeline, chiamate OpenAI per modello, esiti delle cache ed errori
+    """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
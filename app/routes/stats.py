@@ -0,0 +1,36 @@
+import asyncio
+
+from fastapi import APIRouter
+
+from app.database import get_pool_stats, get_profile_cache_stats
+from app.generation_cache import generation_cache
+from app.http_client import outbound_http
+from app.image_store import image_store
+from app.mlflow_utils import mlflow_log_queue
+from app.openai_scheduler import openai_scheduler
+from app.prompt_registry import prompt_registry
+from app.prompt_service import get_extraction_stats
+from app.routes.generate_images import image_jobs
+from app.singleflight import generation_flights
+
+router = APIRouter()
+
+
+@router.get("/stats")
+async def get_stats():
+    """
+    Statistiche operative dei componenti dell'API
+    """
+    return {
+        "database_pool": get_pool_stats(),
+        "profile_cache": get_profile_cache_stats(),
+        "generation_cache": await asyncio.to_thread(generation_cache.stats),
+        "image_jobs": image_jobs.stats(),
+        "image_store": image_store.stats(),
+        "outbound_http": outbound_http.stats(),
+        "openai_scheduler": openai_scheduler.stats(),
+        "mlflow_logging": mlflow_log_queue.stats(),
+        "request_coalescing": generation_flights.stats(),
+        "info_extraction": get_extraction_stats(),
+        "prompt_templates": prompt_registry.stats(),
+    }
@@ -0,0 +1,60 @@
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+from .models import Request
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalescing delle richieste identiche in corso (single-flight).
+
+    La prima chiamata per una chiave avvia l'esecuzione; le chiamate con la
+    stessa chiave che arrivano prima della sua conclusione ne attendono il
+    risultato (o l'eccezione) invece di ripetere il lavoro. L'esecuzione è
+    protetta da shield: se un chiamante si disconnette, gli altri continuano
+    ad attendere lo stesso risultato.
+    """
+
+    def __init__(self) -> None:
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.executed += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Evita il warning "exception was never retrieved" se nessuno attende più
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._inflight),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+        }
+
+
+def flight_key(route: str, request: Request) -> Hashable:
+    """
+    Chiave di coalescing: route, utente, hash del campo info e uso della cache
+    """
+    info_hash = hashlib.sha256((request.info or "").encode("utf-8")).hexdigest()
+    return (route, request.user_id, info_hash, request.use_cache)
+
+
+generation_flights = SingleFlight()
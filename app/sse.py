@@ -0,0 +1,19 @@
+import json
+from typing import Any, Optional
+
+
+def format_sse(data: Any, event: Optional[str] = None) -> str:
+    """
+    Serializza un evento Server-Sent Events (data in JSON)
+    """
+    message = ""
+    if event:
+        message += f"event: {event}\n"
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    for line in payload.splitlines() or [""]:
+        message += f"data: {line}\n"
+    return message + "\n"
+
+
+# Commento SSE: mantiene viva la connessione attraverso proxy e load balancer
+SSE_KEEPALIVE = ": keepalive\n\n"
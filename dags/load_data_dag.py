@@ -5,6 +5,7 @@ import sys
 import os
 
 from airflow.models.dag import DAG
+from airflow.models.param import Param
 from airflow.operators.bash import BashOperator
 
 # Get the project root directory
@@ -16,6 +17,15 @@ with DAG(
     catchup=False,
     schedule=None,
     tags=["data"],
+    params={
+        # Full reload: truncate, parallel COPY, rebuild the trips indexes
+        "fast": Param(False, type="boolean"),
+        "workers": Param(4, type="integer", minimum=1),
+        # Hash partitions of trips, recreated by a fast reload if different
+        "partitions": Param(8, type="integer", minimum=1),
+        # Incremental runs skip unchanged chunks unless forced
+        "force": Param(False, type="boolean"),
+    },
 ) as dag:
     init_db = BashOperator(
         task_id="init_db",
@@ -24,7 +34,17 @@ with DAG(
 
     load_data = BashOperator(
         task_id="load_data",
-        bash_command=f"{sys.executable} {PROJECT_ROOT}/dataset/load_csv_to_postgres.py",
+        bash_command=(
+            f"{sys.executable} {PROJECT_ROOT}/dataset/load_csv_to_postgres.py"
+            "{{ ' --fast --workers ' ~ params.workers if params.fast else '' }}"
+            "{{ ' --partitions ' ~ params.partitions if params.fast else '' }}"
+            "{{ ' --force' if params.force and not params.fast else '' }}"
+        ),
     )
 
-    init_db >> load_data
+    build_user_profile = BashOperator(
+        task_id="build_user_profile",
+        bash_command=f"cd {PROJECT_ROOT} && {sys.executable} -m dataset.build_user_profile",
+    )
+
+    init_db >> load_data >> build_user_profile
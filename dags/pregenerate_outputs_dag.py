@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+import pendulum
+import sys
+import os
+
+from airflow.models.dag import DAG
+from airflow.models.param import Param
+from airflow.operators.bash import BashOperator
+
+# Get the project root directory
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+with DAG(
+    dag_id="pregenerate_outputs",
+    start_date=pendulum.datetime(2025, 8, 25, tz="UTC"),
+    catchup=False,
+    schedule=None,
+    tags=["data", "generation"],
+    params={
+        "images": Param(False, type="boolean"),
+        "force": Param(False, type="boolean"),
+    },
+) as dag:
+    # Run after load_data_to_postgres: profile classes come from user_profile
+    pregenerate = BashOperator(
+        task_id="pregenerate_outputs",
+        bash_command=(
+            f"cd {PROJECT_ROOT} && {sys.executable} -m dataset.pregenerate_outputs"
+            "{{ ' --images' if params.images else '' }}"
+            "{{ ' --force' if params.force else '' }}"
+        ),
+        retries=2,
+        retry_delay=pendulum.duration(minutes=5),
+    )
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import argparse
+
+from loguru import logger
+from sqlalchemy import text
+
+from dataset.load_csv_to_postgres import BUMP_DATA_VERSION, create_connection
+
+# Users whose trips were appended after the last build: any trips.id above
+# the highest id already folded into user_profile.
+INCREMENTAL_USERS = """
+    SELECT DISTINCT "UserId"
+    FROM trips
+    WHERE "UserId" IS NOT NULL
+      AND id > (SELECT COALESCE(MAX(last_trip_id), 0) FROM user_profile)
+"""
+
+ALL_USERS = """
+    SELECT DISTINCT "UserId" FROM trips WHERE "UserId" IS NOT NULL
+"""
+
+EXPLICIT_USERS = """
+    SELECT UNNEST(CAST(:user_ids AS INTEGER[]))
+"""
+
+# Single pass over the touched users' trips; mode() skips unmatched codes
+# (NULL after the lookup join) and breaks ties alphabetically.
+UPSERT_PROFILES = """
+    WITH touched AS ({users})
+    INSERT INTO user_profile (
+        user_id, year, region, travel_mode, travel_motive,
+        trip_count, km_travelled, last_trip_id, updated_at
+    )
+    SELECT
+        t."UserId",
+        CASE
+            WHEN MIN(t."Periods") = MAX(t."Periods")
+            THEN MIN(t."Periods")::varchar
+            ELSE MIN(t."Periods")::varchar || '-' || MAX(t."Periods")::varchar
+        END,
+        mode() WITHIN GROUP (ORDER BY r.region),
+        mode() WITHIN GROUP (ORDER BY tm.mode),
+        mode() WITHIN GROUP (ORDER BY tmot.motive),
+        SUM(t."Trip in a year")::int,
+        SUM(t."Km travelled in a year")::int,
+        MAX(t.id),
+        now()
+    FROM trips t
+    LEFT JOIN region r ON t."RegionCharacteristics" = r.id
+    LEFT JOIN travel_mode tm ON t."TravelModes" = tm.id
+    LEFT JOIN travel_motives tmot ON t."TravelMotives" = tmot.id
+    WHERE t."UserId" IN (SELECT * FROM touched)
+    GROUP BY t."UserId"
+    ON CONFLICT (user_id) DO UPDATE SET
+        year = EXCLUDED.year,
+        region = EXCLUDED.region,
+        travel_mode = EXCLUDED.travel_mode,
+        travel_motive = EXCLUDED.travel_motive,
+        trip_count = EXCLUDED.trip_count,
+        km_travelled = EXCLUDED.km_travelled,
+        last_trip_id = EXCLUDED.last_trip_id,
+        updated_at = EXCLUDED.updated_at
+"""
+
+
+def refresh_user_profiles(engine, user_ids=None, full=False) -> int:
+    """Recompute user_profile rows and return how many were written.
+
+    By default only users with trips loaded after the previous build are
+    recomputed; pass explicit ``user_ids`` or ``full=True`` to override.
+    """
+    params = {}
+    if full:
+        users = ALL_USERS
+    elif user_ids is not None:
+        users = EXPLICIT_USERS
+        params["user_ids"] = [int(u) for u in user_ids]
+    else:
+        users = INCREMENTAL_USERS
+
+    with engine.connect() as conn:
+        with conn.begin():
+            result = conn.execute(text(UPSERT_PROFILES.format(users=users)), params)
+            if result.rowcount:
+                conn.execute(text(BUMP_DATA_VERSION))
+            return result.rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the precomputed user_profile table from trips."
+    )
+    parser.add_argument(
+        "--full", action="store_true", help="Rebuild every user profile."
+    )
+    args = parser.parse_args()
+
+    try:
+        mode = "full" if args.full else "incremental"
+        logger.info(f"Building user_profile ({mode})...")
+        count = refresh_user_profiles(create_connection(), full=args.full)
+        logger.info(f"user_profile updated for {count} users")
+    except Exception as e:
+        logger.error(f"Failed to build user_profile: {str(e)}")
+        raise
+
+
+if __name__ == "__main__":
+    main()
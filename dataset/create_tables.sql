@@ -1,33 +1,51 @@
 -- Database schema for MIR ML Challenge
 -- Creates all tables needed for CSV data loading
 
+-- Lookup tables: code is the natural key used by the source data, id the
+-- smallint surrogate key stored in trips. Names are NULL for codes found
+-- only in trips (e.g. totals), which the profile joins treat as unmatched.
+
 -- Population lookup table
 CREATE TABLE IF NOT EXISTS population (
     code VARCHAR(20) PRIMARY KEY,
-    population TEXT NOT NULL
+    id SMALLINT GENERATED BY DEFAULT AS IDENTITY UNIQUE,
+    population TEXT
 );
 
 -- Region lookup table
 CREATE TABLE IF NOT EXISTS region (
     code VARCHAR(20) PRIMARY KEY,
-    region VARCHAR(100) NOT NULL,
+    id SMALLINT GENERATED BY DEFAULT AS IDENTITY UNIQUE,
+    region VARCHAR(100),
     description TEXT
 );
 
 -- Travel mode lookup table
 CREATE TABLE IF NOT EXISTS travel_mode (
     code VARCHAR(20) PRIMARY KEY,
-    mode VARCHAR(100) NOT NULL,
+    id SMALLINT GENERATED BY DEFAULT AS IDENTITY UNIQUE,
+    mode VARCHAR(100),
     description TEXT
 );
 
 -- Travel motives lookup table
 CREATE TABLE IF NOT EXISTS travel_motives (
     code VARCHAR(20) PRIMARY KEY,
-    motive VARCHAR(200) NOT NULL,
+    id SMALLINT GENERATED BY DEFAULT AS IDENTITY UNIQUE,
+    motive VARCHAR(200),
     description TEXT
 );
 
+-- Lookup tables created before the surrogate keys
+ALTER TABLE population ADD COLUMN IF NOT EXISTS id SMALLINT GENERATED BY DEFAULT AS IDENTITY UNIQUE;
+ALTER TABLE population ALTER COLUMN population DROP NOT NULL;
+ALTER TABLE region ADD COLUMN IF NOT EXISTS id SMALLINT GENERATED BY DEFAULT AS IDENTITY UNIQUE;
+ALTER TABLE region ALTER COLUMN region DROP NOT NULL;
+ALTER TABLE travel_mode ADD COLUMN IF NOT EXISTS id SMALLINT GENERATED BY DEFAULT AS IDENTITY UNIQUE;
+ALTER TABLE travel_mode ALTER COLUMN mode DROP NOT NULL;
+ALTER TABLE travel_motives ADD COLUMN IF NOT EXISTS id SMALLINT GENERATED BY DEFAULT AS IDENTITY UNIQUE;
+ALTER TABLE travel_motives ALTER COLUMN motive DROP NOT NULL;
+
 -- Urbanization level lookup table
 CREATE TABLE IF NOT EXISTS urbanization_level (
     id INTEGER,
@@ -36,19 +54,144 @@ CREATE TABLE IF NOT EXISTS urbanization_level (
     area VARCHAR(100)
 );
 
--- Main trips fact table
+-- Migration from the VARCHAR or unpartitioned trips layouts, step 1: for
+-- VARCHAR trips register the codes found in the lookups, then move the old
+-- table (with its constraint, sequence and index names) out of the way
+DO $$
+DECLARE
+    moved BOOLEAN := true;
+BEGIN
+    IF EXISTS (
+        SELECT FROM information_schema.columns
+        WHERE table_schema = current_schema()
+          AND table_name = 'trips'
+          AND column_name = 'Periods'
+          AND data_type = 'character varying'
+    ) THEN
+        INSERT INTO travel_motives (code)
+        SELECT DISTINCT "TravelMotives" FROM trips WHERE "TravelMotives" IS NOT NULL
+        ON CONFLICT (code) DO NOTHING;
+        INSERT INTO population (code)
+        SELECT DISTINCT "Population" FROM trips WHERE "Population" IS NOT NULL
+        ON CONFLICT (code) DO NOTHING;
+        INSERT INTO travel_mode (code)
+        SELECT DISTINCT "TravelModes" FROM trips WHERE "TravelModes" IS NOT NULL
+        ON CONFLICT (code) DO NOTHING;
+        INSERT INTO region (code)
+        SELECT DISTINCT "RegionCharacteristics" FROM trips
+        WHERE "RegionCharacteristics" IS NOT NULL
+        ON CONFLICT (code) DO NOTHING;
+
+        ALTER TABLE trips RENAME TO trips_varchar;
+        ALTER TABLE trips_varchar RENAME CONSTRAINT trips_pkey TO trips_varchar_pkey;
+        ALTER SEQUENCE trips_id_seq RENAME TO trips_varchar_id_seq;
+    ELSIF EXISTS (
+        SELECT FROM pg_class WHERE oid = to_regclass('trips') AND relkind = 'r'
+    ) THEN
+        ALTER TABLE trips RENAME TO trips_unpartitioned;
+        ALTER TABLE trips_unpartitioned
+            RENAME CONSTRAINT trips_pkey TO trips_unpartitioned_pkey;
+        ALTER SEQUENCE trips_id_seq RENAME TO trips_unpartitioned_id_seq;
+    ELSE
+        moved := false;
+    END IF;
+
+    IF moved THEN
+        DROP INDEX IF EXISTS idx_trips_travel_motives;
+        DROP INDEX IF EXISTS idx_trips_population;
+        DROP INDEX IF EXISTS idx_trips_travel_modes;
+        DROP INDEX IF EXISTS idx_trips_region;
+        DROP INDEX IF EXISTS idx_trips_periods;
+        DROP INDEX IF EXISTS idx_trips_user_id;
+        DROP INDEX IF EXISTS uq_trips_natural_key;
+    END IF;
+END $$;
+
+-- Main trips fact table. Dimension codes are stored as the smallint
+-- surrogate keys of the lookup tables (dictionary encoded by the loader),
+-- Periods as the year and the measures as fixed-width numbers.
+-- Hash partitioned on UserId so that a per-user query reads one partition;
+-- unique constraints must include the partition key.
 CREATE TABLE IF NOT EXISTS trips (
-    id SERIAL PRIMARY KEY,
-    "TravelMotives" VARCHAR(20),
-    "Population" VARCHAR(20),
-    "TravelModes" VARCHAR(20),
-    "RegionCharacteristics" VARCHAR(20),
-    "Periods" VARCHAR(20),
-    "Trip in a year" NUMERIC,
-    "Km travelled in a year" NUMERIC,
-    "Hours travelled in a year" NUMERIC,
-    "UserId" INTEGER
-);
+    id SERIAL,
+    "TravelMotives" SMALLINT,
+    "Population" SMALLINT,
+    "TravelModes" SMALLINT,
+    "RegionCharacteristics" SMALLINT,
+    "Periods" SMALLINT,
+    "Trip in a year" INTEGER,
+    "Km travelled in a year" INTEGER,
+    "Hours travelled in a year" REAL,
+    "UserId" INTEGER,
+    CONSTRAINT trips_id_key UNIQUE (id, "UserId")
+) PARTITION BY HASH ("UserId");
+
+-- Partitions of a new trips table. The count is only chosen here; a fast
+-- reload changes it (load_csv_to_postgres.py --fast --partitions N).
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT FROM pg_inherits WHERE inhparent = 'trips'::regclass) THEN
+        FOR remainder IN 0..7 LOOP
+            EXECUTE format(
+                'CREATE TABLE trips_p%s PARTITION OF trips '
+                'FOR VALUES WITH (MODULUS 8, REMAINDER %s)',
+                remainder, remainder
+            );
+        END LOOP;
+    END IF;
+END $$;
+
+-- Migration step 2: copy the old rows, keeping their ids (user_profile
+-- high-water mark), then drop the old table
+DO $$
+BEGIN
+    IF to_regclass('trips_unpartitioned') IS NOT NULL THEN
+        INSERT INTO trips (
+            id, "TravelMotives", "Population", "TravelModes",
+            "RegionCharacteristics", "Periods", "Trip in a year",
+            "Km travelled in a year", "Hours travelled in a year", "UserId"
+        )
+        SELECT
+            id, "TravelMotives", "Population", "TravelModes",
+            "RegionCharacteristics", "Periods", "Trip in a year",
+            "Km travelled in a year", "Hours travelled in a year", "UserId"
+        FROM trips_unpartitioned;
+
+        PERFORM setval(
+            pg_get_serial_sequence('trips', 'id'),
+            COALESCE((SELECT MAX(id) FROM trips), 0) + 1,
+            false
+        );
+        DROP TABLE trips_unpartitioned;
+    END IF;
+
+    IF to_regclass('trips_varchar') IS NOT NULL THEN
+        INSERT INTO trips (
+            id, "TravelMotives", "Population", "TravelModes",
+            "RegionCharacteristics", "Periods", "Trip in a year",
+            "Km travelled in a year", "Hours travelled in a year", "UserId"
+        )
+        SELECT
+            t.id, tmot.id, p.id, tm.id, r.id,
+            left(t."Periods", 4)::smallint,
+            round(t."Trip in a year")::integer,
+            round(t."Km travelled in a year")::integer,
+            t."Hours travelled in a year"::real,
+            t."UserId"
+        FROM trips_varchar t
+        LEFT JOIN travel_motives tmot ON tmot.code = t."TravelMotives"
+        LEFT JOIN population p ON p.code = t."Population"
+        LEFT JOIN travel_mode tm ON tm.code = t."TravelModes"
+        LEFT JOIN region r ON r.code = t."RegionCharacteristics";
+
+        PERFORM setval(
+            pg_get_serial_sequence('trips', 'id'),
+            COALESCE((SELECT MAX(id) FROM trips), 0) + 1,
+            false
+        );
+        DROP TABLE trips_varchar;
+    END IF;
+END $$;
 
 -- Create indexes for better query performance
 CREATE INDEX IF NOT EXISTS idx_trips_travel_motives ON trips("TravelMotives");
@@ -56,4 +199,86 @@ CREATE INDEX IF NOT EXISTS idx_trips_population ON trips("Population");
 CREATE INDEX IF NOT EXISTS idx_trips_travel_modes ON trips("TravelModes");
 CREATE INDEX IF NOT EXISTS idx_trips_region ON trips("RegionCharacteristics");
 CREATE INDEX IF NOT EXISTS idx_trips_periods ON trips("Periods");
-CREATE INDEX IF NOT EXISTS idx_trips_user_id ON trips("UserId");
\ No newline at end of file
+
+-- Covering index for the per-user profile queries (app/database.py,
+-- dataset/build_user_profile.py): every trips column they read is in the
+-- index, so they run as index-only scans on a vacuumed table. It replaces
+-- the plain idx_trips_user_id.
+CREATE INDEX IF NOT EXISTS idx_trips_user_covering ON trips ("UserId") INCLUDE (
+    id, "Periods", "TravelMotives", "TravelModes", "RegionCharacteristics",
+    "Trip in a year", "Km travelled in a year"
+);
+DROP INDEX IF EXISTS idx_trips_user_id;
+
+-- Natural key of a trip, used by the incremental loader to upsert changed
+-- rows (see dataset/load_csv_to_postgres.py). Exact duplicates appended by
+-- earlier loads are removed before the unique index is first created.
+DO $$
+BEGIN
+    IF to_regclass('uq_trips_natural_key') IS NULL THEN
+        DELETE FROM trips WHERE id IN (
+            SELECT id FROM (
+                SELECT id, row_number() OVER (
+                    PARTITION BY "UserId", "Periods", "TravelMotives", "Population",
+                        "TravelModes", "RegionCharacteristics"
+                    ORDER BY id
+                ) AS duplicate
+                FROM trips
+            ) ranked
+            WHERE duplicate > 1
+        );
+    END IF;
+END $$;
+CREATE UNIQUE INDEX IF NOT EXISTS uq_trips_natural_key ON trips (
+    "UserId", "Periods", "TravelMotives", "Population", "TravelModes",
+    "RegionCharacteristics"
+) NULLS NOT DISTINCT;
+
+-- Precomputed per-user profile, rebuilt incrementally after each load
+-- (see dataset/build_user_profile.py). last_trip_id is the highest trips.id
+-- folded into the row and acts as the high-water mark for incremental runs.
+CREATE TABLE IF NOT EXISTS user_profile (
+    user_id INTEGER PRIMARY KEY,
+    year VARCHAR(20),
+    region VARCHAR(100),
+    travel_mode VARCHAR(100),
+    travel_motive VARCHAR(200),
+    trip_count INTEGER,
+    km_travelled INTEGER,
+    last_trip_id INTEGER NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Data version marker, bumped by every load so API caches can invalidate
+CREATE TABLE IF NOT EXISTS data_version (
+    id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+INSERT INTO data_version (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
+
+-- Fingerprint of every loaded CSV chunk: the incremental loader skips
+-- chunks whose sha256 did not change since the previous run
+CREATE TABLE IF NOT EXISTS load_manifest (
+    file_name VARCHAR(100) NOT NULL,
+    chunk_no INTEGER NOT NULL,
+    sha256 CHAR(64) NOT NULL,
+    byte_start BIGINT NOT NULL,
+    byte_end BIGINT NOT NULL,
+    line_count INTEGER NOT NULL,
+    loaded_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (file_name, chunk_no)
+);
+
+-- Text and images generated offline for each distinct profile class
+-- (see dataset/pregenerate_outputs.py). cache_key is the same hash the API
+-- uses for its generation cache: model, rendered prompt and parameters.
+CREATE TABLE IF NOT EXISTS pregenerated_output (
+    cache_key CHAR(64) PRIMARY KEY,
+    kind VARCHAR(10) NOT NULL CHECK (kind IN ('text', 'image')),
+    model VARCHAR(100) NOT NULL,
+    profile_class JSONB NOT NULL,
+    content TEXT,
+    image BYTEA,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
\ No newline at end of file
@@ -1,10 +1,19 @@
 #!/usr/bin/env python3
 
+import argparse
+import csv
+import hashlib
+import io
+import itertools
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from loguru import logger
-import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from pathlib import Path
-import io
 
 DB_CONFIG = {
     "host": "localhost",
@@ -16,111 +25,841 @@ DB_CONFIG = {
 
 DATA_FOLDER = Path(__file__).parent.parent / "data"
 
+# Rows transformed per chunk; memory use is bounded by one chunk
+CSV_CHUNK_ROWS = int(os.getenv("CSV_CHUNK_ROWS", "50000"))
+CSV_PROGRESS_ROWS = int(os.getenv("CSV_PROGRESS_ROWS", "1000000"))
+COPY_READ_SIZE = 1024 * 1024
+
+# file -> (table, delimiter, drop the leading index column)
+CSV_FILES = {
+    "population.csv": ("population", ",", False),
+    "region.csv": ("region", ",", False),
+    "travel_mode.csv": ("travel_mode", "|", False),
+    "travel_motives.csv": ("travel_motives", ",", False),
+    "trips.csv": ("trips", ",", True),
+    "urbanization_level.csv": ("urbanization_level", ";", True),
+}
+
+# Fast full reload: parallel COPY with the trips indexes rebuilt afterwards
+FAST_LOAD_WORKERS = int(os.getenv("FAST_LOAD_WORKERS", "4"))
+FAST_LOAD_UNLOGGED = os.getenv("FAST_LOAD_UNLOGGED", "false").lower() == "true"
+FAST_LOAD_MAINTENANCE_WORK_MEM = os.getenv("FAST_LOAD_MAINTENANCE_WORK_MEM", "512MB")
+# Hash partitions of trips on UserId; create_tables.sql starts with 8 and a
+# fast reload recreates them when the count differs
+TRIPS_PARTITIONS = int(os.getenv("TRIPS_PARTITIONS", "8"))
+
+# Secondary indexes on trips (see create_tables.sql), dropped during a fast
+# load and rebuilt once the data has landed
+TRIPS_INDEXES = {
+    "idx_trips_travel_motives": "TravelMotives",
+    "idx_trips_population": "Population",
+    "idx_trips_travel_modes": "TravelModes",
+    "idx_trips_region": "RegionCharacteristics",
+    "idx_trips_periods": "Periods",
+}
+# Covering index for the per-user profile queries: every trips column they
+# read is included, so they run as index-only scans once trips is vacuumed
+TRIPS_COVERING_INDEX = "idx_trips_user_covering"
+TRIPS_PROFILE_COLUMNS = [
+    "id",
+    "Periods",
+    "TravelMotives",
+    "TravelModes",
+    "RegionCharacteristics",
+    "Trip in a year",
+    "Km travelled in a year",
+]
+
+# Natural key of each table for the incremental upsert; tables without one
+# are replaced as a whole when their file changes
+NATURAL_KEYS = {
+    "population": ["code"],
+    "region": ["code"],
+    "travel_mode": ["code"],
+    "travel_motives": ["code"],
+    "trips": [
+        "UserId",
+        "Periods",
+        "TravelMotives",
+        "Population",
+        "TravelModes",
+        "RegionCharacteristics",
+    ],
+}
+TRIPS_NATURAL_KEY_INDEX = "uq_trips_natural_key"
+# trips dimension columns, stored as the smallint surrogate key of a lookup
+TRIPS_DIMENSIONS = {
+    "TravelMotives": "travel_motives",
+    "Population": "population",
+    "TravelModes": "travel_mode",
+    "RegionCharacteristics": "region",
+}
+# Lookups denormalized into user_profile: a change invalidates every profile
+PROFILE_LOOKUPS = {"region", "travel_mode", "travel_motives"}
+
+# Files fingerprinted per chunk of lines (they have no quoted multi-line
+# fields); the others are fingerprinted as a whole
+CHUNKED_FILES = {"trips.csv"}
+MANIFEST_CHUNK_ROWS = int(os.getenv("MANIFEST_CHUNK_ROWS", "100000"))
+
+# "." and empty fields are missing values; periods such as 2018JJ00 become 2018
+NULL_VALUES = {".", ""}
+NULL_MARKER = "\\N"
+YEAR_CODE = re.compile(r"^(\d{4})JJ00$")
+
+BUMP_DATA_VERSION = """
+    INSERT INTO data_version (id, version) VALUES (1, 1)
+    ON CONFLICT (id) DO UPDATE
+    SET version = data_version.version + 1, updated_at = now()
+"""
+
+REGISTER_CODE = """
+    INSERT INTO {table} (code) VALUES (:code)
+    ON CONFLICT (code) DO UPDATE SET code = EXCLUDED.code
+    RETURNING id
+"""
+
+TRIPS_PARTITIONS_QUERY = """
+    SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'trips'::regclass
+    ORDER BY c.relname
+"""
+
+LOADED_CHUNKS = """
+    SELECT chunk_no, sha256 FROM load_manifest WHERE file_name = :file_name
+"""
+
+UPSERT_MANIFEST = """
+    INSERT INTO load_manifest (
+        file_name, chunk_no, sha256, byte_start, byte_end, line_count, loaded_at
+    )
+    VALUES (%s, %s, %s, %s, %s, %s, now())
+    ON CONFLICT (file_name, chunk_no) DO UPDATE SET
+        sha256 = EXCLUDED.sha256,
+        byte_start = EXCLUDED.byte_start,
+        byte_end = EXCLUDED.byte_end,
+        line_count = EXCLUDED.line_count,
+        loaded_at = EXCLUDED.loaded_at
+"""
+
+TRIM_MANIFEST = """
+    DELETE FROM load_manifest WHERE file_name = :file_name AND chunk_no >= :chunks
+"""
 
-def create_connection():
+# Resetting the user_profile high-water mark makes the next incremental
+# build recompute every user
+RESET_PROFILE_WATERMARK = "UPDATE user_profile SET last_trip_id = 0"
+
+# Exact duplicates on the natural key, keeping the first loaded row
+DEDUPLICATE_TRIPS = f"""
+    DELETE FROM trips WHERE id IN (
+        SELECT id FROM (
+            SELECT id, row_number() OVER (
+                PARTITION BY {", ".join(f'"{c}"' for c in NATURAL_KEYS["trips"])}
+                ORDER BY id
+            ) AS duplicate
+            FROM trips
+        ) ranked
+        WHERE duplicate > 1
+    )
+"""
+
+
+def create_connection(**engine_options):
     connection_string = f"postgresql+psycopg2://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}"
-    engine = create_engine(connection_string)
+    engine = create_engine(connection_string, **engine_options)
     return engine
 
 
-def load_csv_files():
-    engine = create_connection()
+class CodeEncoder:
+    """Dictionary encoding of the trips dimension codes into the smallint
+    surrogate keys of the lookup tables.
 
-    # Year conversion mapping
-    year_mapping = {
-        "2018JJ00": "2018",
-        "2019JJ00": "2019",
-        "2020JJ00": "2020",
-        "2021JJ00": "2021",
-        "2022JJ00": "2022",
-    }
+    The lookups are read once; codes missing from them (totals, typos in
+    the source data) are registered with a NULL name so that no value is
+    lost. Must be created after the lookup tables have been loaded.
+    """
 
-    csv_files = {
-        "population.csv": "population",
-        "region.csv": "region",
-        "travel_mode.csv": "travel_mode",
-        "travel_motives.csv": "travel_motives",
-        "trips.csv": "trips",
-        "urbanization_level.csv": "urbanization_level",
-    }
+    def __init__(self, engine):
+        self.engine = engine
+        self._ids = {}
+        self._lock = threading.Lock()
+        with engine.connect() as conn:
+            for table in set(TRIPS_DIMENSIONS.values()):
+                for code, id_ in conn.execute(text(f"SELECT code, id FROM {table}")):
+                    self._ids[(table, code)] = id_
 
-    for csv_file, table_name in csv_files.items():
-        csv_path = DATA_FOLDER / csv_file
+    def encode(self, table, code):
+        id_ = self._ids.get((table, code))
+        if id_ is None:
+            with self._lock:
+                id_ = self._ids.get((table, code))
+                if id_ is None:
+                    with self.engine.connect() as conn:
+                        with conn.begin():
+                            id_ = conn.execute(
+                                text(REGISTER_CODE.format(table=table)), {"code": code}
+                            ).scalar()
+                    logger.warning(f"Code {code!r} not found in {table}, registered")
+                    self._ids[(table, code)] = id_
+        return id_
 
-        if not csv_path.exists():
-            logger.warning(f"File {csv_path} not found, skipping...")
-            continue
+    def for_header(self, header):
+        """Column position -> lookup table for the dimension columns."""
+        return {
+            position: TRIPS_DIMENSIONS[column]
+            for position, column in enumerate(header)
+            if column in TRIPS_DIMENSIONS
+        }
 
-        logger.info(f"Loading {csv_file} into table {table_name}...")
 
-        try:
-            if csv_file == "travel_mode.csv":
-                df = pd.read_csv(csv_path, delimiter="|")
-            elif csv_file == "urbanization_level.csv":
-                df = pd.read_csv(csv_path, delimiter=";")
+class CsvCopyStream:
+    """File-like object that streams a transformed CSV file into COPY.
+
+    Rows are read, transformed and serialized CHUNK_ROWS at a time, so
+    memory stays bounded by one chunk whatever the size of the file.
+    ``copy_expert`` pulls data through ``read`` as the server consumes it.
+    With an ``encoder``, the dimension columns of ``header`` are replaced
+    by their surrogate keys.
+    """
+
+    def __init__(
+        self,
+        reader,
+        drop_index=False,
+        chunk_rows=None,
+        label="",
+        encoder=None,
+        header=(),
+    ):
+        self.reader = reader
+        self.drop_index = drop_index
+        self.label = label
+        self.encoder = encoder
+        self.dimensions = encoder.for_header(header) if encoder else {}
+        self.chunk_rows = chunk_rows or CSV_CHUNK_ROWS
+        self.rows = 0
+        self.started = time.monotonic()
+        self._buffer = ""
+        self._exhausted = False
+        self._next_report = CSV_PROGRESS_ROWS
+
+    def _transform(self, row):
+        if self.drop_index:
+            row = row[1:]
+        values = []
+        for value in row:
+            if value in NULL_VALUES:
+                values.append(NULL_MARKER)
             else:
-                df = pd.read_csv(csv_path)
-
-            df.replace(".", None, inplace=True)
-
-            # Apply year conversion mapping to all columns
-            for col in df.columns:
-                if df[col].dtype == "object":  # Only apply to string columns
-                    df[col] = df[col].replace(year_mapping)
-
-            if table_name == "trips":
-                df = df.drop(columns=[df.columns[0]], errors="ignore")
-            elif table_name == "urbanization_level":
-                df = df.drop(columns=[df.columns[0]], errors="ignore")
-
-            try:
-                # Bulk load via COPY for reliability and speed
-                copy_df_to_table(engine, df, table_name)
-            except Exception as e:
-                if "duplicate key value violates unique constraint" in str(e):
-                    logger.info(
-                        f"Table {table_name} already contains data, skipping..."
-                    )
-                else:
-                    raise
-            logger.info(f"Successfully loaded {len(df)} rows into {table_name}")
+                match = YEAR_CODE.match(value)
+                values.append(match.group(1) if match else value)
+        for position, table in self.dimensions.items():
+            if values[position] != NULL_MARKER:
+                values[position] = str(self.encoder.encode(table, values[position]))
+        return values
 
-        except Exception as e:
-            logger.error(f"Error loading {csv_file}: {str(e)}")
+    def _fill(self):
+        chunk = io.StringIO()
+        writer = csv.writer(chunk, lineterminator="\n")
+        count = 0
+        for row in itertools.islice(self.reader, self.chunk_rows):
+            if row:
+                writer.writerow(self._transform(row))
+                count += 1
+        if count == 0:
+            self._exhausted = True
+            return
+        self.rows += count
+        self._buffer += chunk.getvalue()
+        if self.rows >= self._next_report:
+            logger.info(
+                f"  {self.label}: {self.rows} rows ({self.rows_per_second:.0f} rows/s)"
+            )
+            self._next_report += CSV_PROGRESS_ROWS
+
+    def read(self, size=-1):
+        while not self._exhausted and (size < 0 or len(self._buffer) < size):
+            self._fill()
+        if size < 0:
+            data, self._buffer = self._buffer, ""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
 
-    logger.info("CSV loading completed!")
+    @property
+    def rows_per_second(self):
+        elapsed = time.monotonic() - self.started
+        return self.rows / elapsed if elapsed > 0 else 0.0
 
 
-def copy_df_to_table(engine, df: pd.DataFrame, table_name: str):
-    # Prepare CSV buffer with explicit NULL marker
-    buffer = io.StringIO()
-    df.to_csv(buffer, index=False, na_rep="\\N")
-    buffer.seek(0)
+def read_header(csv_path, delimiter=","):
+    """Return the header columns and the byte offset where the data starts."""
+    with open(csv_path, "rb") as f:
+        line = f.readline()
+        data_start = f.tell()
+    header = next(csv.reader([line.decode("utf-8-sig")], delimiter=delimiter))
+    return header, data_start
 
+
+def split_csv(csv_path, parts):
+    """Split the data rows of a CSV file into byte ranges of similar size.
+
+    Boundaries are moved to the next line start, so this is only valid for
+    files without quoted multi-line fields (true for trips.csv).
+    """
+    size = os.path.getsize(csv_path)
+    _, data_start = read_header(csv_path)
+    bounds = [data_start]
+    with open(csv_path, "rb") as f:
+        for i in range(1, parts):
+            f.seek(data_start + (size - data_start) * i // parts)
+            f.readline()  # finish the line in progress
+            if bounds[-1] < f.tell() < size:
+                bounds.append(f.tell())
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def _segment_lines(csv_path, start, end):
+    """Decoded lines of the file starting in the byte range [start, end)."""
+    with open(csv_path, "rb") as f:
+        f.seek(start)
+        position = start
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line.decode("utf-8")
+
+
+def _columns(columns):
     # Quote column names to preserve case/special chars
-    cols = ", ".join([f'"{col}"' for col in df.columns])
-    copy_sql = f"COPY {table_name} ({cols}) FROM STDIN WITH (FORMAT CSV, HEADER TRUE, DELIMITER ',', NULL '\\N', QUOTE '\"')"
+    return ", ".join([f'"{col}"' for col in columns])
+
+
+def _copy_sql(table_name, columns):
+    return f"COPY {table_name} ({_columns(columns)}) FROM STDIN WITH (FORMAT CSV, HEADER FALSE, DELIMITER ',', NULL '\\N', QUOTE '\"')"
+
+
+def fingerprint_chunks(csv_path, data_start, chunk_rows=None):
+    """sha256 of consecutive chunks of ``chunk_rows`` lines of a CSV file
+    (a single chunk for the whole file if ``chunk_rows`` is None).
+
+    Returns a list of (byte_start, byte_end, lines, sha256).
+    """
+    chunks = []
+    with open(csv_path, "rb") as f:
+        f.seek(data_start)
+        start = position = data_start
+        digest, lines = hashlib.sha256(), 0
+        for line in f:
+            digest.update(line)
+            position += len(line)
+            lines += 1
+            if chunk_rows and lines == chunk_rows:
+                chunks.append((start, position, lines, digest.hexdigest()))
+                start, digest, lines = position, hashlib.sha256(), 0
+        if lines or not chunks:
+            chunks.append((start, position, lines, digest.hexdigest()))
+    return chunks
+
+
+def copy_csv_to_table(
+    engine,
+    csv_path,
+    table_name,
+    delimiter=",",
+    drop_index=False,
+    segment=None,
+    encoder=None,
+):
+    """Stream a CSV file, or one byte range of it, into ``table_name`` with a
+    single COPY. trips requires a CodeEncoder for its dimension columns.
+
+    Returns the number of rows loaded.
+    """
+    header, data_start = read_header(csv_path, delimiter)
+    if drop_index:
+        header = header[1:]
+    start, end = segment or (data_start, os.path.getsize(csv_path))
+    label = table_name if segment is None else f"{table_name} [{start}:{end}]"
+    reader = csv.reader(_segment_lines(csv_path, start, end), delimiter=delimiter)
+    stream = CsvCopyStream(
+        reader, drop_index=drop_index, label=label, encoder=encoder, header=header
+    )
 
     conn = engine.raw_connection()
     try:
         cur = conn.cursor()
         try:
-            cur.copy_expert(copy_sql, buffer)
+            cur.copy_expert(_copy_sql(table_name, header), stream, size=COPY_READ_SIZE)
         finally:
             cur.close()
         conn.commit()
     finally:
         conn.close()
 
+    logger.info(
+        f"Successfully loaded {stream.rows} rows into {label} "
+        f"in {time.monotonic() - stream.started:.1f}s "
+        f"({stream.rows_per_second:.0f} rows/s)"
+    )
+    return stream.rows
 
-def main():
+
+def _upsert_sql(table_name, columns):
+    """Move the staged rows into ``table_name``.
+
+    Tables with a natural key are upserted, skipping rows that did not
+    change; the others are replaced as a whole.
+    """
+    cols = _columns(columns)
+    key = NATURAL_KEYS.get(table_name)
+    if not key:
+        return f"""
+            DELETE FROM {table_name};
+            INSERT INTO {table_name} ({cols}) SELECT {cols} FROM load_stage
+        """
+
+    key_cols = _columns(key)
+    values = [col for col in columns if col not in key]
+    updates = [f'"{col}" = EXCLUDED."{col}"' for col in values]
+    if table_name == "trips":
+        # Fresh id above the user_profile high-water mark, so the next
+        # incremental build recomputes the user
+        updates.append("id = DEFAULT")
+    current = ", ".join(f'{table_name}."{col}"' for col in values)
+    excluded = ", ".join(f'EXCLUDED."{col}"' for col in values)
+    return f"""
+        INSERT INTO {table_name} ({cols})
+        SELECT DISTINCT ON ({key_cols}) {cols} FROM load_stage
+        ORDER BY {key_cols}
+        ON CONFLICT ({key_cols}) DO UPDATE SET {", ".join(updates)}
+        WHERE ({current}) IS DISTINCT FROM ({excluded})
+    """
+
+
+def _upsert_chunk(
+    engine,
+    csv_file,
+    table_name,
+    delimiter,
+    drop_index,
+    header,
+    chunk_no,
+    chunk,
+    encoder=None,
+):
+    """Stage one chunk in an unlogged temp table and upsert it, recording
+    the chunk in the manifest in the same transaction.
+
+    Returns the number of rows read and the number inserted or updated.
+    """
+    start, end, lines, sha256 = chunk
+    reader = csv.reader(
+        _segment_lines(DATA_FOLDER / csv_file, start, end), delimiter=delimiter
+    )
+    stream = CsvCopyStream(
+        reader,
+        drop_index=drop_index,
+        label=f"{table_name} #{chunk_no}",
+        encoder=encoder,
+        header=header,
+    )
+
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                f"CREATE TEMP TABLE load_stage ON COMMIT DROP AS "
+                f"SELECT {_columns(header)} FROM {table_name} WITH NO DATA"
+            )
+            cur.copy_expert(
+                _copy_sql("load_stage", header), stream, size=COPY_READ_SIZE
+            )
+            cur.execute(_upsert_sql(table_name, header))
+            changed = cur.rowcount
+            cur.execute(
+                UPSERT_MANIFEST, (csv_file, chunk_no, sha256, start, end, lines)
+            )
+        finally:
+            cur.close()
+        conn.commit()
+    finally:
+        conn.close()
+    return stream.rows, changed
+
+
+def load_file_incremental(
+    engine,
+    csv_file,
+    table_name,
+    delimiter=",",
+    drop_index=False,
+    force=False,
+    encoder=None,
+):
+    """Load the chunks of a CSV file that changed since the last run.
+
+    Each chunk is fingerprinted and compared with load_manifest; changed or
+    new chunks are upserted on the table's natural key, one transaction per
+    chunk, so an interrupted run resumes where it stopped. Rows removed from
+    a file are not deleted from the table.
+
+    Returns the number of rows inserted or updated.
+    """
+    csv_path = DATA_FOLDER / csv_file
+    header, data_start = read_header(csv_path, delimiter)
+    if drop_index:
+        header = header[1:]
+    chunk_rows = MANIFEST_CHUNK_ROWS if csv_file in CHUNKED_FILES else None
+    chunks = fingerprint_chunks(csv_path, data_start, chunk_rows)
+
+    loaded = {}
+    if not force:
+        with engine.connect() as conn:
+            rows = conn.execute(text(LOADED_CHUNKS), {"file_name": csv_file})
+            loaded = {chunk_no: sha256 for chunk_no, sha256 in rows}
+    pending = [
+        (chunk_no, chunk)
+        for chunk_no, chunk in enumerate(chunks)
+        if loaded.get(chunk_no) != chunk[3]
+    ]
+    logger.info(f"{csv_file}: {len(pending)} of {len(chunks)} chunks new or changed")
+
+    started = time.monotonic()
+    read = changed = 0
+    for chunk_no, chunk in pending:
+        chunk_read, chunk_changed = _upsert_chunk(
+            engine,
+            csv_file,
+            table_name,
+            delimiter,
+            drop_index,
+            header,
+            chunk_no,
+            chunk,
+            encoder,
+        )
+        read += chunk_read
+        changed += chunk_changed
+
+    with engine.connect() as conn:
+        with conn.begin():
+            conn.execute(
+                text(TRIM_MANIFEST), {"file_name": csv_file, "chunks": len(chunks)}
+            )
+
+    if pending:
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"Upserted {changed} of {read} rows into {table_name} in {elapsed:.1f}s "
+            f"({read / elapsed if elapsed > 0 else 0:.0f} rows/s)"
+        )
+    return changed
+
+
+def record_manifest(engine, csv_file, delimiter=","):
+    """Record the fingerprints of a file loaded outside the incremental path."""
+    csv_path = DATA_FOLDER / csv_file
+    _, data_start = read_header(csv_path, delimiter)
+    chunk_rows = MANIFEST_CHUNK_ROWS if csv_file in CHUNKED_FILES else None
+    chunks = fingerprint_chunks(csv_path, data_start, chunk_rows)
+
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        try:
+            cur.execute("DELETE FROM load_manifest WHERE file_name = %s", (csv_file,))
+            for chunk_no, (start, end, lines, sha256) in enumerate(chunks):
+                cur.execute(
+                    UPSERT_MANIFEST, (csv_file, chunk_no, sha256, start, end, lines)
+                )
+        finally:
+            cur.close()
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def load_csv_files(force=False):
+    """Incremental load: only new or changed chunks of each file are upserted.
+
+    With ``force`` every chunk is upserted again, ignoring the manifest.
+    """
+    engine = create_connection()
+    changed_tables = set()
+
+    for csv_file, (table_name, delimiter, drop_index) in CSV_FILES.items():
+        csv_path = DATA_FOLDER / csv_file
+
+        if not csv_path.exists():
+            logger.warning(f"File {csv_path} not found, skipping...")
+            continue
+
+        logger.info(f"Loading {csv_file} into table {table_name}...")
+
+        try:
+            # CSV_FILES lists the lookups first, so they are up to date here
+            encoder = CodeEncoder(engine) if table_name == "trips" else None
+            if load_file_incremental(
+                engine,
+                csv_file,
+                table_name,
+                delimiter=delimiter,
+                drop_index=drop_index,
+                force=force,
+                encoder=encoder,
+            ):
+                changed_tables.add(table_name)
+        except Exception as e:
+            logger.error(f"Error loading {csv_file}: {str(e)}")
+
+    if not changed_tables:
+        logger.info("No changes detected, nothing to load")
+        return
+
+    with engine.connect() as conn:
+        with conn.begin():
+            if changed_tables & PROFILE_LOOKUPS:
+                # Lookup names are copied into every profile
+                conn.execute(text(RESET_PROFILE_WATERMARK))
+            # Signal API caches that the data changed
+            conn.execute(text(BUMP_DATA_VERSION))
+    if "trips" in changed_tables:
+        # Upserted rows are not all-visible until vacuumed: without this the
+        # profile queries fall back to heap fetches
+        _vacuum_analyze(engine, ["trips"])
+
+    logger.info(f"CSV loading completed! Changed tables: {', '.join(changed_tables)}")
+
+
+def _execute(engine, *statements):
+    with engine.connect() as conn:
+        with conn.begin():
+            for statement in statements:
+                conn.execute(text(statement))
+
+
+def _trips_index_ddl():
+    ddl = {
+        name: f'CREATE INDEX IF NOT EXISTS {name} ON trips("{column}")'
+        for name, column in TRIPS_INDEXES.items()
+    }
+    ddl[TRIPS_COVERING_INDEX] = (
+        f"CREATE INDEX IF NOT EXISTS {TRIPS_COVERING_INDEX} "
+        f'ON trips ("UserId") INCLUDE ({_columns(TRIPS_PROFILE_COLUMNS)})'
+    )
+    ddl[TRIPS_NATURAL_KEY_INDEX] = (
+        f"CREATE UNIQUE INDEX IF NOT EXISTS {TRIPS_NATURAL_KEY_INDEX} "
+        f'ON trips ({_columns(NATURAL_KEYS["trips"])}) NULLS NOT DISTINCT'
+    )
+    return ddl
+
+
+def _vacuum_analyze(engine, tables):
+    """VACUUM ANALYZE the tables: fresh statistics, and a visibility map that
+    lets the profile queries use index-only scans on trips."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for table in tables:
+            conn.execute(text(f"VACUUM ANALYZE {table}"))
+
+
+def trips_partitions(engine):
+    with engine.connect() as conn:
+        return list(conn.execute(text(TRIPS_PARTITIONS_QUERY)).scalars())
+
+
+def _partition_trips_ddl(current, partitions):
+    """Statements replacing the (empty) trips partitions with ``partitions``
+    hash partitions on UserId; none if the count already matches."""
+    if len(current) == partitions:
+        return []
+    ddl = [f"DROP TABLE {name}" for name in current]
+    ddl += [
+        f"CREATE TABLE trips_p{remainder} PARTITION OF trips "
+        f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+        for remainder in range(partitions)
+    ]
+    return ddl
+
+
+def _create_index(engine, name, ddl):
+    started = time.monotonic()
+    _execute(
+        engine, f"SET maintenance_work_mem = '{FAST_LOAD_MAINTENANCE_WORK_MEM}'", ddl
+    )
+    logger.info(f"Rebuilt {name} in {time.monotonic() - started:.1f}s")
+
+
+def _run_parallel(pool, fn, tasks):
+    """Run fn over tasks on the pool; re-raise the first failure."""
+    futures = [pool.submit(fn, *task) for task in tasks]
+    return [future.result() for future in as_completed(futures)]
+
+
+def fast_load_csv_files(workers=None, partitions=None):
+    """Full reload tuned for throughput.
+
+    The loaded tables (and user_profile, rebuilt from trips afterwards) are
+    truncated, the trips indexes are dropped, then the lookup tables and,
+    once their codes are known, byte ranges of trips.csv are COPYed in
+    parallel. Duplicate trips are removed and the indexes rebuilt in
+    parallel once the data has landed, then the tables are vacuumed and
+    analyzed and the load manifest recorded. trips is recreated with
+    ``partitions`` hash partitions when the count differs, which only a full
+    reload can do cheaply. With
+    FAST_LOAD_UNLOGGED the trips partitions are unlogged while loading and
+    written to the WAL in a single pass when switched back to logged.
+
+    Without trips.csv the lookups are upserted on ``code`` instead: a
+    TRUNCATE ... RESTART IDENTITY would renumber the ids trips refers to.
+    """
+    workers = workers or FAST_LOAD_WORKERS
+    partitions = partitions or TRIPS_PARTITIONS
+    # One connection more than the workers for CodeEncoder registrations
+    engine = create_connection(pool_size=workers + 1, max_overflow=0)
+    started = time.monotonic()
+
+    lookup_tasks = []
+    trips_tasks = []
+    files = []
+    for csv_file, (table_name, delimiter, drop_index) in CSV_FILES.items():
+        csv_path = DATA_FOLDER / csv_file
+        if not csv_path.exists():
+            logger.warning(f"File {csv_path} not found, skipping...")
+            continue
+        files.append((csv_file, delimiter))
+        if table_name == "trips":
+            for segment in split_csv(csv_path, workers):
+                trips_tasks.append(
+                    (engine, csv_path, table_name, delimiter, drop_index, segment)
+                )
+        else:
+            lookup_tasks.append((engine, csv_path, table_name, delimiter, drop_index))
+
+    tasks = lookup_tasks + trips_tasks
+    tables = list(dict.fromkeys(task[2] for task in tasks))
+    if not tables:
+        logger.warning("No CSV files found, nothing to load")
+        return
+    if "trips" not in tables:
+        logger.info("trips.csv not found: upserting the lookup tables instead")
+        load_csv_files(force=True)
+        return
+
+    truncate = tables + ["user_profile"]
+    prepare = [f"TRUNCATE {', '.join(truncate)} RESTART IDENTITY"]
+    current = trips_partitions(engine)
+    prepare += [f"DROP INDEX IF EXISTS {name}" for name in _trips_index_ddl()]
+    prepare += _partition_trips_ddl(current, partitions)
+    if len(current) != partitions:
+        logger.info(f"Repartitioning trips: {len(current)} -> {partitions} partitions")
+    trips_tables = (
+        current
+        if len(current) == partitions
+        else [f"trips_p{remainder}" for remainder in range(partitions)]
+    )
+    if FAST_LOAD_UNLOGGED:
+        # Partitioned tables have no storage: switch each partition
+        prepare += [f"ALTER TABLE {name} SET UNLOGGED" for name in trips_tables]
+    _execute(engine, *prepare)
+    logger.info(f"Truncated {', '.join(truncate)}; loading with {workers} workers...")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            rows = sum(_run_parallel(pool, copy_csv_to_table, lookup_tasks))
+            encoder = CodeEncoder(engine)
+            rows += sum(
+                _run_parallel(
+                    pool,
+                    copy_csv_to_table,
+                    [task + (encoder,) for task in trips_tasks],
+                )
+            )
+        finally:
+            # Restore durability and indexes even if a load failed
+            if FAST_LOAD_UNLOGGED:
+                _run_parallel(
+                    pool,
+                    _execute,
+                    [
+                        (engine, f"ALTER TABLE {name} SET LOGGED")
+                        for name in trips_tables
+                    ],
+                )
+            # The natural key is unique: drop exact duplicate rows first
+            _execute(engine, DEDUPLICATE_TRIPS)
+            _run_parallel(
+                pool,
+                _create_index,
+                [(engine, name, ddl) for name, ddl in _trips_index_ddl().items()],
+            )
+
+    _vacuum_analyze(engine, tables)
+    for csv_file, delimiter in files:
+        record_manifest(engine, csv_file, delimiter)
+    _execute(engine, BUMP_DATA_VERSION)
+
+    elapsed = time.monotonic() - started
+    logger.info(
+        f"Fast load completed: {rows} rows in {elapsed:.1f}s "
+        f"({rows / elapsed if elapsed > 0 else 0:.0f} rows/s)"
+    )
+
+
+def load_csv(fast=False, force=False, workers=None, partitions=None):
+    """Load the CSV files: incremental by default, a full reload with ``fast``.
+
+    ``force`` applies to the incremental load, ``workers`` and ``partitions``
+    to the fast one.
+    """
     try:
         logger.info("Starting CSV to PostgreSQL loading process...")
-        load_csv_files()
+        if fast:
+            fast_load_csv_files(workers=workers, partitions=partitions)
+        else:
+            load_csv_files(force=force)
     except Exception as e:
         logger.error(f"Failed to load CSV files: {str(e)}")
         raise
 
 
+def main():
+    parser = argparse.ArgumentParser(description="Load the CSV files into PostgreSQL.")
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        help="Full reload: truncate, parallel COPY, rebuild indexes, VACUUM ANALYZE.",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Parallel loads in --fast mode."
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Upsert every chunk again, ignoring the load manifest.",
+    )
+    parser.add_argument(
+        "--partitions",
+        type=int,
+        default=None,
+        help="Hash partitions of trips, recreated in --fast mode if different.",
+    )
+    args = parser.parse_args()
+    if args.partitions is not None and not args.fast:
+        parser.error("--partitions requires --fast")
+
+    load_csv(
+        fast=args.fast,
+        force=args.force,
+        workers=args.workers,
+        partitions=args.partitions,
+    )
+
+
 if __name__ == "__main__":
     main()
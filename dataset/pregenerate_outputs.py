@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import httpx
+import openai
+from loguru import logger
+from sqlalchemy import text
+
+from app.generation_service import (
+    IMAGE_MAX_BYTES,
+    IMAGE_PARAMS,
+    TEXT_SYSTEM_PROMPT,
+    image_generation_key,
+    text_generation_key,
+)
+from app.prompt_registry import prompt_registry
+from app.prompt_service import TRAVEL_DISTANCE_BUCKETS, TRAVEL_FREQUENCY_BUCKETS
+from dataset.load_csv_to_postgres import create_connection
+
+PREGEN_CONCURRENCY = int(os.getenv("PREGEN_CONCURRENCY", "4"))
+# Request budgets per minute; 429s are additionally retried with backoff
+# by the OpenAI client, honouring Retry-After
+PREGEN_TEXT_RPM = int(os.getenv("PREGEN_TEXT_RPM", "60"))
+PREGEN_IMAGE_RPM = int(os.getenv("PREGEN_IMAGE_RPM", "5"))
+PREGEN_MAX_RETRIES = int(os.getenv("PREGEN_MAX_RETRIES", "6"))
+
+
+def bucket_case(column, buckets):
+    """SQL CASE equivalent of app.prompt_service.bucket_label."""
+    whens = " ".join(
+        f"WHEN {column} > {threshold} THEN '{label}'"
+        for threshold, label in buckets
+        if threshold is not None
+    )
+    return f"CASE {whens} ELSE '{buckets[-1][1]}' END"
+
+
+# Distinct profile classes among the users materialized from trips. The
+# prompts only depend on these values, so each class is generated once.
+# Users with missing fields are skipped: their values come from the request.
+PROFILE_CLASSES = f"""
+    SELECT
+        year,
+        region,
+        travel_mode,
+        travel_motive,
+        {bucket_case("trip_count", TRAVEL_FREQUENCY_BUCKETS)} AS travel_frequency,
+        {bucket_case("km_travelled", TRAVEL_DISTANCE_BUCKETS)} AS travel_distance,
+        MIN(trip_count) AS trip_count,
+        MIN(km_travelled) AS km_travelled,
+        COUNT(*) AS users
+    FROM user_profile
+    WHERE year IS NOT NULL
+      AND region IS NOT NULL
+      AND travel_mode IS NOT NULL
+      AND travel_motive IS NOT NULL
+      AND trip_count IS NOT NULL
+      AND km_travelled IS NOT NULL
+    GROUP BY 1, 2, 3, 4, 5, 6
+    ORDER BY users DESC
+"""
+
+EXISTING_KEYS = """
+    SELECT cache_key FROM pregenerated_output
+    WHERE cache_key = ANY(CAST(:keys AS CHAR(64)[]))
+"""
+
+UPSERT_OUTPUT = """
+    INSERT INTO pregenerated_output (
+        cache_key, kind, model, profile_class, content, image
+    )
+    VALUES (
+        :cache_key, :kind, :model, CAST(:profile_class AS JSONB), :content, :image
+    )
+    ON CONFLICT (cache_key) DO UPDATE SET
+        profile_class = EXCLUDED.profile_class,
+        content = EXCLUDED.content,
+        image = EXCLUDED.image,
+        created_at = now()
+"""
+
+
+class RatePacer:
+    """Spaces request starts evenly to stay within a requests-per-minute budget."""
+
+    def __init__(self, rpm):
+        self.interval = 60.0 / rpm if rpm > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def fetch_profile_classes(engine, limit=None):
+    with engine.connect() as conn:
+        rows = conn.execute(text(PROFILE_CLASSES)).mappings().all()
+    classes = [dict(row) for row in rows]
+    return classes[:limit] if limit else classes
+
+
+def build_jobs(classes, images):
+    """Render every prompt once and compute the API cache key for it."""
+    jobs = []
+    for profile_class in classes:
+        data = {k: v for k, v in profile_class.items() if k != "users"}
+        prompt = prompt_registry.render("aggregate_text_prompt.j2", data)
+        model, cache_key = text_generation_key(prompt.text)
+        jobs.append(("text", model, cache_key, prompt.text, profile_class))
+        if images:
+            prompt = prompt_registry.render("aggregate_image_prompt.j2", data)
+            model, cache_key = image_generation_key(prompt.text)
+            jobs.append(("image", model, cache_key, prompt.text, profile_class))
+    return jobs
+
+
+def existing_keys(engine, keys):
+    if not keys:
+        return set()
+    with engine.connect() as conn:
+        rows = conn.execute(text(EXISTING_KEYS), {"keys": keys}).all()
+    return {row[0] for row in rows}
+
+
+def store_output(
+    engine, kind, model, cache_key, profile_class, content=None, image=None
+):
+    with engine.connect() as conn:
+        with conn.begin():
+            conn.execute(
+                text(UPSERT_OUTPUT),
+                {
+                    "cache_key": cache_key,
+                    "kind": kind,
+                    "model": model,
+                    "profile_class": json.dumps(profile_class, default=str),
+                    "content": content,
+                    "image": image,
+                },
+            )
+
+
+async def generate_outputs(engine, jobs, concurrency):
+    client = openai.AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"), max_retries=PREGEN_MAX_RETRIES
+    )
+    pacers = {
+        "text": RatePacer(PREGEN_TEXT_RPM),
+        "image": RatePacer(PREGEN_IMAGE_RPM),
+    }
+    semaphore = asyncio.Semaphore(concurrency)
+    counts = {"generated": 0, "failed": 0}
+
+    async with httpx.AsyncClient(timeout=60.0) as http_client:
+
+        async def run(kind, model, cache_key, prompt, profile_class):
+            async with semaphore:
+                await pacers[kind].wait()
+                try:
+                    if kind == "text":
+                        response = await client.chat.completions.create(
+                            model=model,
+                            messages=[
+                                {"role": "system", "content": TEXT_SYSTEM_PROMPT},
+                                {"role": "user", "content": prompt},
+                            ],
+                        )
+                        content = response.choices[0].message.content.strip()
+                        await asyncio.to_thread(
+                            store_output,
+                            engine,
+                            kind,
+                            model,
+                            cache_key,
+                            profile_class,
+                            content=content,
+                        )
+                    else:
+                        response = await client.images.generate(
+                            model=model, prompt=prompt, **IMAGE_PARAMS
+                        )
+                        image = await http_client.get(response.data[0].url)
+                        image.raise_for_status()
+                        if len(image.content) > IMAGE_MAX_BYTES:
+                            raise ValueError("Image exceeds IMAGE_MAX_BYTES")
+                        await asyncio.to_thread(
+                            store_output,
+                            engine,
+                            kind,
+                            model,
+                            cache_key,
+                            profile_class,
+                            image=image.content,
+                        )
+                    counts["generated"] += 1
+                except Exception as e:
+                    counts["failed"] += 1
+                    logger.error(
+                        f"Pre-generation failed ({kind}, {cache_key[:12]}): {e}"
+                    )
+
+        await asyncio.gather(*(run(*job) for job in jobs))
+
+    await client.close()
+    return counts
+
+
+def pregenerate_outputs(
+    engine, images=False, limit=None, force=False, concurrency=None
+):
+    """Generate text (and optionally images) for every profile class.
+
+    Classes whose output is already stored are skipped unless ``force`` is set.
+    Returns the number of outputs generated, failed and skipped.
+    """
+    classes = fetch_profile_classes(engine, limit)
+    jobs = build_jobs(classes, images)
+    done = set() if force else existing_keys(engine, [job[2] for job in jobs])
+    pending = [job for job in jobs if job[2] not in done]
+    logger.info(
+        f"{len(classes)} profile classes, {len(pending)} outputs to generate "
+        f"({len(jobs) - len(pending)} already stored)"
+    )
+
+    counts = asyncio.run(
+        generate_outputs(engine, pending, concurrency or PREGEN_CONCURRENCY)
+    )
+    counts["skipped"] = len(jobs) - len(pending)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pre-generate the API outputs for every distinct profile class."
+    )
+    parser.add_argument(
+        "--images", action="store_true", help="Also pre-generate images."
+    )
+    parser.add_argument(
+        "--limit", type=int, default=None, help="Only the N most common classes."
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Regenerate outputs already stored."
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=None, help="Concurrent requests."
+    )
+    args = parser.parse_args()
+
+    try:
+        logger.info("Pre-generating outputs for profile classes...")
+        counts = pregenerate_outputs(
+            create_connection(),
+            images=args.images,
+            limit=args.limit,
+            force=args.force,
+            concurrency=args.concurrency,
+        )
+        logger.info(
+            f"Pre-generation done: {counts['generated']} generated, "
+            f"{counts['failed']} failed, {counts['skipped']} skipped"
+        )
+        if counts["failed"]:
+            # Fail the task so a retry picks up the missing classes
+            raise RuntimeError(f"{counts['failed']} outputs could not be generated")
+    except Exception as e:
+        logger.error(f"Failed to pre-generate outputs: {str(e)}")
+        raise
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 
+from dataset.build_user_profile import refresh_user_profiles
 from dataset.init_database import main as init_db
-from dataset.load_csv_to_postgres import main as load_csv, create_connection
+from dataset.load_csv_to_postgres import load_csv, create_connection
 from loguru import logger
 from sqlalchemy import text
 
@@ -38,6 +39,9 @@ def main():
         logger.info("Step 2: Loading CSV data...")
         load_csv()
 
+        logger.info("Step 3: Building user profiles...")
+        refresh_user_profiles(create_connection())
+
         logger.info("Database setup completed successfully!")
 
     except Exception as e:
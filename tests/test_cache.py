@@ -0,0 +1,70 @@
+import pytest
+
+from app import cache as cache_module
+from app.cache import MISSING, TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_get_returns_missing_for_unknown_key():
+    cache = TTLCache(maxsize=2, ttl=10)
+    assert cache.get("a") is MISSING
+    assert cache.stats()["misses"] == 1
+
+
+def test_set_and_get_counts_hits():
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", {"user_id": 1})
+    assert cache.get("a") == {"user_id": 1}
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["hit_ratio"] == 1.0
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    clock[0] += 9
+    assert cache.get("a") == 1
+    clock[0] += 2
+    assert cache.get("a") is MISSING
+    assert cache.stats()["size"] == 0
+
+
+def test_negative_entries_use_their_own_ttl(clock):
+    cache = TTLCache(maxsize=2, ttl=100, negative_ttl=5)
+    cache.set("missing-user", None)
+    assert cache.get("missing-user") is None
+    clock[0] += 6
+    assert cache.get("missing-user") is MISSING
+
+
+def test_lru_eviction_keeps_recently_used_entries():
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_zero_maxsize_disables_the_cache():
+    cache = TTLCache(maxsize=0, ttl=10)
+    cache.set("a", 1)
+    assert cache.get("a") is MISSING
+
+
+def test_clear_drops_entries_and_counts_invalidation():
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.clear()
+    assert cache.get("a") is MISSING
+    assert cache.stats()["invalidations"] == 1
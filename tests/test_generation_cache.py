@@ -0,0 +1,74 @@
+import pytest
+
+from app import generation_cache as generation_cache_module
+from app.generation_cache import GenerationCache, make_cache_key
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return GenerationCache(str(tmp_path / "cache.sqlite3"), max_bytes=1000)
+
+
+def test_cache_key_depends_on_model_prompt_and_params():
+    key = make_cache_key("gpt", "prompt", {"size": "1024x1024", "n": 1})
+    assert key == make_cache_key("gpt", "prompt", {"n": 1, "size": "1024x1024"})
+    assert key != make_cache_key("gpt", "prompt ", {"n": 1, "size": "1024x1024"})
+    assert key != make_cache_key("other", "prompt", {"n": 1, "size": "1024x1024"})
+    assert len(key) == 64
+
+
+def test_set_and_get(cache):
+    assert cache.get("k") is None
+    cache.set("k", "text", "gpt", "valore")
+    assert cache.get("k") == "valore"
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+
+def test_expired_entries_are_removed(cache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(generation_cache_module.time, "time", lambda: now[0])
+    cache.set("k", "text", "gpt", "valore", ttl=10)
+    now[0] += 11
+    assert cache.get("k") is None
+    assert cache.stats()["size_bytes"] == 0
+    assert cache._total_bytes == 0
+
+
+def test_least_recently_used_entries_are_evicted(cache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(generation_cache_module.time, "time", lambda: now[0])
+    for key in ("a", "b", "c"):
+        now[0] += 1
+        cache.set(key, "text", "gpt", "x" * 300)
+    now[0] += 1
+    cache.get("a")
+    now[0] += 1
+    cache.set("d", "text", "gpt", "x" * 300)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("d") is not None
+    assert cache.stats()["size_bytes"] <= 900
+
+
+def test_running_total_tracks_replacements(cache):
+    cache.set("k", "text", "gpt", "x" * 100)
+    cache.set("k", "text", "gpt", "x" * 10)
+    assert cache._total_bytes == cache.stats()["size_bytes"] == 11
+
+
+def test_set_under_the_cap_does_not_scan_the_table(cache):
+    cache.set("a", "text", "gpt", "valore")
+    statements = []
+    cache._conn.set_trace_callback(statements.append)
+    cache.set("b", "text", "gpt", "valore")
+    assert not any("SUM(size)" in statement for statement in statements)
+
+
+def test_total_is_loaded_from_an_existing_file(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    GenerationCache(path, max_bytes=1000).set("k", "text", "gpt", "valore")
+    reopened = GenerationCache(path, max_bytes=1000)
+    assert reopened.get("k") == "valore"
+    assert reopened._total_bytes == len("k") + len("valore")
@@ -0,0 +1,48 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.http_client import OutboundHTTP
+
+
+@pytest.fixture
+def fake_network(monkeypatch):
+    async def handle(self, request):
+        if request.url.host == "down.example":
+            raise httpx.ConnectError("connessione rifiutata", request=request)
+        return httpx.Response(200, stream=httpx.ByteStream(b"x" * 10))
+
+    monkeypatch.setattr(httpx.AsyncHTTPTransport, "handle_async_request", handle)
+
+
+def test_in_flight_counts_until_the_body_is_closed(fake_network):
+    outbound = OutboundHTTP()
+
+    async def scenario():
+        async with outbound.client.stream("GET", "https://img.example/a") as response:
+            during = outbound.in_flight
+            body = await response.aread()
+        await outbound.aclose()
+        return during, body
+
+    during, body = asyncio.run(scenario())
+    assert body == b"x" * 10
+    assert during == 1
+    stats = outbound.stats()
+    assert stats["in_flight"] == 0
+    assert stats["peak_in_flight"] == 1
+    assert stats["responses"] == {"2xx": 1}
+
+
+def test_failed_requests_leave_the_in_flight_count(fake_network):
+    outbound = OutboundHTTP()
+
+    async def scenario():
+        with pytest.raises(httpx.ConnectError):
+            await outbound.client.get("https://down.example/")
+        await outbound.aclose()
+
+    asyncio.run(scenario())
+    assert outbound.stats()["in_flight"] == 0
+    assert outbound.stats()["requests"] == 1
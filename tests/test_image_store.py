@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+
+from app import generation_service
+from app.image_store import ImageStore, is_digest, sniff_image_type
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 32
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ImageStore(str(tmp_path / "images"))
+
+
+def leftovers(store):
+    return [name for name in os.listdir(store.root) if name.startswith(".tmp-")]
+
+
+def test_put_stores_by_content_hash(store):
+    digest = store.put(PNG)
+    assert digest == hashlib.sha256(PNG).hexdigest()
+    assert store.path_for(digest).endswith(f"{digest[:2]}/{digest[2:4]}/{digest}")
+    assert store.read(digest) == PNG
+    assert store.media_type(digest) == "image/png"
+
+
+def test_identical_images_are_stored_once(store):
+    store.put(PNG)
+    store.put(PNG)
+    assert store.stats()["stored"] == 1
+    assert store.stats()["deduplicated"] == 1
+
+
+def test_writer_hashes_chunks_incrementally(store):
+    with store.writer() as writer:
+        for offset in range(0, len(PNG), 7):
+            writer.write(PNG[offset : offset + 7])
+        digest = writer.commit()
+    assert digest == hashlib.sha256(PNG).hexdigest()
+    assert store.read(digest) == PNG
+    assert leftovers(store) == []
+
+
+def test_writer_without_commit_leaves_nothing_behind(store):
+    with pytest.raises(ValueError):
+        with store.writer() as writer:
+            writer.write(PNG)
+            raise ValueError("download interrotto")
+    assert leftovers(store) == []
+    assert store.stats()["stored"] == 0
+
+
+def test_digest_validation(store):
+    assert is_digest("a" * 64)
+    assert not is_digest("../../etc/passwd")
+    with pytest.raises(ValueError):
+        store.path_for("not-a-digest")
+
+
+def test_sniff_image_type():
+    assert sniff_image_type(PNG) == ("png", "image/png")
+    assert sniff_image_type(b"\xff\xd8\xff\xe0") == ("jpg", "image/jpeg")
+    assert sniff_image_type(b"RIFF0000WEBP") == ("webp", "image/webp")
+    assert sniff_image_type(b"boh") == ("bin", "application/octet-stream")
+
+
+class FakeResponse:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    async def aiter_bytes(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+class FakeClient:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def stream(self, method, url):
+        return FakeResponse(self.chunks)
+
+
+@pytest.fixture
+def download(monkeypatch):
+    def run(store, chunks):
+        fake = type("FakeOutbound", (), {"client": FakeClient(chunks)})()
+        monkeypatch.setattr(generation_service, "outbound_http", fake)
+
+        async def scenario():
+            with store.writer() as writer:
+                await generation_service._download_image("https://img", writer)
+                return writer.commit()
+
+        return asyncio.run(scenario())
+
+    return run
+
+
+def test_download_streams_into_the_store(store, download):
+    digest = download(store, [PNG[:10], PNG[10:]])
+    assert store.read(digest) == PNG
+
+
+def test_oversized_download_is_rejected(store, download, monkeypatch):
+    monkeypatch.setattr(generation_service, "IMAGE_MAX_BYTES", 16)
+    with pytest.raises(ValueError):
+        download(store, [PNG[:10], PNG[10:]])
+    assert leftovers(store) == []
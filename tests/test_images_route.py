@@ -0,0 +1,60 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.image_store import ImageStore
+from app.routes import images
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 32
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = ImageStore(str(tmp_path / "images"))
+    monkeypatch.setattr(images, "image_store", store)
+    return store
+
+
+@pytest.fixture
+def client(store):
+    app = FastAPI()
+    app.include_router(images.router)
+    return TestClient(app)
+
+
+def test_serves_stored_images_with_cache_headers(store, client):
+    digest = store.put(PNG)
+    response = client.get(f"/images/{digest}")
+    assert response.status_code == 200
+    assert response.content == PNG
+    assert response.headers["content-type"] == "image/png"
+    assert response.headers["etag"] == f'"{digest}"'
+    assert "immutable" in response.headers["cache-control"]
+
+
+def test_matching_etag_returns_not_modified(store, client):
+    digest = store.put(PNG)
+    headers = {"If-None-Match": f'"{digest}"'}
+    response = client.get(f"/images/{digest}", headers=headers)
+    assert response.status_code == 304
+
+
+def test_range_requests_are_supported(store, client):
+    digest = store.put(PNG)
+    response = client.get(f"/images/{digest}", headers={"Range": "bytes=0-7"})
+    assert response.status_code == 206
+    assert response.content == PNG[:8]
+
+
+@pytest.mark.parametrize("if_none_match", [None, '"{digest}"'])
+def test_unknown_digest_is_not_found(client, if_none_match):
+    digest = "a" * 64
+    headers = {}
+    if if_none_match:
+        headers["If-None-Match"] = if_none_match.format(digest=digest)
+    assert client.get(f"/images/{digest}", headers=headers).status_code == 404
+
+
+def test_malformed_digest_is_not_found(client):
+    response = client.get("/images/not-a-digest", headers={"If-None-Match": '"x"'})
+    assert response.status_code == 404
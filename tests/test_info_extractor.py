@@ -0,0 +1,127 @@
+import pytest
+
+from app.info_extractor import extract_fields
+
+LOOKUPS = {
+    "region": ["Groningen (PV)", "Friesland (PV)", "Noord-Holland (PV)"],
+    "travel_mode": [
+        "Passenger car (driver)",
+        "Passenger car (passenger)",
+        "Train",
+        "Bus/tram/metro",
+        "Bike",
+        "Walking",
+        "Other",
+    ],
+    "travel_motive": [
+        "Travel to/from work, (non)-daily commute",
+        "Services/care",
+        "Shopping, groceries, funshopping.",
+        "Attending education/courses",
+        "Visits including staying overnight",
+        "Leisure, sports",
+        "Touring/walking",
+        "Professionally",
+    ],
+}
+
+
+def extract(info, *fields):
+    return extract_fields(info, list(fields), LOOKUPS)
+
+
+@pytest.mark.parametrize(
+    "info, expected",
+    [
+        ("Ha viaggiato 10 volte", 10),
+        ("12 trips last year", 12),
+        ("viaggi: 7", 7),
+        ("1.500 viaggi", 1500),
+    ],
+)
+def test_trip_count(info, expected):
+    assert extract(info, "trip_count") == {"trip_count": expected}
+
+
+@pytest.mark.parametrize(
+    "info, expected",
+    [
+        ("500 km percorsi", 500),
+        ("1.500 chilometri", 1500),
+        ("12,5 km", 12),
+        ("km_travelled: 42", 42),
+    ],
+)
+def test_km_travelled(info, expected):
+    assert extract(info, "km_travelled") == {"km_travelled": expected}
+
+
+def test_conflicting_numbers_are_left_to_the_llm():
+    assert extract("10 volte, anzi 12 volte", "trip_count") == {}
+
+
+@pytest.mark.parametrize(
+    "info, expected",
+    [
+        ("nel 2021", "2021"),
+        ("dal 2018 al 2022", "2018-2022"),
+        ("between 2022 and 2019", "2019-2022"),
+        ("2018-2020", "2018-2020"),
+    ],
+)
+def test_year(info, expected):
+    assert extract(info, "year") == {"year": expected}
+
+
+def test_region_by_name():
+    assert extract("vivo a Groningen", "region") == {"region": "Groningen (PV)"}
+
+
+def test_two_regions_are_ambiguous():
+    assert extract("tra Groningen e Friesland", "region") == {}
+
+
+@pytest.mark.parametrize(
+    "info, expected",
+    [
+        ("in bici", "Bike"),
+        ("by train", "Train"),
+        ("in auto", "Passenger car (driver)"),
+        ("uso la metropolitana", "Bus/tram/metro"),
+    ],
+)
+def test_travel_mode_by_alias(info, expected):
+    assert extract(info, "travel_mode") == {"travel_mode": expected}
+
+
+def test_ambiguous_name_falls_back_to_aliases():
+    # "Passenger car" matches both driver and passenger by name
+    assert extract("passenger car to office", "travel_mode", "travel_motive") == {
+        "travel_mode": "Passenger car (passenger)",
+        "travel_motive": "Travel to/from work, (non)-daily commute",
+    }
+
+
+@pytest.mark.parametrize(
+    "info",
+    ["by train and by bike", "in treno o in bici", "passeggero in auto"],
+)
+def test_aliases_of_different_modes_are_ambiguous(info):
+    assert extract(info, "travel_mode") == {}
+
+
+def test_travel_motive_by_alias():
+    assert extract("in bicicletta per lavoro", "travel_mode", "travel_motive") == {
+        "travel_mode": "Bike",
+        "travel_motive": "Travel to/from work, (non)-daily commute",
+    }
+
+
+def test_aliases_of_different_motives_are_ambiguous():
+    assert extract("per lavoro e per fare la spesa", "travel_motive") == {}
+
+
+def test_only_missing_fields_are_extracted():
+    assert extract("10 volte per 500 km nel 2021", "km_travelled") == {
+        "km_travelled": 500
+    }
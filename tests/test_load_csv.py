@@ -0,0 +1,144 @@
+import csv
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from dataset import load_csv_to_postgres
+from dataset.load_csv_to_postgres import (
+    TRIPS_DIMENSIONS,
+    CodeEncoder,
+    CsvCopyStream,
+    _segment_lines,
+    fingerprint_chunks,
+    read_header,
+    split_csv,
+)
+
+ROWS = [f"{i},U{i % 7},2018JJ00,M{i % 3},.\n" for i in range(100)]
+
+
+@pytest.fixture
+def trips_csv(tmp_path):
+    path = tmp_path / "trips.csv"
+    path.write_text("\ufeffID,UserId,Periods,TravelMotives,Km\n" + "".join(ROWS))
+    return path
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'lookups.db'}")
+    with engine.begin() as conn:
+        for table in set(TRIPS_DIMENSIONS.values()):
+            conn.execute(
+                text(
+                    f"CREATE TABLE {table} "
+                    "(id INTEGER PRIMARY KEY, code TEXT UNIQUE, name TEXT)"
+                )
+            )
+        conn.execute(text("INSERT INTO travel_motives (code, name) VALUES ('M0', 'a')"))
+    return engine
+
+
+def test_read_header_strips_bom(trips_csv):
+    header, data_start = read_header(trips_csv)
+    assert header == ["ID", "UserId", "Periods", "TravelMotives", "Km"]
+    with open(trips_csv, "rb") as f:
+        f.seek(data_start)
+        assert f.readline().decode() == ROWS[0]
+
+
+def test_split_csv_covers_every_line_once(trips_csv):
+    segments = split_csv(trips_csv, 4)
+    assert len(segments) == 4
+    assert all(start < end for start, end in segments)
+    lines = [
+        line for segment in segments for line in _segment_lines(trips_csv, *segment)
+    ]
+    assert lines == ROWS
+
+
+def test_split_csv_more_parts_than_lines(tmp_path):
+    path = tmp_path / "small.csv"
+    path.write_text("a,b\n1,2\n")
+    assert len(split_csv(path, 8)) == 1
+
+
+def test_fingerprint_chunks(trips_csv):
+    _, data_start = read_header(trips_csv)
+    chunks = fingerprint_chunks(trips_csv, data_start, chunk_rows=30)
+    assert [lines for _, _, lines, _ in chunks] == [30, 30, 30, 10]
+    assert chunks[0][0] == data_start
+    assert chunks[-1][1] == trips_csv.stat().st_size
+    assert all(a[1] == b[0] for a, b in zip(chunks, chunks[1:]))
+
+    (whole,) = fingerprint_chunks(trips_csv, data_start)
+    assert whole[2] == 100
+
+    # Changing one line only changes the fingerprint of its chunk
+    trips_csv.write_text(
+        trips_csv.read_text().replace(ROWS[45], ROWS[45].replace("M0", "M9"))
+    )
+    changed = fingerprint_chunks(trips_csv, data_start, chunk_rows=30)
+    assert [a[3] == b[3] for a, b in zip(chunks, changed)] == [True, False, True, True]
+
+
+def test_fingerprint_chunks_empty_file(tmp_path):
+    path = tmp_path / "empty.csv"
+    path.write_text("a,b\n")
+    _, data_start = read_header(path)
+    assert [lines for _, _, lines, _ in fingerprint_chunks(path, data_start)] == [0]
+
+
+def test_code_encoder_registers_unknown_codes(engine):
+    encoder = CodeEncoder(engine)
+    known = encoder.encode("travel_motives", "M0")
+    new = encoder.encode("travel_motives", "M1")
+    assert new != known
+    assert encoder.encode("travel_motives", "M1") == new
+
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT code, name FROM travel_motives ORDER BY id"))
+        assert rows.fetchall() == [("M0", "a"), ("M1", None)]
+    # A new encoder reads the registered code back
+    assert CodeEncoder(engine).encode("travel_motives", "M1") == new
+
+
+def test_csv_copy_stream_transforms_and_encodes(engine, trips_csv):
+    encoder = CodeEncoder(engine)
+    header, _ = read_header(trips_csv)
+    with open(trips_csv, newline="") as f:
+        reader = csv.reader(f)
+        next(reader)
+        stream = CsvCopyStream(
+            reader,
+            drop_index=True,
+            chunk_rows=16,
+            encoder=encoder,
+            header=header[1:],
+        )
+        data = stream.read(64) + stream.read()
+
+    rows = list(csv.reader(data.splitlines()))
+    assert stream.rows == 100
+    motive = str(encoder.encode("travel_motives", "M1"))
+    assert rows[1] == ["U1", "2018", motive, "\\N"]
+
+
+def test_fast_load_without_trips_upserts_the_lookups(tmp_path, monkeypatch):
+    (tmp_path / "region.csv").write_text("code,name\nR1,North\n")
+    executed = []
+    upserts = []
+    monkeypatch.setattr(load_csv_to_postgres, "DATA_FOLDER", tmp_path)
+    monkeypatch.setattr(load_csv_to_postgres, "create_connection", lambda **_: None)
+    monkeypatch.setattr(
+        load_csv_to_postgres, "_execute", lambda _, *sql: executed.extend(sql)
+    )
+    monkeypatch.setattr(
+        load_csv_to_postgres, "load_csv_files", lambda force: upserts.append(force)
+    )
+
+    load_csv_to_postgres.fast_load_csv_files(workers=2)
+
+    # No TRUNCATE ... RESTART IDENTITY: the lookup ids stay stable
+    assert executed == []
+    assert upserts == [True]
@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import pytest
+from prometheus_client import REGISTRY
+
+from app.mlflow_spool import MlflowSpool
+from app.mlflow_utils import MlflowLogQueue
+
+
+def make_queue(tmp_path, policy, maxsize=2, block_timeout=0.05):
+    spool = MlflowSpool(
+        str(tmp_path / "spool"), segment_bytes=1024, max_bytes=4096, fsync=False
+    )
+    return MlflowLogQueue(
+        "test",
+        maxsize=maxsize,
+        policy=policy,
+        block_timeout=block_timeout,
+        batch_size=10,
+        spool=spool,
+        replay_interval=60,
+    )
+
+
+def record(n):
+    return {"route": "generate_text", "n": n}
+
+
+def queued(log_queue):
+    return [log_queue._queue.get_nowait()["n"] for _ in range(log_queue._queue.qsize())]
+
+
+def test_invalid_policy_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        make_queue(tmp_path, "drop_everything")
+
+
+def test_drop_newest_discards_the_incoming_record(tmp_path):
+    log_queue = make_queue(tmp_path, "drop_newest")
+    assert [log_queue.submit(record(n)) for n in range(3)] == [True, True, False]
+    assert queued(log_queue) == [0, 1]
+    assert log_queue.stats()["dropped"] == 1
+
+
+def test_drop_oldest_keeps_the_most_recent_records(tmp_path):
+    log_queue = make_queue(tmp_path, "drop_oldest")
+    assert all(log_queue.submit(record(n)) for n in range(3))
+    assert queued(log_queue) == [1, 2]
+    assert log_queue.stats()["dropped"] == 1
+
+
+def test_block_gives_up_after_the_timeout(tmp_path):
+    log_queue = make_queue(tmp_path, "block", maxsize=1, block_timeout=0.05)
+    assert log_queue.submit(record(0))
+    assert not log_queue.submit(record(1))
+    assert log_queue.stats()["dropped"] == 1
+
+
+def test_blocking_submit_does_not_stall_the_event_loop(tmp_path):
+    log_queue = make_queue(tmp_path, "block", maxsize=1, block_timeout=0.3)
+    log_queue.submit(record(0))
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        started = time.monotonic()
+        accepted = await log_queue.submit_async(record(1))
+        task.cancel()
+        return accepted, ticks, time.monotonic() - started
+
+    accepted, ticks, elapsed = asyncio.run(scenario())
+    assert not accepted
+    assert elapsed >= 0.3
+    assert ticks >= 10
+
+
+def test_queue_depth_and_drops_are_exported(tmp_path):
+    log_queue = make_queue(tmp_path, "drop_newest", maxsize=1)
+    dropped = REGISTRY.get_sample_value("mir_mlflow_records_dropped_total")
+    log_queue.submit(record(0))
+    log_queue.submit(record(1))
+    assert REGISTRY.get_sample_value("mir_mlflow_queue_depth") == 1
+    assert (
+        REGISTRY.get_sample_value("mir_mlflow_records_dropped_total") == dropped + 1
+    )
@@ -0,0 +1,102 @@
+import os
+
+import pytest
+
+from app import mlflow_spool as mlflow_spool_module
+from app.mlflow_spool import MlflowSpool, decode_record, encode_record
+
+
+def make_spool(tmp_path, **options):
+    settings = {"segment_bytes": 1024, "max_bytes": 1024 * 1024, "fsync": False}
+    settings.update(options)
+    return MlflowSpool(str(tmp_path), **settings)
+
+
+def record(n, image=None):
+    return {"route": "generate_text", "n": n, "image": image}
+
+
+def test_records_round_trip_with_images():
+    line = encode_record(record(1, image=b"\x89PNG data"))
+    assert decode_record(line) == record(1, image=b"\x89PNG data")
+
+
+def test_replay_uploads_in_order_and_removes_segments(tmp_path):
+    spool = make_spool(tmp_path, segment_bytes=200)
+    for n in range(10):
+        spool.append(record(n))
+    uploaded = []
+    assert spool.replay(lambda r: uploaded.append(r["n"])) == 10
+    assert uploaded == list(range(10))
+    assert not spool.has_pending()
+    assert spool._total_bytes == 0
+
+
+def test_failed_replay_resumes_after_the_last_uploaded_record(tmp_path):
+    spool = make_spool(tmp_path, checkpoint_records=100)
+    for n in range(5):
+        spool.append(record(n))
+
+    uploaded = []
+
+    def flaky_upload(r):
+        if r["n"] == 3:
+            raise ConnectionError("server down")
+        uploaded.append(r["n"])
+
+    with pytest.raises(ConnectionError):
+        spool.replay(flaky_upload)
+    spool.replay(lambda r: uploaded.append(r["n"]))
+    assert uploaded == [0, 1, 2, 3, 4]
+
+
+def test_offset_is_checkpointed_per_batch(tmp_path, monkeypatch):
+    spool = make_spool(tmp_path, checkpoint_records=3)
+    for n in range(7):
+        spool.append(record(n))
+    writes = []
+    original = MlflowSpool._write_offset
+
+    def write_offset(path, offset):
+        writes.append(offset)
+        original(path, offset)
+
+    monkeypatch.setattr(MlflowSpool, "_write_offset", staticmethod(write_offset))
+    spool.replay(lambda r: None)
+    assert len(writes) == 2
+
+
+def test_oldest_segments_are_dropped_above_max_bytes(tmp_path):
+    line_bytes = len(encode_record(record(0)))
+    spool = make_spool(tmp_path, segment_bytes=line_bytes, max_bytes=3 * line_bytes)
+    for n in range(6):
+        spool.append(record(n))
+    assert spool.stats()["size_bytes"] <= 3 * line_bytes
+    assert spool._total_bytes == spool.stats()["size_bytes"]
+    uploaded = []
+    spool.replay(lambda r: uploaded.append(r["n"]))
+    assert uploaded == [3, 4, 5]
+
+
+def test_appends_under_the_limit_do_not_list_the_directory(tmp_path, monkeypatch):
+    spool = make_spool(tmp_path)
+    spool.append(record(0))
+    listings = []
+    original = mlflow_spool_module.glob.glob
+    monkeypatch.setattr(
+        mlflow_spool_module.glob,
+        "glob",
+        lambda pattern: listings.append(pattern) or original(pattern),
+    )
+    for n in range(1, 20):
+        spool.append(record(n))
+    assert listings == []
+
+
+def test_existing_segments_count_towards_the_limit(tmp_path):
+    make_spool(tmp_path).append(record(0))
+    reopened = make_spool(tmp_path)
+    reopened.append(record(1))
+    assert reopened._total_bytes == sum(
+        os.path.getsize(tmp_path / name) for name in os.listdir(tmp_path)
+    )
@@ -0,0 +1,198 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from app import openai_scheduler as scheduler_module
+from app.openai_scheduler import (
+    BATCH,
+    INTERACTIVE,
+    ModelLimiter,
+    OpenAIRateLimited,
+    OpenAIScheduler,
+    TokenBucket,
+    image_priority,
+    request_priority,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler_module.time, "monotonic", clock)
+    return clock
+
+
+def rate_limit_error(retry_after="0"):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(
+        429, headers={"retry-after": retry_after}, request=request
+    )
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+def test_token_bucket_spends_and_refills(clock):
+    bucket = TokenBucket(60)
+    assert bucket.time_until(60) == 0
+    bucket.take(60)
+    assert bucket.time_until(1) == pytest.approx(1.0)
+    clock.now += 30
+    assert bucket.time_until(30) == 0
+    assert bucket.time_until(31) == pytest.approx(1.0)
+
+
+def test_token_bucket_zero_limit_is_disabled(clock):
+    bucket = TokenBucket(0)
+    bucket.take(1000)
+    assert bucket.time_until(1000) == 0
+
+
+def test_token_bucket_follows_openai_headers(clock):
+    bucket = TokenBucket(100)
+    bucket.observe(limit=200, remaining=10)
+    assert bucket.capacity == 200
+    assert bucket.level == 10
+
+
+def test_limiter_aimd(clock):
+    limiter = ModelLimiter("m", rpm=0, tpm=0, max_concurrency=8)
+    limiter.on_rate_limited(None)
+    assert limiter.concurrency == 4
+    limiter.on_rate_limited(None)
+    limiter.on_rate_limited(None)
+    limiter.on_rate_limited(None)
+    assert limiter.concurrency == 1
+
+    limiter.on_success({})
+    assert limiter.concurrency == 2
+    limiter.on_success({})
+    assert limiter.concurrency == 2.5
+
+    # Sotto il 10% della quota residua la concorrenza non cresce più
+    limiter.on_success(
+        {"x-ratelimit-limit-requests": "100", "x-ratelimit-remaining-requests": "5"}
+    )
+    assert limiter.concurrency == 2.5
+    assert limiter.stats()["rate_limited"] == 4
+
+
+def test_limiter_pauses_after_retry_after(clock):
+    limiter = ModelLimiter("m", rpm=0, tpm=0, max_concurrency=4)
+    limiter.on_rate_limited(5)
+    assert limiter.paused_until == clock.now + 5
+
+
+def test_limiter_serves_waiters_by_priority():
+    order = []
+
+    async def scenario():
+        limiter = ModelLimiter("m", rpm=0, tpm=0, max_concurrency=1)
+        await limiter.acquire(INTERACTIVE, 0)
+
+        async def waiter(priority, name):
+            await limiter.acquire(priority, 0)
+            order.append(name)
+            limiter.release()
+
+        tasks = [
+            asyncio.create_task(waiter(image_priority(), "image")),
+            asyncio.create_task(waiter(BATCH, "batch")),
+            asyncio.create_task(waiter(INTERACTIVE, "interactive")),
+        ]
+        await asyncio.sleep(0)
+        assert limiter.stats()["waiting"] == {
+            "image": 1,
+            "batch": 1,
+            "interactive": 1,
+        }
+        limiter.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    assert order == ["interactive", "batch", "image"]
+
+
+def test_image_priority_follows_request_class():
+    async def batch_image_priority():
+        request_priority.set(BATCH)
+        return image_priority()
+
+    interactive = image_priority()
+    batch = asyncio.run(batch_image_priority())
+    assert INTERACTIVE < BATCH < interactive < batch
+
+
+def test_call_retries_rate_limits():
+    scheduler = OpenAIScheduler(max_retries=2, backoff_base=0, backoff_max=0)
+    attempts = 0
+
+    async def fn():
+        nonlocal attempts
+        attempts += 1
+        if attempts < 3:
+            raise rate_limit_error()
+        return "ok"
+
+    assert asyncio.run(scheduler.call("m", fn)) == "ok"
+    limiter = scheduler.limiter("m")
+    assert limiter.in_flight == 0
+    assert limiter.rate_limited == 2
+    assert scheduler.stats()["retries"] == 2
+
+
+def test_call_raises_429_when_retries_are_exhausted():
+    scheduler = OpenAIScheduler(max_retries=0, backoff_base=0, backoff_max=0)
+
+    async def fn():
+        raise rate_limit_error("7")
+
+    with pytest.raises(OpenAIRateLimited) as excinfo:
+        asyncio.run(scheduler.call("m", fn))
+    assert excinfo.value.status_code == 429
+    assert excinfo.value.headers["Retry-After"] == "7"
+    assert scheduler.stats()["exhausted"] == 1
+
+
+def test_stream_holds_the_slot_until_the_block_exits():
+    scheduler = OpenAIScheduler(max_retries=0, backoff_base=0, backoff_max=0)
+    limiter = scheduler.limiter("m")
+
+    async def fn():
+        return "stream"
+
+    async def scenario():
+        async with scheduler.stream("m", fn) as response:
+            assert response == "stream"
+            assert limiter.in_flight == 1
+        assert limiter.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_stream_rate_limit_mid_stream_reaches_the_limiter():
+    scheduler = OpenAIScheduler(max_retries=0, backoff_base=0, backoff_max=0)
+    limiter = scheduler.limiter("m")
+    concurrency = limiter.concurrency
+
+    async def fn():
+        return "stream"
+
+    async def scenario():
+        async with scheduler.stream("m", fn):
+            raise rate_limit_error("3")
+
+    with pytest.raises(OpenAIRateLimited) as excinfo:
+        asyncio.run(scenario())
+    assert excinfo.value.headers["Retry-After"] == "3"
+    assert limiter.in_flight == 0
+    assert limiter.rate_limited == 1
+    assert limiter.concurrency == concurrency / 2
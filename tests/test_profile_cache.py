@@ -0,0 +1,65 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from app import database
+from app.cache import MISSING
+
+
+class FakeCursor:
+    def __init__(self, versions):
+        self.versions = versions
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, query, params=None, prepare=None):
+        pass
+
+    async def fetchone(self):
+        return (self.versions.pop(0),)
+
+
+class FakeConnection:
+    def __init__(self, versions):
+        self.versions = versions
+
+    def cursor(self, **kwargs):
+        return FakeCursor(self.versions)
+
+
+@pytest.fixture
+def data_versions(monkeypatch):
+    versions = []
+
+    @asynccontextmanager
+    async def fake_connection():
+        yield FakeConnection(versions)
+
+    monkeypatch.setattr(database, "get_database_connection", fake_connection)
+    monkeypatch.setattr(database, "PROFILE_CACHE_VERSION_CHECK_S", 0)
+    monkeypatch.setattr(database, "_data_version", None)
+    monkeypatch.setattr(database, "_data_version_checked_at", float("-inf"))
+    database.profile_cache.clear()
+    return versions
+
+
+def test_cache_survives_unchanged_data_version(data_versions):
+    data_versions.extend([1, 1])
+    asyncio.run(database.refresh_profile_cache_version())
+    database.profile_cache.set(7, {"user_id": 7})
+    asyncio.run(database.refresh_profile_cache_version())
+    assert database.profile_cache.get(7) == {"user_id": 7}
+
+
+def test_new_load_invalidates_the_cache(data_versions):
+    data_versions.extend([1, 2])
+    asyncio.run(database.refresh_profile_cache_version())
+    database.profile_cache.set(7, {"user_id": 7})
+    asyncio.run(database.refresh_profile_cache_version())
+    assert database.profile_cache.get(7) is MISSING
+    assert database.get_profile_cache_stats()["data_version"] == 2
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from app.models import Request
+from app.singleflight import SingleFlight, flight_key
+
+
+def test_identical_calls_share_one_execution():
+    flights = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "risultato"
+
+    async def scenario():
+        return await asyncio.gather(*(flights.do("k", work) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == ["risultato"] * 5
+    assert calls == 1
+    assert flights.stats() == {"in_flight": 0, "executed": 1, "coalesced": 4}
+
+
+def test_different_keys_run_separately():
+    flights = SingleFlight()
+
+    async def scenario():
+        return await asyncio.gather(
+            flights.do("a", lambda: asyncio.sleep(0, "a")),
+            flights.do("b", lambda: asyncio.sleep(0, "b")),
+        )
+
+    assert asyncio.run(scenario()) == ["a", "b"]
+    assert flights.stats()["executed"] == 2
+
+
+def test_exceptions_reach_every_waiter_and_are_not_cached():
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("errore")
+
+    async def scenario():
+        results = await asyncio.gather(
+            flights.do("k", fail), flights.do("k", fail), return_exceptions=True
+        )
+        again = await flights.do("k", lambda: asyncio.sleep(0, "ok"))
+        return results, again
+
+    results, again = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert again == "ok"
+
+
+def test_a_cancelled_caller_does_not_cancel_the_others():
+    flights = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.02)
+        return "risultato"
+
+    async def scenario():
+        first = asyncio.create_task(flights.do("k", work))
+        second = asyncio.create_task(flights.do("k", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(scenario()) == "risultato"
+
+
+def test_flight_key_distinguishes_info_and_cache_usage():
+    key = flight_key("text", Request(user_id="1", info="in bici"))
+    assert key == flight_key("text", Request(user_id="1", info="in bici"))
+    assert key != flight_key("image", Request(user_id="1", info="in bici"))
+    assert key != flight_key("text", Request(user_id="1", info="in auto"))
+    assert key != flight_key(
+        "text", Request(user_id="1", info="in bici", use_cache=False)
+    )